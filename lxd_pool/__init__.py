@@ -1,13 +1,56 @@
 """A library (and tool) for managing a pool of LXD containers.
 
-<TBD> A brief description...
+A pool keeps a number of LXD containers launched ahead of time, so
+handing one out is nearly instant.  Containers are reset to a clean
+snapshot once they are given back.
 
 See https://github.com/ericsnowcurrently/lxd-pool.
 
 Usage
 =========
 
-<TBD>
+From the command line::
+
+  $ lxd-pool create --image ubuntu:16.04 ci 10
+  $ lxd-pool run 200 ci "make test"
+
+As a library::
+
+  from lxd_pool import Pool, Store
+
+  pool = Pool.load('ci', store=Store())
+  with pool.checkout(timeout=60) as container:
+      pool.lxc.exec(container, 'make test')
 
 """
 __version__ = '0.0.1a1'
+
+
+# The public API is imported lazily, so "lxd-pool" (and anything else
+# that only needs a submodule) doesn't pay for all of it at startup.
+_LAZY = {
+        'Pool': 'pool',
+        'PoolError': 'pool',
+        'PoolTimeoutError': 'pool',
+        'UnknownContainerError': 'pool',
+        'UnknownPoolError': 'pool',
+        'Store': 'state',
+        }
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    try:
+        modname = _LAZY[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'
+                             .format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + modname, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
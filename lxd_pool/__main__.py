@@ -1,14 +1,27 @@
 import logging
+import os
+import signal
 import sys
+import threading
+import time
 
 from . import __version__
 from ._util import os as _os
 from ._util.cli import CLIArgs, Registry, Handler
+from ._util.logging import flush as flush_logs
+
+
+BACKEND_ENV = 'LXD_POOL_BACKEND'  # "cli" (the default) or "rest"
+LOG_FORMAT_ENV = 'LXD_POOL_LOG_FORMAT'  # "text" (the default) or "json"
 
 
 logger = logging.getLogger()
 
 
+# The rest of the package (along with asyncio, sqlite3, etc.) is
+# imported only once a command actually needs it, to keep startup fast.
+
+
 #######################################
 # sub-command handlers
 
@@ -23,103 +36,597 @@ def add_arg(*args, **kwargs):
     return lambda f: specs.insert_arg(f, *args, **kwargs) or f
 
 
+class Command:
+    """A ready-to-run sub-command, as returned by the handler factories."""
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+def _parse_size(size):
+    from .images import parse_size
+    return parse_size(size)
+
+
+def _parse_remote(spec):
+    from .remotes import parse
+    return parse(spec)
+
+
+def _parse_tenant(spec):
+    from .tenants import parse
+    return parse(spec)
+
+
+def _parse_probe(spec):
+    from .health import parse
+    parse(spec)  # Fail early if it's bad.
+    return spec
+
+
+def _parse_address(address):
+    host, _, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def _get_lxc(cliargs):
+    from .lxd import LXC
+    runner = cliargs.cmd_runner()
+    if runner is None and os.environ.get(BACKEND_ENV) == 'rest':
+        from .rest import RESTRunner
+        runner = RESTRunner()
+    return LXC(runner=runner, logger=logger)
+
+
+def _get_store(cliargs):
+    from .state import Store, MEMORY
+    # A dry run must not leave anything behind.
+    return Store(MEMORY if cliargs.dryrun else None)
+
+
+def _get_admission(args):
+    if not args.admission:
+        return None
+    from .resources import Admission
+    return Admission(reserve=args.reserve, maxload=args.maxload,
+                     logger=logger)
+
+
+def _get_limits(args, current=None):
+    limits = {key: value
+              for key, value in (('cpu', args.cpu), ('memory', args.memory))
+              if value is not None}
+    if not limits:
+        return None
+    return dict(current or {}, **limits)
+
+
+def _get_images(cliargs, store, maxbytes=None):
+    from .images import ImageCache
+    return ImageCache(store, lxc=_get_lxc(cliargs), maxbytes=maxbytes,
+                      logger=logger)
+
+
+def _load_pool(args, cliargs, **kwargs):
+    # If the daemon is running then it holds the pool.  (A dry run
+    # never goes through the daemon, which would make real changes.)
+    if not cliargs.dryrun:
+        from .daemon import RemotePool, connect
+        client = connect()
+        if client is not None:
+            logger.debug('using the daemon at {}'.format(client.address))
+            pool = RemotePool(args.pool, client, lxc=_get_lxc(cliargs))
+            if kwargs.get('reconcile'):
+                pool.reconcile()
+            return pool
+    from .pool import Pool
+    store = _get_store(cliargs)
+    return Pool.load(args.pool, lxc=_get_lxc(cliargs), store=store,
+                     images=_get_images(cliargs, store), logger=logger,
+                     **kwargs)
+
+
 # meta -----
 
 @set_handler('config', 'meta')
 def cmd_config(args, cliargs):
+    """Show or change the lxd-pool config."""
     raise NotImplementedError
 
 
 @set_handler('list', 'meta')
 def cmd_list(args, cliargs):
-    raise NotImplementedError
+    """List the known pools."""
+    return Command(_list, _get_store(cliargs))
+
+
+def _list(store):
+    counts = store.counts()
+    for pool in store.pools():
+        states = counts.get(pool.name, {})
+        print('{:20} size={} maxsize={} image={} members={} ({})'.format(
+            pool.name, pool.size, pool.maxsize, pool.image,
+            sum(states.values()), _format_counts(states)))
+
+
+def _format_counts(counts):
+    return ', '.join('{} {}'.format(count, state)
+                     for state, count in sorted(counts.items())) or 'empty'
 
 
 @set_handler('image-list', 'meta')
 def cmd_image_list(args, cliargs):
-    raise NotImplementedError
+    """List the cached images."""
+    return Command(_image_list, _get_store(cliargs))
+
+
+def _image_list(store):
+    for image in store.images():
+        _print_image(image)
+
+
+def _print_image(image):
+    lastused = '-'
+    if image.lastused is not None:
+        lastused = time.strftime('%Y-%m-%d %H:%M:%S',
+                                 time.localtime(image.lastused))
+    print('{:20} {:12} {:>12} used: {}  ({})'.format(
+        image.alias, image.fingerprint[:12], image.size, lastused,
+        image.source))
+
+
+@set_handler('serve', 'meta')
+@add_arg('--socket', dest='address')
+@add_arg('--replenish', action='store_true', default=True)
+@add_arg('--no-replenish', dest='replenish', action='store_false')
+@add_arg('--metrics-address', dest='metrics', metavar='[HOST:]PORT',
+         type=_parse_address,
+         help='also serve the metrics over HTTP (for Prometheus)')
+@add_arg('--admission', action='store_true', default=False,
+         help='only hand out (or launch) containers while the host has '
+              'the memory and CPU for them')
+@add_arg('--reserve', type=float, default=0.1,
+         help='(with --admission) the fraction of memory to keep free')
+@add_arg('--max-load', dest='maxload', type=float, default=1.0,
+         help='(with --admission) the most load per CPU')
+@add_arg('--health', action='store_true', default=True)
+@add_arg('--no-health', dest='health', action='store_false')
+@add_arg('--probe', dest='probes', action='append', metavar='NAME[=ARG]',
+         type=_parse_probe,
+         help='a health check for idle members: exec[=COMMAND], '
+              'dns[=HOST] or disk[=MINFREE] (may be repeated)')
+def cmd_serve(args, cliargs):
+    """Run the daemon that holds the pools for the other commands."""
+    from .daemon import Server
+    store = _get_store(cliargs)
+    server = Server(args.address, store=store, lxc=_get_lxc(cliargs),
+                    images=_get_images(cliargs, store),
+                    replenish=args.replenish, health=args.health,
+                    probes=args.probes, admission=_get_admission(args),
+                    metrics_address=args.metrics, logger=logger)
+    return Command(_serve, server)
+
+
+def _serve(server):
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+@set_handler('metrics', 'meta')
+def cmd_metrics(args, cliargs):
+    """Print the pool metrics, in the Prometheus text format."""
+    # Only the daemon lives long enough to have latencies to report.
+    # Otherwise there are just the member counts from the store.
+    from .daemon import connect
+    client = connect() if not cliargs.dryrun else None
+    if client is not None:
+        return Command(_metrics_remote, client)
+    return Command(_metrics_local, _get_store(cliargs))
+
+
+def _metrics_remote(client):
+    try:
+        sys.stdout.write(client.call('metrics'))
+    finally:
+        client.close()
+
+
+def _metrics_local(store):
+    from .metrics import Registry, collect
+    registry = Registry()
+    collect(registry, store=store)
+    sys.stdout.write(registry.render())
 
 
 # pool -----
 
 @set_handler('create', 'pool')
-@add_arg('--maxsize')
+@add_arg('--maxsize', type=int)
 @add_arg('--image')
+@add_arg('--remote', dest='remotes', action='append',
+         metavar='REMOTE[=CAPACITY]', type=_parse_remote,
+         help='an LXD remote to put members on (may be repeated)')
+@add_arg('--tenant', dest='tenants', action='append',
+         metavar='TENANT[=WEIGHT][:CAP]', type=_parse_tenant,
+         help='a tenant\'s share of the pool and the most containers it '
+              'may hold (may be repeated)')
+@add_arg('--cpu', type=int, help='limit each member to CPU cpus')
+@add_arg('--memory', type=_parse_size,
+         help='limit each member to MEMORY (e.g. 2G)')
 @add_arg('pool')
-@add_arg('size')
+@add_arg('size', type=int)
 def cmd_create(args, cliargs):
-    raise NotImplementedError
+    """Create a new pool."""
+    from .pool import Pool, PoolError
+    store = _get_store(cliargs)
+    if store.get_pool(args.pool) is not None:
+        raise PoolError('pool {!r} already exists'.format(args.pool))
+    pool = Pool(args.pool, args.size, maxsize=args.maxsize, image=args.image,
+                remotes=args.remotes, limits=_get_limits(args),
+                tenants=args.tenants,
+                lxc=_get_lxc(cliargs), store=store,
+                images=_get_images(cliargs, store), logger=logger)
+    return Command(pool.create)
 
 
 @set_handler('destroy', 'pool')
 @add_arg('pool')
 def cmd_destroy(args, cliargs):
+    """Delete the pool and its containers."""
     raise NotImplementedError
 
 
 @set_handler('update', 'pool')
-@add_arg('--maxsize')
+@add_arg('--maxsize', type=int)
 @add_arg('--image')
+@add_arg('--remote', dest='remotes', action='append',
+         metavar='REMOTE[=CAPACITY]', type=_parse_remote,
+         help='replaces the pool\'s remotes (may be repeated)')
+@add_arg('--tenant', dest='tenants', action='append',
+         metavar='TENANT[=WEIGHT][:CAP]', type=_parse_tenant,
+         help='replaces the pool\'s tenants (may be repeated)')
+@add_arg('--cpu', type=int, help='limit each member to CPU cpus')
+@add_arg('--memory', type=_parse_size,
+         help='limit each member to MEMORY (e.g. 2G)')
 @add_arg('pool')
-@add_arg('size')
+@add_arg('size', type=int)
 def cmd_update(args, cliargs):
-    raise NotImplementedError
+    """Change the size, image, remotes, tenants or limits of the pool."""
+    pool = _load_pool(args, cliargs)
+    return Command(_update, pool, size=args.size, maxsize=args.maxsize,
+                   image=args.image, remotes=args.remotes,
+                   limits=_get_limits(args, pool.limits),
+                   tenants=args.tenants)
+
+
+def _update(pool, **kwargs):
+    try:
+        pool.update(**kwargs)
+    finally:
+        pool.close()
 
 
 @set_handler('disable', 'pool')
 @add_arg('pool')
 def cmd_disable(args, cliargs):
+    """Stop handing out containers from the pool."""
     raise NotImplementedError
 
 
 @set_handler('enable', 'pool')
 @add_arg('pool')
 def cmd_enable(args, cliargs):
+    """Start handing out containers from the pool again."""
     raise NotImplementedError
 
 
 @set_handler('status', 'pool')
+@add_arg('--reconcile', action='store_true', default=False)
 @add_arg('pool')
 def cmd_status(args, cliargs):
-    raise NotImplementedError
+    """Show the state of the pool and its members."""
+    if args.reconcile:
+        # This is the only case where we have to ask LXD.
+        _load_pool(args, cliargs, reconcile=True)
+    return Command(_status, _get_store(cliargs), args.pool,
+                   queue=_get_queue(args, cliargs))
+
+
+def _get_queue(args, cliargs):
+    # Only the daemon has anyone waiting in line across processes.
+    if cliargs.dryrun:
+        return None
+    from .daemon import connect
+    client = connect()
+    if client is None:
+        return None
+    try:
+        return client.call('queue', pool=args.pool)
+    finally:
+        client.close()
+
+
+def _status(store, name, *, queue=None):
+    from .pool import PoolError
+    pool = store.get_pool(name)
+    if pool is None:
+        raise PoolError('unknown pool {!r}'.format(name))
+    print('pool:    {}'.format(pool.name))
+    print('image:   {}'.format(pool.image))
+    print('size:    {} (max {})'.format(pool.size, pool.maxsize))
+    if pool.limits:
+        print('limits:  {}'.format(', '.join(
+            '{}={}'.format(key, value)
+            for key, value in sorted(pool.limits.items()))))
+    print('members: {}'.format(_format_counts(store.counts(name))))
+    if pool.hits or pool.misses:
+        print('cache:   {} hits, {} misses ({:.0%} hit rate)'.format(
+            pool.hits, pool.misses, pool.hits / (pool.hits + pool.misses)))
+    if pool.tenants or queue:
+        _print_queue(pool.tenants or {}, queue)
+    members = store.members(name)
+    if pool.remotes:
+        from .remotes import split
+        print('remotes:')
+        for remote, capacity in sorted(pool.remotes.items()):
+            counts = {}
+            for member in members:
+                if split(member.name)[0] == remote:
+                    counts[member.state] = counts.get(member.state, 0) + 1
+            print('  {:22} capacity={} ({})'.format(
+                remote or '(default)',
+                '-' if capacity is None else capacity,
+                _format_counts(counts)))
+    for member in members:
+        lastreset = '-'
+        if member.lastreset is not None:
+            lastreset = time.strftime('%Y-%m-%d %H:%M:%S',
+                                      time.localtime(member.lastreset))
+        print('  {:24} {:10} reset: {}  lease: {}'.format(
+            member.name, member.state, lastreset, member.lease or '-'))
+        if member.note:
+            print('    ({})'.format(member.note))
+        if member.affinity:
+            print('    warm for: {}'.format(', '.join(member.affinity)))
+
+
+def _print_queue(tenants, queue):
+    print('tenants:' if queue is None else
+          'tenants: ({} waiting)'.format(sum(stats['waiting']
+                                             for stats in queue.values())))
+    for tenant in sorted(set(tenants) | set(queue or ())):
+        share = tenants.get(tenant) or {}
+        line = '  {:22} weight={:g} cap={}'.format(
+            tenant, share.get('weight', 1), _or_dash(share.get('cap')))
+        stats = (queue or {}).get(tenant)
+        if stats is not None:
+            line += ' waiting={} holding={} wait: {}'.format(
+                stats['waiting'], stats['held'], ' '.join(
+                    '{}={}'.format(pct, _format_seconds(stats[pct]))
+                    for pct in ('p50', 'p90', 'p99')))
+        print(line)
+
+
+def _or_dash(value):
+    return '-' if value is None else value
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return '{:.0f}ms'.format(seconds * 1000)
+    return '{:.1f}s'.format(seconds)
 
 
 @set_handler('reset', 'pool')
 @add_arg('pool')
 def cmd_reset(args, cliargs):
-    raise NotImplementedError
+    """Reset every idle container in the pool."""
+    pool = _load_pool(args, cliargs)
+    return Command(pool.reset)
+
+
+@set_handler('check', 'pool')
+@add_arg('--probe', dest='probes', action='append', metavar='NAME[=ARG]',
+         type=_parse_probe,
+         help='exec[=COMMAND], dns[=HOST] or disk[=MINFREE] (may be '
+              'repeated; default: exec)')
+@add_arg('--batch', type=int,
+         help='probe at most BATCH idle members (default: all of them)')
+@add_arg('pool')
+def cmd_check(args, cliargs):
+    """Probe the idle containers, quarantining any that are broken."""
+    pool = _load_pool(args, cliargs)
+    return Command(_check, pool, args.probes, batch=args.batch)
+
+
+def _check(pool, probes, *, batch=None):
+    from .health import RATE
+    broken = pool.check_health(probes, batch=batch, rate=RATE)
+    for container in broken:
+        print('quarantined {}'.format(container))
+    return 1 if broken else 0
 
 
 @set_handler('run', 'pool')
 @add_arg('num', type=int)
-@add_arg('--reset', action='store_false', default=True)
+@add_arg('--reset', action='store_true', default=True)
 @add_arg('--no-reset', dest='reset', action='store_false')
+@add_arg('--stream', action='store_true', default=True)
+@add_arg('--no-stream', dest='stream', action='store_false')
+@add_arg('--batch', type=int,
+         help='run up to BATCH commands per container (in one session)')
+@add_arg('--cache-key', dest='key',
+         help='prefer containers that last ran with this key, and keep '
+              'them warm for it (instead of resetting them)')
+@add_arg('--priority', type=int, default=0,
+         help='go ahead of lower priorities while the pool is exhausted')
+@add_arg('--tenant',
+         help='who the containers are for (for sharing the pool fairly)')
+@add_arg('--admission', action='store_true', default=False,
+         help='only run while the host has the memory and CPU to spare '
+              '(unless the daemon holds the pool)')
+@add_arg('--reserve', type=float, default=0.1,
+         help='(with --admission) the fraction of memory to keep free')
+@add_arg('--max-load', dest='maxload', type=float, default=1.0,
+         help='(with --admission) the most load per CPU')
 @add_arg('pool')
 @add_arg('command')
 def cmd_run(args, cliargs):
-    raise NotImplementedError
+    """Run the command in the pool, NUM times."""
+    pool = _load_pool(args, cliargs, admission=_get_admission(args))
+    return Command(_run, pool, args.command, args.num, reset=args.reset,
+                   stream=args.stream, batch=args.batch, key=args.key,
+                   priority=args.priority, tenant=args.tenant)
+
+
+def _run(pool, command, num, *, reset=True, stream=True, batch=None,
+         key=None, priority=0, tenant=None):
+    online = None
+    if stream:
+        lock = threading.Lock()
+        def online(index, container, line):
+            with lock:
+                sys.stdout.write('[{} {}] {}'.format(index, container, line))
+                if not line.endswith('\n'):
+                    sys.stdout.write('\n')
+                sys.stdout.flush()
+
+    from .run import run as run_pool
+    failed = 0
+    try:
+        for result in run_pool(pool, command, num, reset=reset,
+                               online=online, batch=batch, key=key,
+                               priority=priority, tenant=tenant):
+            if result.failed:
+                failed += 1
+            print('--- [{}] {} (exit {}) ---'.format(
+                result.index, result.container, result.returncode))
+            if result.output:
+                print(result.output)
+            sys.stdout.flush()
+    finally:
+        # Let the pending resets finish.
+        pool.close()
+    logger.info('{} of {} runs failed'.format(failed, num))
+    return 1 if failed else 0
+
+
+@set_handler('push', 'pool')
+@add_arg('-z', '--compress', action='store_true', default=False)
+@add_arg('-C', '--directory', dest='cwd', metavar='DIR',
+         help='(resolve SOURCE relative to this directory)')
+@add_arg('--container', dest='containers', action='append',
+         help='(default: every member of the pool)')
+@add_arg('pool')
+@add_arg('source')
+@add_arg('target')
+def cmd_push(args, cliargs):
+    """Copy a local directory tree into the pool's containers."""
+    containers = _get_containers(args, cliargs)
+    lxc = _get_lxc(cliargs)
+    return Command(lxc.push, containers, args.source, args.target,
+                   compress=args.compress, cwd=args.cwd)
+
+
+@set_handler('pull', 'pool')
+@add_arg('-z', '--compress', action='store_true', default=False)
+@add_arg('-C', '--directory', dest='cwd', metavar='DIR',
+         help='(resolve TARGET relative to this directory)')
+@add_arg('--container', dest='containers', action='append',
+         help='(default: every member of the pool)')
+@add_arg('pool')
+@add_arg('source')
+@add_arg('target')
+def cmd_pull(args, cliargs):
+    """Copy a directory tree out of the pool's containers."""
+    containers = _get_containers(args, cliargs)
+    return Command(_pull, _get_lxc(cliargs), containers, args.source,
+                   args.target, compress=args.compress, cwd=args.cwd)
+
+
+def _get_containers(args, cliargs):
+    if args.containers:
+        return args.containers
+    from .pool import PoolError, UnknownPoolError
+    store = _get_store(cliargs)
+    if store.get_pool(args.pool) is None:
+        raise UnknownPoolError(args.pool)
+    containers = [member.name for member in store.members(args.pool)]
+    if not containers:
+        raise PoolError('pool {!r} has no members'.format(args.pool))
+    return containers
+
+
+def _pull(lxc, containers, source, target, *, compress=False, cwd=None):
+    from concurrent.futures import ThreadPoolExecutor
+    from .pool import MAX_PARALLEL
+    if len(containers) == 1:
+        return lxc.pull(containers[0], source, target, compress=compress,
+                        cwd=cwd)
+    # Each container gets its own subdirectory.  The pulls run on
+    # worker threads, so they are given the directory (cwd) rather than
+    # relying on the process's working directory.
+    workers = min(len(containers), MAX_PARALLEL)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(lxc.pull, container, source,
+                                   os.path.join(target, container),
+                                   compress=compress, cwd=cwd)
+                   for container in containers]
+    for fut in futures:
+        fut.result()
 
 
 # image -----
 
 @set_handler('image-add', 'image')
 @add_arg('image')
-#@add_arg('')
+@add_arg('--alias')
+@add_arg('--cache-size', dest='cachesize', type=_parse_size)
 def cmd_image_add(args, cliargs):
-    raise NotImplementedError
+    """Copy the image into the local cache."""
+    store = _get_store(cliargs)
+    images = _get_images(cliargs, store, args.cachesize)
+    return Command(_image_add, images, args.image, args.alias)
+
+
+def _image_add(images, image, alias):
+    _print_image(images.add(image, alias))
 
 
 @set_handler('image-update', 'image')
 @add_arg('image')
-#@add_arg('')
+@add_arg('--cache-size', dest='cachesize', type=_parse_size)
 def cmd_image_update(args, cliargs):
-    raise NotImplementedError
+    """Pull the latest version of the cached image."""
+    store = _get_store(cliargs)
+    images = _get_images(cliargs, store, args.cachesize)
+    return Command(_image_update, images, args.image)
+
+
+def _image_update(images, alias):
+    _print_image(images.update(alias))
 
 
 @set_handler('image-remove', 'image')
 @add_arg('image')
 def cmd_image_remove(args, cliargs):
-    raise NotImplementedError
+    """Delete the image from the local cache."""
+    store = _get_store(cliargs)
+    return Command(_get_images(cliargs, store).remove, args.image)
 
 
 #######################################
@@ -127,7 +634,10 @@ def cmd_image_remove(args, cliargs):
 
 def main(handler, args, cliargs, *, showtb=False):
     global logger
-    logger = cliargs.logger('lxd-pool')
+    # In JSON mode (with -vv) every lxc call and pool operation is
+    # logged as a timing span.
+    logger = cliargs.logger('lxd-pool',
+                            json=os.environ.get(LOG_FORMAT_ENV) == 'json')
 
     #lambda args, **kw: _os.cmd(args, logger=logger, runner=cliargs.cmd_runner, **kw)
 
@@ -135,16 +645,24 @@ def main(handler, args, cliargs, *, showtb=False):
     try:
         # XXX Pass args and cliargs to cmd.run() instead?
         cmd = handler.factory(args, cliargs)
-        cmd.run()
+        return cmd.run()
     except Exception as e:
         logger.error(e)
         if showtb:
             raise
         #print('ERROR: {}'.format(e), file=sys.stderr)
         # XXX traceback.print_exc()
+        return 1
+    finally:
+        flush_logs(logger)
 
 
 def get_parser(prog, *, add_help=True):
+    """Return the top-level parser.
+
+    Only the command name is parsed here; everything after it is left
+    in "args" for the command's own parser (see get_handler()).
+    """
     import argparse
 
     # inspired by lxc --help
@@ -152,15 +670,10 @@ def get_parser(prog, *, add_help=True):
             ).format(prog)
     # More help added as we go below...
 
-    common = CLIArgs.parser(with_showtb=True)
-
-    subs = {}
     def add_sub(sub, width=12):
-        spec = specs[sub]
-        subs[sub] = Handler.from_spec(spec, prog, parents=[common])
         nonlocal usage
         usage += ('        {:%d}	{}\n' % width
-                  ).format(sub, spec.summary or '...')
+                  ).format(sub, specs[sub].summary or '...')
 
     usage += '\n"meta" commands:\n'
     for sub in sorted(specs.filter('meta')):
@@ -181,13 +694,22 @@ def get_parser(prog, *, add_help=True):
                                      add_help=add_help,
                                      )
     parser.add_argument('--version', action='version', version=__version__)
-    parser.set_defaults(command='list')
+    parser.add_argument('command', nargs='?', default='list',
+                        choices=sorted(specs), help=argparse.SUPPRESS)
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help=argparse.SUPPRESS)
+
+    return parser
 
-    subparsers = parser.add_subparsers(dest='command')
-    for sub in subs:
-        subparsers.add_parser(sub, add_help=False)
 
-    return parser, subs
+def get_handler(command, prog):
+    """Return the Handler for the command.
+
+    Building a command's parser isn't free, so we only do it for the
+    one that is actually run.
+    """
+    common = CLIArgs.parser(with_showtb=True)
+    return Handler.from_spec(specs[command], prog, parents=[common])
 
 
 def parse_args(argv=None):
@@ -196,13 +718,13 @@ def parse_args(argv=None):
     prog, argv = argv[0], argv[1:]
     prog = 'lxd-pool'
     add_help = bool(argv and argv[0] in ('-h', '--help'))
-    parser, subs = get_parser(prog, add_help=add_help)
+    parser = get_parser(prog, add_help=add_help)
 
-    args, remainder = parser.parse_known_args(argv)
-    command = 'list' if args.command is None else args.command
-    handler = subs[command]
+    # Common options (e.g. -v) may come before the command.
+    ns, common = parser.parse_known_args(argv)
+    handler = get_handler(ns.command, prog)
 
-    args = handler.parser.parse_args(remainder)
+    args = handler.parser.parse_args(common + ns.args)
     cliargs, showtb, args = CLIArgs.from_args(args)
 
     return handler, args, cliargs, showtb
@@ -60,9 +60,14 @@ class CLIArgs:
     def __init__(self, verbosity=VERBOSITY, dryrun=False):
         super().__init__(verbosity, dryrun)
 
-    def logger(self, name):
-        """Return a logger set to the proper verbosity."""
-        logger, _ = get_stdout_logger(name, verbosity=self.verbosity)
+    def logger(self, name, *, json=False):
+        """Return a logger set to the proper verbosity.
+
+        If 'json' is True then it writes JSON records (through a
+        queue), rather than plain text.
+        """
+        logger, _ = get_stdout_logger(name, verbosity=self.verbosity,
+                                      json=json)
         return logger
 
     def cmd_runner(self):
@@ -100,7 +105,7 @@ class HandlerSpec:
         self.args = args
         self.factory = factory
 
-    attrs = classonly(tuple(inspect.getargspec(__init__).args[1:]))
+    attrs = classonly(tuple(inspect.getfullargspec(__init__).args[1:]))
 
     def __repr__(self):
         args = ('{}={!r}'.format(name, getattr(self, name))
@@ -138,16 +143,23 @@ class Registry(Mapping):
     def __getitem__(self, name):
         return self._named[name]
 
-    def set_handler(self, factory, name, kind=None):
-        """Set the name and kind for the spec related to the given factory."""
+    def set_handler(self, factory, name, kind=None, summary=None):
+        """Set the name and kind for the spec related to the given factory.
+
+        If no summary is given then the first line of the factory's
+        docstring is used (if any).
+        """
         try:
             spec = self._by_factory[factory]
         except KeyError:
             spec = self._by_factory[factory] = HandlerSpec(factory)
         if spec.name is not None:
             raise TypeError('name already set ({})'.format(spec.name))
+        if summary is None and factory.__doc__:
+            summary = factory.__doc__.strip().splitlines()[0]
         spec.name = name
         spec.kind = kind
+        spec.summary = summary
         self._named[name] = spec
 
     def insert_arg(self, factory, arg, *args, **kwargs):
@@ -99,6 +99,14 @@ def as_namespace(attrs, *, factory=None, **kwargs):
     return as_namespace_decorator
 
 
+# The generated base classes (see FixedNamespace._subclass()), by
+# (base, attrs).  Records with the same attrs share one.
+_BASES = {}
+
+# The result of dir(), by FixedNamespace subclass.
+_DIRS = {}
+
+
 class FixedNamespace:
     """A "fixed" namespace is an object with a static set of attributes.
 
@@ -122,31 +130,71 @@ class FixedNamespace:
 
     @classonly
     def _subclass(cls, subcls, attrs):
-        attrscopy = tuple(attrs)
-
-        # We take a page from namedtuple's book here by exec'ing
-        # generated code to get __init__().  Note that the only part
-        # we don't control is that list of attrs, and those were proven
-        # safe by namedtuple().
-        ns = {'base': cls}
-        code = 'def __init__(self, {}):'.format(', '.join(attrscopy))
-        code += '\n    base.__init__(self)'
-        for attr in attrscopy:
-            code += '\n    object.__setattr__(self, {0!r}, {0})'.format(attr)
-        exec(code, ns, ns)
-
-        class SubBase(cls):
-            __slots__ = attrscopy
-            attrs = classonly(attrscopy)
-            __init__ = ns['__init__']
+        attrs = tuple(attrs)
+        try:
+            base = _BASES[(cls, attrs)]
+        except KeyError:
+            base = _BASES[(cls, attrs)] = cls._new_base(attrs)
 
         # Note that subcls goes first in the bases list so that its
         # methods take precedence during lookup.
-        return type(subcls.__name__, (subcls, SubBase), {
+        return type(subcls.__name__, (subcls, base), {
                 '__slots__': (),
                 '__doc__': subcls.__doc__,
+                '__module__': subcls.__module__,
+                '__qualname__': subcls.__qualname__,
                 })
 
+    @classonly
+    def _new_base(cls, attrs):
+        attrscopy = tuple(attrs)
+
+        class SubBase(cls):
+            __slots__ = attrscopy
+            attrs = classonly(attrscopy)
+
+        # We take a page from namedtuple's book here by exec'ing
+        # generated code to get __init__().  Note that the only part
+        # we don't control is that list of attrs, and those were proven
+        # safe by namedtuple().  Each attr is set through its slot's
+        # descriptor directly, which skips our __setattr__() (and the
+        # lookup that object.__setattr__() would do).
+        ns = {'_base_init': cls.__init__, '_new': object.__new__}
+        sets = []
+        for attr in attrs:
+            ns['_set_' + attr] = getattr(SubBase, attr).__set__
+            sets.append('    _set_{0}(self, {0})'.format(attr))
+        args = ', '.join(attrs)
+        lines = ['def __init__(self, {}):'.format(args)]
+        if cls.__init__ is not object.__init__:
+            lines.append('    _base_init(self)')
+        lines.extend(sets)
+        lines.append('    return None')
+        lines.append('def _make(cls, values):')
+        lines.append('    if cls.__init__ is not __init__'
+                     ' or cls.__new__ is not _new:')
+        lines.append('        return cls(*values)')
+        lines.append('    {}, = values'.format(args) if attrs else '    ()')
+        lines.append('    self = _new(cls)')
+        lines.extend(sets)
+        lines.append('    return self')
+        values = ''.join('self.{}, '.format(attr) for attr in attrs)
+        lines.append('def _values(self):')
+        lines.append('    return ({})'.format(values))
+        ns['_reprfmt'] = '{{}}({})'.format(
+                ', '.join('{}={{!r}}'.format(attr) for attr in attrs))
+        lines.append('def __repr__(self):')
+        lines.append('    return _reprfmt.format(type(self).__name__, {})'
+                     .format(values))
+        exec('\n'.join(lines), ns, ns)
+
+        SubBase.__init__ = ns['__init__']
+        SubBase.__repr__ = ns['__repr__']
+        SubBase._make = classmethod(ns['_make'])
+        SubBase._values = ns['_values']
+        SubBase._fields = attrscopy
+        return SubBase
+
     def __setattr__(self, name, value):
         # We raise AttributeError like the builtin property does.
         raise AttributeError('a fixed namespace is read-only')
@@ -156,15 +204,50 @@ class FixedNamespace:
         raise AttributeError('a fixed namespace is read-only')
 
     def __dir__(self):
-        attrs = type(self).attrs
-        return sorted(
-                set(super().__dir__() + attrs))
+        cls = type(self)
+        try:
+            return list(_DIRS[cls])
+        except KeyError:
+            names = _DIRS[cls] = tuple(sorted(
+                    set(super().__dir__()) | set(cls.attrs)))
+            return list(names)
 
     def __repr__(self):
-        attrs = ('{}={!r}'.format(name, getattr(self, name))
-                 for name in type(self).attrs)
-        return '{}({})'.format(type(self).__name__, ', '.join(attrs))
+        return '{}()'.format(type(self).__name__)
+
+    # These are replaced for each set of attrs (see _new_base()).
+
+    _fields = ()
+
+    def _values(self):
+        return ()
+
+    @classmethod
+    def _make(cls, values):
+        """Return a new namespace with the given values (in attr order).
+
+        As with namedtuple, the class (and its __init__()) isn't called,
+        unless a subclass defines its own __init__() or __new__().
+        """
+        if cls.__init__ is not FixedNamespace.__init__ or (
+                cls.__new__ is not object.__new__):
+            return cls(*values)
+        if tuple(values):
+            raise TypeError('expected 0 values')
+        return object.__new__(cls)
+
+    def _asdict(self):
+        """Return a new dict mapping each attr to its value, in order."""
+        return dict(zip(self._fields, self._values()))
+
+    def _replace(self, **changes):
+        """Return a new namespace with the given attrs changed."""
+        values = dict(zip(self._fields, self._values()))
+        values.update(changes)
+        if len(values) != len(self._fields):
+            unknown = sorted(set(changes) - set(self._fields))
+            raise ValueError('got unexpected attr names: {!r}'
+                             .format(unknown))
+        return self._make(values.values())
 
-    # XXX Add a _fields property for namedtuple compatibility?
-    # XXX Add [some] namedtuple methods, like _replace?
     # XXX Add an as_namedtuple() class-only method?
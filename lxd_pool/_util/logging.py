@@ -1,4 +1,7 @@
+from contextlib import contextmanager
+import json
 import logging
+import time
 
 
 LEVEL = logging.INFO  # 30
@@ -28,17 +31,123 @@ def get_stdout_handler(fmt=None, datefmt=None, verbosity=None):
     return handler
 
 
-def get_stdout_logger(name=None, *, force=False, **handlerkwargs):
+def get_json_handler(stream=None, *, verbosity=None):
+    """Return a handler that writes each record as a line of JSON.
+
+    The handler only puts records on a queue.  They are formatted and
+    written by a background thread (handler.listener, a QueueListener),
+    so logging doesn't block on I/O.  Call handler.listener.stop() to
+    flush any remaining records.
+    """
+    # These are imported here to keep them off the CLI's startup path.
+    import logging.handlers
+    import queue
+
+    class QueueHandler(logging.handlers.QueueHandler):
+        def prepare(self, record):
+            # Unlike QueueHandler, we leave the formatting to the
+            # listener (i.e. off the caller's thread).
+            return record
+
+    target = logging.StreamHandler(stream)
+    target.setFormatter(JSONFormatter())
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.listener = logging.handlers.QueueListener(records, target)
+
+    if verbosity is not None:
+        level = log_level(verbosity)
+        handler.setLevel(level)
+
+    handler.listener.start()
+    return handler
+
+
+def flush(logger):
+    """Write out any records still queued for the logger's handlers.
+
+    The background threads of any queue handlers (see
+    get_json_handler()) are stopped, which drains their queues, and
+    then started again, so the logger may still be used (and flushed
+    again) afterward.
+    """
+    for handler in logger.handlers:
+        listener = getattr(handler, 'listener', None)
+        if listener is not None:
+            listener.stop()
+            listener.start()
+
+
+def get_stdout_logger(name=None, *, force=False, json=False, **handlerkwargs):
     logger = logging.getLogger(name)
     if not force and len(logger.handlers) > 0:
         return logger, None
 
     #logger.propagate = False
 
-    handler = get_stdout_handler(**handlerkwargs)
+    if json:
+        handler = get_json_handler(**handlerkwargs)
+    else:
+        handler = get_stdout_handler(**handlerkwargs)
     logger.addHandler(handler)
 
     if not logger.isEnabledFor(handler.level):
         logger.setLevel(handler.level)
 
     return logger, handler
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON.
+
+    Any fields attached to the record (as "fields", e.g. by span())
+    are included.
+    """
+
+    def format(self, record):
+        data = {
+                'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'msg': record.getMessage(),
+                }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+@contextmanager
+def span(logger, name, **fields):
+    """Log how long the with block takes, at DEBUG level.
+
+    The record carries the given fields (e.g. pool and container) along
+    with "span" (the name), "duration" (in seconds) and "status" (0, or
+    the returncode or name of the exception that got raised).  The
+    fields dict is the target of the with statement, so more may be
+    added to it in the block.
+
+    If the logger isn't enabled for DEBUG then this does next to
+    nothing.
+    """
+    if logger is None or not logger.isEnabledFor(logging.DEBUG):
+        yield fields
+        return
+    start = time.perf_counter()
+    status = 0
+    try:
+        yield fields
+    except BaseException as exc:
+        status = getattr(exc, 'returncode', None) or type(exc).__name__
+        raise
+    finally:
+        log_span(logger, name, time.perf_counter() - start, status=status,
+                 **fields)
+
+
+def log_span(logger, name, duration, **fields):
+    """Log a span that was timed some other way (see span())."""
+    if logger is None or not logger.isEnabledFor(logging.DEBUG):
+        return
+    fields.update(span=name, duration=duration)
+    logger.debug('%s took %.6fs', name, duration, extra={'fields': fields})
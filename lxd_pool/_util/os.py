@@ -1,15 +1,20 @@
 from contextlib import contextmanager
-from distutils.spawn import find_executable
+from functools import lru_cache, partial
+import codecs
 import locale
 import logging
 import os
 import os.path
 import shlex
+import shutil
 import subprocess
+import time
+import warnings
 
 
 LOGGER = __name__ + '.cmd'
 ENCODING = locale.getpreferredencoding(do_setlocale=False)
+BUFSIZE = 64 * 1024
 
 
 _logger = logging.getLogger(LOGGER)
@@ -50,29 +55,255 @@ def cmd(args, *, logger=_logger, runner=None, parse=True, strip=True, **kwargs):
     through to the runner.  A "dry run" can be accomplished by providing
     a runner that doesn't actually run the command.
 
+    To run the command in some other directory, pass 'cwd' (as with
+    subprocess) rather than changing the process's working directory
+    (e.g. with pushd()), which every other thread would see too.
+
     """
     if runner is None:
         runner = subprocess.check_output
+    args = _prepare(args, logger, parse, kwargs)
+
+    rawout = runner(args, **kwargs)
+
+    output = rawout.decode(ENCODING)
+    return output.strip() if strip else output
+
+
+async def acmd(args, *, logger=_logger, runner=None, parse=True, strip=True,
+               limit=None, **kwargs):
+    """Run the given command asynchronously (the asyncio twin of cmd()).
+
+    The command is handled exactly as cmd() would, except that by
+    default it is run using asyncio.create_subprocess_exec().  If
+    'runner' is provided then it is used instead.  A coroutine function
+    is awaited while any other runner (e.g. dryrun) is called in the
+    event loop's default executor, so it does not block the loop.
+
+    If 'limit' is provided (e.g. an asyncio.Semaphore) then the command
+    is run while holding it, which caps how many run at once.
+    """
+    if runner is None:
+        runner = check_output_async
+    args = _prepare(args, logger, parse, kwargs)
+
+    if limit is None:
+        rawout = await _arun(runner, args, kwargs)
+    else:
+        async with limit:
+            rawout = await _arun(runner, args, kwargs)
+
+    output = rawout.decode(ENCODING)
+    return output.strip() if strip else output
+
+
+def cmd_stream(args, *, logger=_logger, runner=None, parse=True,
+               chunksize=None, errors='strict', **kwargs):
+    """Run the given command, yielding its output as it arrives.
+
+    The command is handled like cmd() would, but rather than buffering
+    all of the output, this is a generator of decoded text.  By default
+    it yields each line (with its line ending).  If 'chunksize' is
+    provided then it instead yields text as soon as it is read, at most
+    'chunksize' bytes of output at a time.  Decoding is incremental so
+    multi-byte characters that straddle reads are handled correctly.
+
+    The child process only gets ahead of the caller by the size of the
+    pipe's buffer, since it blocks once that is full; that is how the
+    caller applies backpressure.  If the caller stops early (i.e. closes
+    the generator) then the process is killed.  As with cmd(),
+    CalledProcessError is raised (at the end) if the command fails.
+
+    If 'runner' is provided then it is used instead of subprocess.Popen.
+    It may also be a cmd() runner (like dryrun), in which case its
+    output is yielded once it returns.
+    """
+    if runner is None:
+        runner = subprocess.Popen
+    args = _prepare(args, logger, parse, kwargs)
+    kwargs.setdefault('stdout', subprocess.PIPE)
+    decoder = codecs.getincrementaldecoder(ENCODING)(errors)
+
+    proc = runner(args, **kwargs)
+    if isinstance(proc, bytes):
+        # It's a check_output()-style runner.
+        chunks = [proc]
+        proc = None
+    else:
+        chunks = _read_chunks(proc.stdout, chunksize or BUFSIZE)
+
+    try:
+        pending = ''
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if chunksize is not None:
+                if text:
+                    yield text
+                continue
+            lines = (pending + text).splitlines(keepends=True)
+            # A trailing "\r" might be the start of "\r\n".
+            pending = lines.pop() if lines and not lines[-1].endswith(
+                    '\n') else ''
+            yield from lines
+        text = pending + decoder.decode(b'', final=True)
+        if text:
+            yield text
+    except BaseException:
+        if proc is not None:
+            proc.kill()
+        raise
+    finally:
+        if proc is not None:
+            proc.stdout.close()
+            returncode = proc.wait()
+    if proc is not None and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
+def cmd_pipe(source, sinks, *, logger=_logger, runner=None,
+             bufsize=BUFSIZE, cwd=None):
+    """Run the source command, feeding its output to each of the sinks.
+
+    The output is streamed, a chunk at a time, to all the sink commands
+    at once, so none of it is held in memory (or written to disk) for
+    long.  Each command's stderr goes to ours, so the output isn't
+    mixed with it.  If any of the commands fails then
+    CalledProcessError is raised (for the first one), once they are
+    all done.
+
+    If 'runner' is provided (a la subprocess.check_output()) then the
+    commands are still streamed if it has a 'popen' attribute (a la
+    subprocess.Popen), which is used to run them.  That is for runners
+    that can't stream themselves (e.g. rest.RESTRunner).  Otherwise
+    (e.g. a dry run) the runner is used instead and the source's output
+    is buffered and passed to each sink as its input.
+
+    All the commands are run in 'cwd', if provided.
+    """
+    source = _prepare(source, logger, True, {})
+    sinks = [_prepare(sink, logger, True, {}) for sink in sinks]
+    if runner is None or runner is subprocess.Popen:
+        popen = subprocess.Popen
+    else:
+        popen = getattr(runner, 'popen', None)
+    if popen is None:
+        data = runner(source, cwd=cwd)
+        for sink in sinks:
+            runner(sink, input=data, cwd=cwd)
+        return
+
+    src = popen(source, stdout=subprocess.PIPE, cwd=cwd)
+    procs = []
+    try:
+        for sink in sinks:
+            procs.append(popen(sink, stdin=subprocess.PIPE, cwd=cwd))
+        live = list(procs)
+        for chunk in _read_chunks(src.stdout, bufsize):
+            for proc in list(live):
+                try:
+                    proc.stdin.write(chunk)
+                    proc.stdin.flush()
+                except BrokenPipeError:
+                    # It quit early; its returncode will tell why.
+                    live.remove(proc)
+            if not live:
+                break
+    except BaseException:
+        for proc in [src] + procs:
+            proc.kill()
+        raise
+    finally:
+        src.stdout.close()
+        for proc in procs:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        for proc in [src] + procs:
+            proc.wait()
+    for args, proc in zip([source] + sinks, [src] + procs):
+        if proc.returncode != 0 and not (proc is src and not live):
+            raise subprocess.CalledProcessError(proc.returncode, args)
+
+
+def _read_chunks(stdout, size):
+    read = getattr(stdout, 'read1', stdout.read)
+    while True:
+        chunk = read(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _prepare(args, logger, parse, kwargs):
     kwargs.setdefault('stderr', subprocess.STDOUT)
 
+    raw = args
     if isinstance(args, str):
-        raw = args
         if parse:
             args = shlex.split(raw)
-            args[0] = find_executable(args[0])
+            args[0] = which(args[0])
         else:
             kwargs.setdefault('shell', True)
+
+    # We don't pay for formatting unless it will be logged.
+    if logger is not None and logger.isEnabledFor(logging.DEBUG):
+        if not isinstance(raw, str):
+            raw = ' '.join(shlex.quote(arg) if needs_quote(arg) else arg
+                           for arg in raw)
+        logger.debug('...running %r', raw)
+
+    return args
+
+
+# asyncio is imported lazily (it is relatively slow to import and the
+# CLI mostly doesn't need it).
+
+async def _arun(runner, args, kwargs):
+    import asyncio
+    if asyncio.iscoroutinefunction(runner):
+        return await runner(args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(runner, args, **kwargs))
+
+
+async def check_output_async(args, *, shell=False, **kwargs):
+    """The asyncio equivalent of subprocess.check_output()."""
+    import asyncio
+    kwargs.setdefault('stdout', subprocess.PIPE)
+    if shell:
+        proc = await asyncio.create_subprocess_shell(args, **kwargs)
     else:
-        raw = ' '.join(shlex.quote(arg) if needs_quote(arg) else arg
-                       for arg in args)
+        proc = await asyncio.create_subprocess_exec(*args, **kwargs)
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args, output)
+    return output
 
-    if logger is not None:
-        logger.debug('...running {!r}'.format(raw))
 
-    rawout = runner(args, **kwargs)
+def resolve(path, cwd=None):
+    """Return the path, relative to 'cwd' (if provided) rather than to
+    the process's working directory.
 
-    output = rawout.decode(ENCODING)
-    return output.strip() if strip else output
+    This is how to work relative to a directory without chdir (see
+    pushd()).  Absolute paths are returned as-is.
+    """
+    if cwd is None:
+        return path
+    return os.path.join(cwd, path)
+
+
+def which(name):
+    """Return the full path to the named executable (or None).
+
+    The result is cached for as long as $PATH doesn't change.
+    """
+    return _which(name, os.environ.get('PATH', os.defpath))
+
+
+@lru_cache(maxsize=None)
+def _which(name, path):
+    return shutil.which(name, path=path)
 
 
 def dryrun(*args, **kwargs):
@@ -80,16 +311,20 @@ def dryrun(*args, **kwargs):
     return b''
 
 
-def dummy_runner(output):
+def dummy_runner(output, *, delay=None):
     """Return a command runner that returns the given output.
 
-    A string is first encoded to the locale encoding.
+    A string is first encoded to the locale encoding.  If 'delay' is
+    provided then the runner sleeps that many seconds first, simulating
+    a command that takes time.
 
     The runners signature matches that of subprocess.check_output().
     """
     if isinstance(output, str):
         output = output.encode(ENCODING)
     def runner(*args, **kwargs):
+        if delay:
+            time.sleep(delay)
         return output
 
     return runner
@@ -101,7 +336,13 @@ def pushd(dirname):
     
     At the end of the with statement, it changes directory back to the
     original one.  The original directory is returned by __enter__().
+
+    This is deprecated: the working directory belongs to the whole
+    process, so it changes under every other thread too.  Instead, pass
+    'cwd' to cmd() (and friends) and use resolve() for file paths.
     """
+    warnings.warn('pushd() is not thread-safe; pass cwd (and use '
+                  'resolve()) instead', DeprecationWarning, stacklevel=3)
     dirname = os.path.abspath(dirname)
     original = os.getcwd()
     if dirname == original:
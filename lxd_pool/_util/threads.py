@@ -0,0 +1,66 @@
+import logging
+import threading
+
+
+_logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """A background thread that calls tick() every 'interval' seconds.
+
+    Subclasses implement tick() and may override _failed(), which logs
+    whatever tick() raised.  A failed tick doesn't stop the thread.
+    The thread is started by start() (or by entering the worker as a
+    context manager) and stopped by stop(), which waits for the
+    current tick to finish.
+    """
+
+    def __init__(self, interval, *, name=None, logger=_logger):
+        self.interval = interval
+        self.logger = logger
+
+        self._name = name or type(self).__name__
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '{}(interval={!r})'.format(type(self).__name__, self.interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start ticking in the background."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self._name,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop ticking (once the current tick is done)."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def tick(self):
+        """Do the periodic work now."""
+        raise NotImplementedError
+
+    # internal methods
+
+    def _failed(self, exc):
+        self.logger.error('{} failed ({})'.format(self._name, exc))
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as exc:
+                self._failed(exc)
@@ -0,0 +1,579 @@
+"""A resident daemon that owns the pools, and a client for it.
+
+"lxd-pool serve" runs a Server, which keeps each pool (and its
+connection to LXD) loaded in memory and answers requests for it over
+a local unix socket.  The other lxd-pool commands use a Client (see
+connect()) when the daemon is running and fall back to doing the work
+in-process when it isn't.
+
+The protocol is one JSON object per line, in each direction.  A
+request looks like {"op": "acquire", "args": {"pool": "ci"}} and the
+response is either {"result": ...} or {"error": "...", "kind": "..."},
+where "kind" is the name of the exception class.  A connection may be
+used for any number of requests, one at a time.  Containers acquired
+over a connection that are still held when it closes (e.g. its client
+died) are released and reset.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import os
+import os.path
+import socket
+import socketserver
+import threading
+
+from . import __version__
+from . import health as _health
+from . import metrics as _metrics
+from . import tenants as _tenants
+from .lxd import LXC
+from .pool import (Pool, PoolError, PoolTimeoutError, UnknownContainerError,
+                   UnknownPoolError, default_lease)
+from .remotes import Monitor
+from .replenish import Replenisher
+from .state import default_path as default_state_path
+
+
+ENV = 'LXD_POOL_SOCKET'
+SOCKET_NAME = 'lxd-pool.sock'
+
+# The errors that are raised as-is on the client side.
+ERRORS = {cls.__name__: cls for cls in (
+        PoolError,
+        PoolTimeoutError,
+        UnknownContainerError,
+        UnknownPoolError,
+        )}
+
+
+_logger = logging.getLogger(__name__)
+
+
+def default_address():
+    """Return the path to the daemon's socket.
+
+    $LXD_POOL_SOCKET takes precedence, followed by $XDG_RUNTIME_DIR.
+    Otherwise the socket sits next to the state file.
+    """
+    path = os.environ.get(ENV)
+    if path:
+        return path
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir:
+        return os.path.join(rundir, SOCKET_NAME)
+    return os.path.join(os.path.dirname(default_state_path()), SOCKET_NAME)
+
+
+class DaemonError(Exception):
+    """The daemon failed to handle a request."""
+
+
+def connect(address=None):
+    """Return a Client for the daemon, or None if it isn't running."""
+    client = Client(address)
+    try:
+        client.call('ping')
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    return client
+
+
+#######################################
+# the server
+
+class Server:
+    """The daemon: serves requests for pools, which it keeps in memory.
+
+    Pools are loaded (see Pool.load()) the first time they are asked
+    for and kept from then on, so they are only ever looked up in LXD
+    once.  Each connection is handled in its own thread, so a client
+    blocked in acquire() doesn't hold up anyone else.
+
+    If 'replenish' is True then each loaded pool gets a Replenisher,
+    which resizes it (between size and maxsize) to fit the demand.
+    Each pool also gets a remotes.Monitor, which drains any of its
+    remotes that are unreachable or overloaded.  Unless 'health' is
+    False, each also gets a health.Checker, which quarantines idle
+    members that fail any of the 'probes' (see the health module).
+    If an 'admission' (see the resources module) is provided then it
+    is shared by all the pools, so together they don't overcommit the
+    host.
+
+    The pools' metrics (see the metrics module) are answered by the
+    "metrics" op.  If 'metrics_address' (a (host, port) tuple) is
+    provided then they are also served over HTTP there, for Prometheus
+    to scrape.
+    """
+
+    def __init__(self, address=None, *, store=None, lxc=None, images=None,
+                 replenish=False, health=True, probes=None, admission=None,
+                 metrics_address=None, logger=_logger):
+        if address is None:
+            address = default_address()
+        if lxc is None:
+            lxc = LXC()
+        self.address = address
+        self.store = store
+        self.lxc = lxc
+        self.images = images
+        self.replenish = replenish
+        self.health = health
+        self.probes = _health.resolve(probes)
+        self.admission = admission
+        self.metrics = lxc.metrics
+        self.metrics_address = metrics_address
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._loading = {}  # pool name -> lock held while it loads
+        self._held = {}  # (pool, container) -> its connection
+        self._workers = []
+        self._server = None
+        self._httpserver = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def bind(self):
+        """Start listening on the socket.
+
+        A socket left behind by a daemon that is gone is replaced.  If
+        another daemon is already listening then DaemonError is raised.
+        """
+        if self._server is not None:
+            return
+        if os.path.exists(self.address):
+            client = connect(self.address)
+            if client is not None:
+                client.close()
+                raise DaemonError('already running at {}'
+                                  .format(self.address))
+            os.unlink(self.address)
+        os.makedirs(os.path.dirname(os.path.abspath(self.address)),
+                    exist_ok=True)
+        server = _UnixServer(self.address, _RequestHandler)
+        os.chmod(self.address, 0o600)
+        server.owner = self
+        self._server = server
+        self.metrics.add_collector(self._collect)
+        if self.metrics_address is not None:
+            self._httpserver = _metrics.serve(self.metrics,
+                                              self.metrics_address)
+            self.logger.info('serving metrics at http://{}:{}/metrics'
+                             .format(*self._httpserver.server_address[:2]))
+
+    def serve_forever(self):
+        """Handle requests until shutdown() is called."""
+        self.bind()
+        self.logger.info('serving at {}'.format(self.address))
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Stop serve_forever() (from another thread)."""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        """Stop listening and wait for the pools' pending resets."""
+        server, self._server = self._server, None
+        if server is not None:
+            server.server_close()
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+            self.metrics.remove_collector(self._collect)
+        httpserver, self._httpserver = self._httpserver, None
+        if httpserver is not None:
+            httpserver.shutdown()
+            httpserver.server_close()
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+        for pool in pools:
+            pool.close()
+
+    def get_pool(self, name):
+        """Return the (loaded) pool."""
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is not None:
+                return pool
+            loading = self._loading.get(name)
+            if loading is None:
+                loading = self._loading[name] = threading.Lock()
+        # Loading may take a while (it looks in LXD), so only requests
+        # for this pool wait for it.
+        with loading:
+            with self._lock:
+                pool = self._pools.get(name)
+            if pool is not None:
+                return pool
+            pool = Pool.load(name, lxc=self.lxc, store=self.store,
+                             images=self.images, admission=self.admission,
+                             logger=self.logger)
+            workers = [Monitor(pool, logger=self.logger)]
+            if self.health:
+                workers.append(_health.Checker(pool, probes=self.probes,
+                                               logger=self.logger))
+            if self.replenish:
+                workers.append(Replenisher(pool, logger=self.logger))
+            for worker in workers:
+                worker.start()
+            with self._lock:
+                self._pools[name] = pool
+                self._workers.extend(workers)
+                del self._loading[name]
+        return pool
+
+    def handle(self, request, *, conn=None):
+        """Return the response (a dict) to the request (a dict).
+
+        'conn' identifies the connection that the request came over.
+        The containers acquired over it are tracked, for disconnect().
+        """
+        try:
+            op = request['op']
+            handle = getattr(self, '_op_' + op, None)
+            if handle is None:
+                raise DaemonError('unsupported op {!r}'.format(op))
+            args = request.get('args') or {}
+            result = handle(**args)
+            if op == 'acquire' and result is not None and conn is not None:
+                with self._lock:
+                    self._held[(args['pool'], result)] = conn
+            return {'result': result}
+        except Exception as exc:
+            if not isinstance(exc, (PoolError, DaemonError)):
+                self.logger.exception('request {!r} failed'.format(request))
+            return {'error': str(exc), 'kind': type(exc).__name__}
+
+    def disconnect(self, conn):
+        """Release the containers still held over the (closed)
+        connection.
+
+        They are reset, since they were left in whatever state their
+        holder (which is presumably gone) got them to.
+        """
+        with self._lock:
+            held = [key for key, owner in self._held.items()
+                    if owner is conn]
+            for key in held:
+                del self._held[key]
+            pools = {name: self._pools.get(name) for name, _ in held}
+        for name, container in held:
+            pool = pools[name]
+            if pool is None:
+                # We are closing.
+                continue
+            self.logger.warning('releasing {} (its client went away)'
+                                .format(container))
+            try:
+                pool.release(container, reset=True)
+            except PoolError as exc:
+                self.logger.warning('could not release {} ({})'
+                                    .format(container, exc))
+
+    # the ops
+
+    def _op_ping(self):
+        return {'version': __version__, 'pid': os.getpid()}
+
+    def _op_info(self, pool):
+        pool = self.get_pool(pool)
+        return {
+                'name': pool.name,
+                'size': pool.size,
+                'maxsize': pool.maxsize,
+                'target': pool.target,
+                'image': pool.image,
+                'remotes': pool.remotes,
+                'limits': pool.limits,
+                'tenants': pool.tenants,
+                'drained': pool.drained,
+                'idle': pool.idle,
+                'busy': pool.busy,
+                'resetting': pool.resetting,
+                'broken': pool.broken,
+                'waiting': pool.waiting,
+                'hits': pool.hits,
+                'misses': pool.misses,
+                }
+
+    def _op_acquire(self, pool, *, timeout=None, block=True, lease=None,
+                    key=None, priority=_tenants.PRIORITY, tenant=None):
+        return self.get_pool(pool).acquire(timeout=timeout, block=block,
+                                           lease=lease, key=key,
+                                           priority=priority, tenant=tenant)
+
+    def _op_release(self, pool, container, *, reset=False, key=None):
+        # Whichever connection it is released over (each of a client's
+        # threads has its own), it is no longer held.  That has to
+        # happen first, before someone else may acquire it.
+        with self._lock:
+            self._held.pop((pool, container), None)
+        self.get_pool(pool).release(container, reset=reset, key=key)
+
+    def _op_reset(self, pool):
+        self.get_pool(pool).reset()
+
+    def _op_update(self, pool, *, size=None, maxsize=None, image=None,
+                   remotes=None, limits=None, tenants=None):
+        self.get_pool(pool).update(size=size, maxsize=maxsize, image=image,
+                                   remotes=remotes, limits=limits,
+                                   tenants=tenants)
+
+    def _op_queue(self, pool):
+        return self.get_pool(pool).queue()
+
+    def _op_drain(self, pool, remote):
+        self.get_pool(pool).drain(remote)
+
+    def _op_undrain(self, pool, remote):
+        self.get_pool(pool).undrain(remote)
+
+    def _op_reconcile(self, pool):
+        self.get_pool(pool).reconcile()
+
+    def _op_check(self, pool, *, probes=None, batch=_health.BATCH,
+                  rate=_health.RATE):
+        # The probes (if any) are given as specs.
+        if probes is None:
+            probes = self.probes
+        return self.get_pool(pool).check_health(probes, batch=batch,
+                                                rate=rate)
+
+    def _op_metrics(self):
+        return self.metrics.render()
+
+    # internal methods
+
+    def _collect(self, registry):
+        with self._lock:
+            pools = list(self._pools.values())
+        _metrics.collect(registry, pools=pools, store=self.store)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+    owner = None
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        owner = self.server.owner
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    response = {'error': 'bad request {!r}'
+                                         .format(line[:200]),
+                                'kind': DaemonError.__name__}
+                else:
+                    response = owner.handle(request, conn=self)
+                self.wfile.write(json.dumps(response).encode('utf-8')
+                                 + b'\n')
+                self.wfile.flush()
+        finally:
+            owner.disconnect(self)
+
+
+#######################################
+# the client
+
+class Client:
+    """A client for the daemon.
+
+    Like rest.Client, each thread gets its own connection (kept open
+    between requests), so a thread blocked waiting on the daemon
+    doesn't hold up the others.
+    """
+
+    def __init__(self, address=None):
+        if address is None:
+            address = default_address()
+        self.address = address
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.address)
+
+    def close(self):
+        """Close every connection."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for sock, file in conns:
+            file.close()
+            sock.close()
+
+    def call(self, op, **args):
+        """Send the request and return the result.
+
+        If the daemon reports a pool error then the matching exception
+        is raised.  Any other failure raises DaemonError.
+        """
+        request = json.dumps({'op': op, 'args': args}).encode('utf-8')
+        _, file = self._connection()
+        file.write(request + b'\n')
+        file.flush()
+        line = file.readline()
+        if not line:
+            self._drop()
+            raise DaemonError('connection closed by the daemon')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            cls = ERRORS.get(response.get('kind'), DaemonError)
+            raise cls(response['error'])
+        return response.get('result')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+            conn = self._local.conn = (sock, sock.makefile('rwb'))
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _drop(self):
+        conn, self._local.conn = self._local.conn, None
+        with self._lock:
+            self._conns.remove(conn)
+        conn[1].close()
+        conn[0].close()
+
+
+class RemotePool:
+    """A pool held by the daemon, with (most of) the Pool API.
+
+    Containers are handed out and taken back by the daemon, while
+    commands are run in them directly (using 'lxc'), so a RemotePool
+    may be used in place of a Pool with run.run().
+    """
+
+    def __init__(self, name, client, *, lxc=None):
+        if lxc is None:
+            lxc = LXC()
+        info = client.call('info', pool=name)
+        self.name = name
+        self.size = info['size']
+        self.maxsize = info['maxsize']
+        self.image = info['image']
+        self.remotes = info['remotes']
+        self.limits = info['limits']
+        self.tenants = info['tenants']
+        self.client = client
+        self.lxc = lxc
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.name,
+                                       self.client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def info(self):
+        """Return the pool's current counts (idle, busy, etc.)."""
+        return self.client.call('info', pool=self.name)
+
+    def queue(self):
+        """See Pool.queue()."""
+        return self.client.call('queue', pool=self.name)
+
+    def acquire(self, *, timeout=None, block=True, lease=None, key=None,
+                priority=_tenants.PRIORITY, tenant=None):
+        """See Pool.acquire()."""
+        if lease is None:
+            lease = default_lease()
+        return self.client.call('acquire', pool=self.name, timeout=timeout,
+                                block=block, lease=lease, key=key,
+                                priority=priority, tenant=tenant)
+
+    def release(self, container, *, reset=False, key=None):
+        """See Pool.release()."""
+        self.client.call('release', pool=self.name, container=container,
+                         reset=reset, key=key)
+
+    @contextmanager
+    def checkout(self, *, timeout=None, reset=True, lease=None, key=None,
+                 priority=_tenants.PRIORITY, tenant=None):
+        """See Pool.checkout()."""
+        container = self.acquire(timeout=timeout, lease=lease, key=key,
+                                 priority=priority, tenant=tenant)
+        try:
+            yield container
+        finally:
+            self.release(container, reset=reset, key=key)
+
+    def reset(self):
+        """See Pool.reset()."""
+        self.client.call('reset', pool=self.name)
+
+    def update(self, *, size=None, maxsize=None, image=None, remotes=None,
+               limits=None, tenants=None):
+        """See Pool.update()."""
+        self.client.call('update', pool=self.name, size=size,
+                         maxsize=maxsize, image=image, remotes=remotes,
+                         limits=limits, tenants=tenants)
+        info = self.info()
+        self.size = info['size']
+        self.maxsize = info['maxsize']
+        self.image = info['image']
+        self.remotes = info['remotes']
+        self.limits = info['limits']
+        self.tenants = info['tenants']
+
+    def drain(self, remote):
+        """See Pool.drain()."""
+        self.client.call('drain', pool=self.name, remote=remote)
+
+    def undrain(self, remote):
+        """See Pool.undrain()."""
+        self.client.call('undrain', pool=self.name, remote=remote)
+
+    def reconcile(self):
+        """See Pool.reconcile()."""
+        self.client.call('reconcile', pool=self.name)
+
+    def check_health(self, probes=None, *, batch=_health.BATCH,
+                     rate=_health.RATE):
+        """See Pool.check_health().
+
+        The probes must be given as specs (e.g. "disk=1G"), if at all.
+        By default the daemon's are used.
+        """
+        return self.client.call('check', pool=self.name, probes=probes,
+                                batch=batch, rate=rate)
+
+    def close(self):
+        """Close the connections to the daemon.
+
+        The pool itself (including any pending resets) is left to the
+        daemon.
+        """
+        self.client.close()
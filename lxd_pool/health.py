@@ -0,0 +1,169 @@
+"""Checking that idle pool members actually work.
+
+A member whose network never came up (or whose disk filled up) would
+waste whatever job it gets handed to.  So idle members are probed now
+and then (see Pool.check_health() and Checker) and any that fail are
+quarantined: taken out of rotation, marked "broken" (along with what
+went wrong) and replaced.
+
+A probe is a callable that takes the LXC and a container name and
+returns what is wrong with the container, or None if nothing is.  It
+may also just raise CalledProcessError.  The probes here are made
+from specs like "exec", "dns=archive.ubuntu.com" or "disk=1G" (see
+parse()).
+"""
+import logging
+import subprocess
+
+from ._util.threads import PeriodicWorker
+
+
+INTERVAL = 30.0  # seconds
+BATCH = 10  # idle members probed per check
+RATE = 5.0  # probes per second, at most
+QUARANTINE = 3  # broken members kept around (per pool) to look at
+
+DNS_HOST = 'archive.ubuntu.com'
+MINFREE = 100 * 1024 ** 2  # bytes
+DEFAULT_PROBES = ('exec',)
+
+
+_logger = logging.getLogger(__name__)
+
+
+class ExecProbe:
+    """Run a command (by default "true") in the container."""
+
+    name = 'exec'
+
+    def __init__(self, command=('true',)):
+        self.command = command
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.command)
+
+    def __call__(self, lxc, container):
+        lxc.exec(container, self.command if isinstance(self.command, str)
+                 else list(self.command))
+        return None
+
+
+class DNSProbe:
+    """Look up a host name from inside the container."""
+
+    name = 'dns'
+
+    def __init__(self, host=DNS_HOST):
+        self.host = host
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.host)
+
+    def __call__(self, lxc, container):
+        lxc.exec(container, ['getent', 'hosts', self.host])
+        return None
+
+
+class DiskProbe:
+    """Make sure the container has some free disk space left."""
+
+    name = 'disk'
+
+    def __init__(self, minfree=MINFREE, path='/'):
+        self.minfree = minfree
+        self.path = path
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.minfree,
+                                       self.path)
+
+    def __call__(self, lxc, container):
+        output = lxc.exec(container, ['df', '-Pk', self.path])
+        try:
+            free = int(output.splitlines()[-1].split()[3]) * 1024
+        except (IndexError, ValueError):
+            return 'disk: could not parse {!r}'.format(output)
+        if free < self.minfree:
+            return 'disk: only {} bytes free on {}'.format(free, self.path)
+        return None
+
+
+PROBES = {cls.name: cls for cls in (ExecProbe, DNSProbe, DiskProbe)}
+
+
+def parse(spec):
+    """Return the probe for "NAME[=ARG]".
+
+    The arg is the command for "exec", the host name for "dns" and the
+    minimum free space (e.g. "1G") for "disk".
+    """
+    name, sep, arg = spec.partition('=')
+    try:
+        cls = PROBES[name]
+    except KeyError:
+        raise ValueError('unsupported probe {!r} (expected one of {})'
+                         .format(name, ', '.join(sorted(PROBES))))
+    if not sep:
+        return cls()
+    if cls is DiskProbe:
+        from .images import parse_size
+        arg = parse_size(arg)
+    return cls(arg)
+
+
+def resolve(probes=None):
+    """Return the list of probes for the given probes and/or specs."""
+    if probes is None:
+        probes = DEFAULT_PROBES
+    return [parse(probe) if isinstance(probe, str) else probe
+            for probe in probes]
+
+
+def run(probe, lxc, container):
+    """Return what the probe found wrong with the container (or None)."""
+    name = getattr(probe, 'name', None) or getattr(probe, '__name__', 'probe')
+    try:
+        return probe(lxc, container)
+    except subprocess.CalledProcessError as exc:
+        output = exc.output or b''
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        lines = output.strip().splitlines()
+        return '{}: {}'.format(name, lines[-1] if lines
+                               else 'exit {}'.format(exc.returncode))
+    except OSError as exc:
+        return '{}: {}'.format(name, exc)
+
+
+class Checker(PeriodicWorker):
+    """A background thread that keeps an eye on a pool's idle members.
+
+    Every 'interval' seconds the pool is asked to probe a batch of its
+    idle members (see Pool.check_health()), no more than 'rate' probes
+    per second, so even a big pool doesn't swamp LXD.  Over enough
+    checks every idle member gets its turn.
+    """
+
+    def __init__(self, pool, *, probes=None, interval=INTERVAL, batch=BATCH,
+                 rate=RATE, logger=_logger):
+        super().__init__(interval, name='health-{}'.format(pool.name),
+                         logger=logger)
+        self.pool = pool
+        self.probes = resolve(probes)
+        self.batch = batch
+        self.rate = rate
+
+    def __repr__(self):
+        return '{}({!r}, interval={!r})'.format(
+                type(self).__name__, self.pool, self.interval)
+
+    def tick(self):
+        """Check a batch of members now.  The quarantined are returned."""
+        return self.pool.check_health(self.probes, batch=self.batch,
+                                      rate=self.rate)
+
+    # internal methods
+
+    def _failed(self, exc):
+        self.logger.error('could not check the health of pool {!r} ({})'
+                          .format(self.pool.name, exc))
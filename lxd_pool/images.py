@@ -0,0 +1,244 @@
+"""Keeping the images that pools use in the local image store."""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import re
+import subprocess
+
+from .lxd import LXC
+from .pool import SOURCE_KEY
+
+
+NEXT_SUFFIX = '.lxd-pool-next'
+
+SIZE_UNITS = {
+        '': 1,
+        'K': 1024,
+        'M': 1024 ** 2,
+        'G': 1024 ** 3,
+        'T': 1024 ** 4,
+        }
+
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_size(size):
+    """Return the number of bytes for the size (e.g. "300M" or "2G")."""
+    if isinstance(size, int):
+        return size
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', size, re.I)
+    if not match:
+        raise ValueError('bad size {!r}'.format(size))
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def default_alias(source):
+    """Return the local alias to use for the (remote) image."""
+    remote, _, name = source.rpartition(':')
+    if not name:
+        name = 'default'
+    return '-'.join(part for part in (remote, name) if part)
+
+
+class ImageCache:
+    """The images pulled (ahead of time) into the local image store.
+
+    Each cached image has a local alias and is recorded in the store,
+    along with its fingerprint, size and when it was last used.  Pools
+    launch from the recorded fingerprint (see resolve()), so they never
+    have to wait on a remote image server, and an update only takes
+    effect for them once the new image is fully in place.  Images are
+    only ever refreshed by update(), never behind our back by LXD, so
+    the recorded fingerprints stay accurate.  The image an update
+    replaces is kept until no container uses it anymore (see prune()).
+
+    If 'maxbytes' is set then the least recently used images are
+    evicted once the cache grows past it.  Images that some pool uses
+    are never evicted.
+    """
+
+    def __init__(self, store, *, lxc=None, maxbytes=None, logger=_logger):
+        if lxc is None:
+            lxc = LXC()
+        self.store = store
+        self.lxc = lxc
+        self.maxbytes = maxbytes
+        self.logger = logger
+
+    def __repr__(self):
+        return '{}({!r}, maxbytes={!r})'.format(
+                type(self).__name__, self.store, self.maxbytes)
+
+    def add(self, source, alias=None):
+        """Copy the image into the local store (under the alias).
+
+        The ImageRecord is returned.
+        """
+        if alias is None:
+            alias = default_alias(source)
+        if self.store.get_image(alias) is not None:
+            raise KeyError('image {!r} already cached'.format(alias))
+        self.logger.info('copying {} to local:{}'.format(source, alias))
+        self.lxc.image_copy(source, alias=alias)
+        info = self._info(alias)
+        self.store.set_image(alias, source, info['fingerprint'],
+                             info.get('size') or 0)
+        self.evict()
+        return self.store.get_image(alias)
+
+    def update(self, alias, *, wait=True):
+        """Pull the latest version of the image and switch the alias to it.
+
+        The new version is copied in under a temporary alias, so the
+        old one keeps serving until the switch.  The old one is deleted
+        once it is no longer used (see prune()).  If 'wait' is False
+        then the update happens in the background and a Future is
+        returned.
+        """
+        if not wait:
+            executor = ThreadPoolExecutor(max_workers=1)
+            try:
+                return executor.submit(self.update, alias)
+            finally:
+                executor.shutdown(wait=False)
+
+        record = self._get(alias)
+        tmpalias = alias + NEXT_SUFFIX
+        self.logger.info('updating local:{} from {}'
+                         .format(alias, record.source))
+        self.lxc.image_copy(record.source, alias=tmpalias)
+        try:
+            info = self._info(tmpalias)
+        finally:
+            self.lxc.image_alias_delete(tmpalias)
+        fingerprint = info['fingerprint']
+        if fingerprint == record.fingerprint:
+            self.logger.info('local:{} is already up to date'.format(alias))
+            return self.store.get_image(alias)
+
+        # Pools switch to the new image as soon as the store says so.
+        self.store.set_image(alias, record.source, fingerprint,
+                             info.get('size') or 0)
+        self.lxc.image_alias_delete(alias)
+        self.lxc.image_alias_create(alias, fingerprint)
+        self.store.retire_image(alias, record.fingerprint)
+        self.prune()
+        self.evict()
+        return self.store.get_image(alias)
+
+    def remove(self, alias):
+        """Delete the image from the local store."""
+        record = self._get(alias)
+        users = self._users(alias)
+        if users:
+            raise RuntimeError('image {!r} is used by pools {}'
+                               .format(alias, ', '.join(sorted(users))))
+        self.lxc.image_delete(record.fingerprint)
+        self.store.remove_image(alias)
+
+    def prune(self):
+        """Delete the images replaced by update() that are no longer used.
+
+        An image is in use while any container (e.g. a pool's golden
+        container, or a member launched from the image) is tagged with
+        it (see pool.SOURCE_KEY), on any of the pools' remotes.  An
+        image that is still in use is tried again by the next prune().
+        The deleted fingerprints are returned.
+        """
+        retired = self.store.retired_images()
+        if not retired:
+            return []
+        remotes = {None}
+        for pool in self.store.pools():
+            remotes.update(remote or None for remote in pool.remotes or ())
+        current = {record.fingerprint for record in self.store.images()}
+        deleted = []
+        for fingerprint in retired:
+            if fingerprint in current:
+                # It was cached again (e.g. the update was rolled back).
+                self.store.unretire_image(fingerprint)
+                continue
+            if self._used(fingerprint, remotes):
+                continue
+            self.logger.info('deleting replaced image {}'
+                             .format(fingerprint[:12]))
+            self.lxc.image_delete(fingerprint)
+            self.store.unretire_image(fingerprint)
+            deleted.append(fingerprint)
+        return deleted
+
+    def resolve(self, image):
+        """Return what to launch for the image (as a pool knows it).
+
+        For a cached image that is its fingerprint (and the image is
+        marked as used).  The image may be given either by its alias or
+        by its source (if it was cached under the default alias).
+        Otherwise the image is returned unchanged.
+        """
+        record = self.store.get_image(image)
+        if record is None:
+            record = self.store.get_image(default_alias(image))
+            if record is None:
+                return image
+        self.store.touch_image(record.alias)
+        return record.fingerprint
+
+    def evict(self, maxbytes=None):
+        """Remove least-recently used images until under 'maxbytes'.
+
+        The evicted aliases are returned.
+        """
+        if maxbytes is None:
+            maxbytes = self.maxbytes
+        if maxbytes is None:
+            return []
+        images = self.store.images()
+        total = sum(record.size for record in images)
+        inuse = {pool.image for pool in self.store.pools()}
+        inuse.update(default_alias(image) for image in list(inuse))
+        evicted = []
+        for record in images:
+            if total <= maxbytes:
+                break
+            if record.alias in inuse:
+                continue
+            self.logger.info('evicting image {} ({} bytes)'
+                             .format(record.alias, record.size))
+            self.lxc.image_delete(record.fingerprint)
+            self.store.remove_image(record.alias)
+            total -= record.size
+            evicted.append(record.alias)
+        return evicted
+
+    # internal methods
+
+    def _get(self, alias):
+        record = self.store.get_image(alias)
+        if record is None:
+            raise KeyError('image {!r} not cached'.format(alias))
+        return record
+
+    def _info(self, alias):
+        for info in self.lxc.image_list(alias):
+            names = [entry.get('name') for entry in info.get('aliases') or ()]
+            if alias in names:
+                return info
+        raise LookupError('image {!r} not found in LXD'.format(alias))
+
+    def _used(self, fingerprint, remotes):
+        tag = '{}={}'.format(SOURCE_KEY, fingerprint)
+        for remote in remotes:
+            try:
+                if self.lxc.list(tag, remote=remote):
+                    return True
+            except (subprocess.CalledProcessError, OSError) as exc:
+                # We can't tell, so we keep it for now.
+                self.logger.warning('could not list containers on {} ({})'
+                                    .format(remote, exc))
+                return True
+        return False
+
+    def _users(self, alias):
+        return {pool.name for pool in self.store.pools()
+                if alias in (pool.image, default_alias(pool.image))}
@@ -0,0 +1,364 @@
+"""A thin wrapper around the "lxc" command-line tool."""
+import json
+import logging
+import subprocess
+import time
+
+from . import metrics as _metrics
+from ._util import os as _os
+from ._util.logging import span
+
+
+EXECUTABLE = 'lxc'
+
+# Where the container name is in the args of each lxc command (for
+# the timing spans).  By default it is right after the command.
+CONTAINER_ARG = {
+        'launch': 3,
+        'copy': 3,
+        'config': 3,
+        'list': None,
+        'image': None,
+        }
+
+
+_logger = logging.getLogger(__name__)
+
+
+class LXC:
+    """The operations we need from LXD, implemented using the lxc CLI.
+
+    Each operation is run through _util.os.cmd(), so the runner used
+    may be swapped out (e.g. for a dry run).  Failed commands, and how
+    long each exec takes, are recorded in 'metrics' (a metrics.Registry,
+    metrics.REGISTRY by default).
+    """
+
+    def __init__(self, *, runner=None, logger=_logger, executable=EXECUTABLE,
+                 metrics=None):
+        if metrics is None:
+            metrics = _metrics.REGISTRY
+        self.runner = runner
+        self.logger = logger
+        self.executable = executable
+        self.metrics = metrics
+        self._failures = _metrics.lxc_failures(metrics)
+        self._exectime = _metrics.exec_seconds(metrics).labels()
+
+    def __repr__(self):
+        return '{}(runner={!r}, executable={!r})'.format(
+                type(self).__name__, self.runner, self.executable)
+
+    def _cmd(self, *args, **kwargs):
+        args = [self.executable] + list(args)
+        fields = _span_fields(args)
+        with span(self.logger, 'lxc', **fields):
+            try:
+                return _os.cmd(args, logger=self.logger, runner=self.runner,
+                               **kwargs)
+            except subprocess.CalledProcessError:
+                self._failures.inc(op=fields['op'])
+                raise
+
+    def aio(self, *, limit=None):
+        """Return an asyncio-based equivalent of this object.
+
+        If 'limit' is provided (e.g. an asyncio.Semaphore) then it caps
+        how many commands run at once.
+        """
+        return AsyncLXC(runner=self.runner, logger=self.logger,
+                        executable=self.executable, metrics=self.metrics,
+                        limit=limit)
+
+    # containers
+
+    def list(self, filter=None, *, columns='ns', remote=None):
+        """Return a list of row tuples for the matching containers.
+
+        By default each row is (name, status).  If a remote is given
+        then its containers are listed (by their names on the remote).
+        """
+        output = self._cmd(*_list_args(filter, columns, remote))
+        return _parse_rows(output)
+
+    def launch(self, image, name, *, ephemeral=False, config=None):
+        """Create and start a new container from the image."""
+        args = ['launch', image, name]
+        if ephemeral:
+            args.append('--ephemeral')
+        for key, value in sorted((config or {}).items()):
+            args.extend(['--config', '{}={}'.format(key, value)])
+        return self._cmd(*args)
+
+    def copy(self, source, name, *, ephemeral=False, config=None):
+        """Create a new (stopped) container as a copy of the source one.
+
+        On storage backends that support it (e.g. zfs or btrfs) the copy
+        is copy-on-write, which is much faster than launching.  The
+        given config is applied on top of the source's.
+        """
+        args = ['copy', source, name]
+        if ephemeral:
+            args.append('--ephemeral')
+        for key, value in sorted((config or {}).items()):
+            args.extend(['--config', '{}={}'.format(key, value)])
+        return self._cmd(*args)
+
+    def config_get(self, name, key):
+        """Return the value of the container's config key ('' if unset)."""
+        return self._cmd('config', 'get', name, key)
+
+    def config_set(self, name, key, value):
+        """Set the container's config key (live, where LXD can)."""
+        return self._cmd('config', 'set', name, key, value)
+
+    def config_unset(self, name, key):
+        """Remove the container's config key."""
+        return self._cmd('config', 'unset', name, key)
+
+    def start(self, name):
+        """Start the container."""
+        return self._cmd('start', name)
+
+    def stop(self, name, *, force=False):
+        """Stop the container."""
+        args = ['stop', name]
+        if force:
+            args.append('--force')
+        return self._cmd(*args)
+
+    def delete(self, name, *, force=True):
+        """Destroy the container (by default even if it is running)."""
+        args = ['delete', name]
+        if force:
+            args.append('--force')
+        return self._cmd(*args)
+
+    def exec(self, name, command, *, env=None, **kwargs):
+        """Run the command in the container and return its output.
+
+        If 'command' is a string then it is run using "sh -c".  As with
+        subprocess.check_output(), CalledProcessError is raised if the
+        command fails.
+        """
+        start = time.perf_counter()
+        try:
+            return self._cmd(*_exec_args(name, command, env), **kwargs)
+        finally:
+            self._exectime.observe(time.perf_counter() - start)
+
+    def exec_stream(self, name, command, *, env=None, **kwargs):
+        """Run the command in the container, yielding output as it comes.
+
+        See _util.os.cmd_stream() for more info (including about the
+        extra keyword arguments).
+        """
+        args = [self.executable] + _exec_args(name, command, env)
+        lines = _os.cmd_stream(args, logger=self.logger,
+                               runner=self.runner, **kwargs)
+        return self._timed_stream(lines, _span_fields(args))
+
+    def _timed_stream(self, lines, fields):
+        start = time.perf_counter()
+        try:
+            with span(self.logger, 'lxc', **fields):
+                yield from lines
+        except subprocess.CalledProcessError:
+            self._failures.inc(op=fields['op'])
+            raise
+        finally:
+            self._exectime.observe(time.perf_counter() - start)
+
+    # files
+
+    def push(self, names, source, target, *, compress=False, cwd=None):
+        """Copy the local directory tree into each of the containers.
+
+        The tree is sent as a single tar stream (gzipped if 'compress'
+        is True) into "lxc exec ... tar" at 'target' (which is created
+        if need be).  The archive is made once and fed to all the
+        containers at the same time, without any temporary files.
+
+        A relative 'source' is relative to 'cwd', if provided.
+        """
+        if isinstance(names, str):
+            names = [names]
+        flags = _tar_flags(compress)
+        source = ['tar', '-C', _os.resolve(source, cwd), '-c' + flags, '.']
+        sinks = [[self.executable] + _exec_args(name, _untar(target, flags),
+                                                None)
+                 for name in names]
+        with span(self.logger, 'push', containers=names):
+            return _os.cmd_pipe(source, sinks, logger=self.logger,
+                                runner=self.runner)
+
+    def pull(self, name, source, target, *, compress=False, cwd=None):
+        """Copy the directory tree out of the container.
+
+        This is the reverse of push(), into the local 'target' (relative
+        to 'cwd', if provided).
+        """
+        flags = _tar_flags(compress)
+        args = [self.executable] + _exec_args(
+                name, ['tar', '-C', source, '-c' + flags, '.'], None)
+        sink = _untar(_os.resolve(target, cwd), flags)
+        with span(self.logger, 'pull', container=name):
+            return _os.cmd_pipe(args, [sink], logger=self.logger,
+                                runner=self.runner)
+
+    def session(self, name, *, env=None):
+        """Return a Session for running many commands in the container.
+
+        See session.Session.
+        """
+        from .session import Session
+        return Session(self, name, env=env, logger=self.logger)
+
+    # snapshots
+
+    def snapshot(self, name, snapshot):
+        """Take a (stateless) snapshot of the container."""
+        return self._cmd('snapshot', name, snapshot)
+
+    def restore(self, name, snapshot):
+        """Restore the container to the given snapshot."""
+        return self._cmd('restore', name, snapshot)
+
+    # images
+
+    def image_list(self, filter=None):
+        """Return the info (a list of dicts) for the matching images."""
+        args = ['image', 'list', '--format', 'json']
+        if filter:
+            args.append(filter)
+        return json.loads(self._cmd(*args) or '[]')
+
+    def image_copy(self, image, target='local:', *, alias=None,
+                   auto_update=False):
+        """Copy the image (e.g. from a remote) into the image store."""
+        args = ['image', 'copy', image, target]
+        if alias:
+            args.extend(['--alias', alias])
+        if auto_update:
+            args.append('--auto-update')
+        return self._cmd(*args)
+
+    def image_delete(self, image):
+        """Remove the image from the image store."""
+        return self._cmd('image', 'delete', image)
+
+    def image_alias_create(self, alias, fingerprint):
+        return self._cmd('image', 'alias', 'create', alias, fingerprint)
+
+    def image_alias_delete(self, alias):
+        return self._cmd('image', 'alias', 'delete', alias)
+
+
+class AsyncLXC(LXC):
+    """An LXC whose operations are coroutines (see _util.os.acmd()).
+
+    Each operation returns the (awaitable) result of the same operation
+    on LXC, except for exec_stream() and session(), which aren't
+    supported (NotImplementedError is raised).
+    """
+
+    def __init__(self, *, limit=None, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+
+    def _cmd(self, *args, **kwargs):
+        args = [self.executable] + list(args)
+        coro = _os.acmd(args, logger=self.logger, runner=self.runner,
+                        limit=self.limit, **kwargs)
+        return self._timed(coro, _span_fields(args))
+
+    async def _timed(self, coro, fields):
+        with span(self.logger, 'lxc', **fields):
+            try:
+                return await coro
+            except subprocess.CalledProcessError:
+                self._failures.inc(op=fields['op'])
+                raise
+
+    async def list(self, filter=None, *, columns='ns', remote=None):
+        output = await self._cmd(*_list_args(filter, columns, remote))
+        return _parse_rows(output)
+
+    async def exec(self, name, command, *, env=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._cmd(*_exec_args(name, command, env), **kwargs)
+        finally:
+            self._exectime.observe(time.perf_counter() - start)
+
+    def exec_stream(self, name, command, *, env=None, **kwargs):
+        # XXX An async generator would need an asyncio cmd_stream().
+        raise NotImplementedError('use LXC.exec_stream()')
+
+    async def push(self, names, source, target, *, compress=False,
+                   cwd=None):
+        # The pipeline is run in the default executor (like acmd() does
+        # for other runners), so it does not block the loop.
+        return await self._in_executor(super().push, names, source, target,
+                                       compress=compress, cwd=cwd)
+
+    async def pull(self, name, source, target, *, compress=False, cwd=None):
+        return await self._in_executor(super().pull, name, source, target,
+                                       compress=compress, cwd=cwd)
+
+    def session(self, name, *, env=None):
+        raise NotImplementedError('use LXC.session()')
+
+    async def _in_executor(self, func, *args, **kwargs):
+        import asyncio
+        from functools import partial
+        loop = asyncio.get_event_loop()
+        call = partial(func, *args, **kwargs)
+        if self.limit is None:
+            return await loop.run_in_executor(None, call)
+        async with self.limit:
+            return await loop.run_in_executor(None, call)
+
+
+def _exec_args(name, command, env):
+    if isinstance(command, str):
+        command = ['sh', '-c', command]
+    args = ['exec', name]
+    for key, value in sorted((env or {}).items()):
+        args.extend(['--env', '{}={}'.format(key, value)])
+    args.append('--')
+    args.extend(command)
+    return args
+
+
+def _span_fields(args):
+    op = args[1]
+    fields = {'op': op}
+    index = CONTAINER_ARG.get(op, 2)
+    if index is not None and index < len(args):
+        fields['container'] = args[index]
+    return fields
+
+
+def _tar_flags(compress):
+    return ('z' if compress else '') + 'f-'
+
+
+def _untar(target, flags):
+    script = 'mkdir -p "$1" && exec tar -C "$1" -x{}'.format(flags)
+    return ['sh', '-c', script, 'sh', target]
+
+
+def _list_args(filter, columns, remote=None):
+    args = ['list', '--format', 'csv', '-c', columns]
+    if remote:
+        args.append(remote + ':')
+    if filter:
+        args.append(filter)
+    return args
+
+
+def _parse_rows(output):
+    return [tuple(line.split(','))
+            for line in output.splitlines()
+            if line]
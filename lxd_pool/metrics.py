@@ -0,0 +1,406 @@
+"""Counters, gauges and latency histograms, in the Prometheus format.
+
+Pools (and LXC) record into a Registry (REGISTRY by default), which
+renders everything in the Prometheus text exposition format.  See
+https://prometheus.io/docs/instrumenting/exposition_formats/.
+
+The numbers are only as long-lived as the process, so they are most
+useful from the daemon ("lxd-pool serve"), which can also serve them
+over HTTP (see serve()).
+"""
+from bisect import bisect_right
+from collections import deque
+import logging
+import threading
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# in seconds, from a warm acquire up to a cold launch
+BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+           60.0, 300.0)
+FOLD_AT = 1000  # observations queued before they are bucketed
+
+# the standard metrics
+MEMBERS = 'lxd_pool_members'
+WAITING = 'lxd_pool_waiting'
+TARGET = 'lxd_pool_target'
+TIMEOUTS = 'lxd_pool_acquire_timeouts_total'
+RESET_FAILURES = 'lxd_pool_reset_failures_total'
+QUARANTINED = 'lxd_pool_quarantined_total'
+AFFINITY = 'lxd_pool_affinity_total'
+LXC_FAILURES = 'lxd_pool_lxc_failures_total'
+EXEC_SECONDS = 'lxd_pool_exec_seconds'
+WAIT_SECONDS = 'lxd_pool_wait_seconds'
+POOL_SECONDS = {
+        'acquire': 'Time taken to hand out a container.',
+        'release': 'Time taken to take back a container.',
+        'reset': 'Time taken to restore a container to its baseline.',
+        'launch': 'Time taken to add a new member to a pool.',
+        }
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Registry:
+    """A set of metrics, rendered together.
+
+    Collectors (functions taking the registry) are called right before
+    rendering, so gauges can be brought up to date.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collectlock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def __repr__(self):
+        return '{}()'.format(type(self).__name__)
+
+    def counter(self, name, help, labelnames=()):
+        """Return the named Counter (creating it if need be)."""
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        """Return the named Gauge (creating it if need be)."""
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        """Return the named Histogram (creating it if need be)."""
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def remove_collector(self, collect):
+        self._collectors.remove(collect)
+
+    def render(self):
+        """Return the text for every metric, in the Prometheus format."""
+        with self._collectlock:
+            for collect in list(self._collectors):
+                try:
+                    collect(self)
+                except Exception as exc:
+                    _logger.error('metrics collector failed ({})'
+                                  .format(exc))
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames,
+                                                   **kwargs)
+            elif type(metric) is not cls:
+                raise TypeError('{} is a {}, not a {}'.format(
+                        name, metric.TYPE, cls.TYPE))
+            return metric
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+
+    TYPE = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.name)
+
+    def labels(self, **labels):
+        """Return the child metric for the given label values."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        try:
+            return self._children[key]
+        except KeyError:
+            with self._lock:
+                return self._children.setdefault(key, self._new_child())
+
+    def clear(self):
+        """Forget the values for every set of labels."""
+        with self._lock:
+            self._children.clear()
+
+    def render(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        lines = []
+        for key, child in children:
+            labels = list(zip(self.labelnames, key))
+            lines.extend(self._render_child(child, labels))
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _render_child(self, child, labels):
+        yield _sample(self.name, labels, child.value)
+
+
+class Counter(_Metric):
+    """A count that only goes up."""
+
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that may go up or down."""
+
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value, **labels):
+        self.labels(**labels).set(value)
+
+
+class Histogram(_Metric):
+    """The distribution of observed values (e.g. latencies)."""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), *, buckets=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Distribution(self.buckets)
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def _render_child(self, child, labels):
+        counts, total, count = child.snapshot()
+        cumulative = 0
+        for bound, bucketcount in zip(self.buckets + (float('inf'),),
+                                      counts):
+            cumulative += bucketcount
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield _sample(self.name + '_bucket', labels + [('le', le)],
+                          cumulative)
+        yield _sample(self.name + '_sum', labels, total)
+        yield _sample(self.name + '_count', labels, count)
+
+
+class _Value:
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Distribution:
+
+    # Observing has to be cheap, since it happens in acquire() and
+    # release().  So observations are only queued (deque.append() is
+    # atomic) and get sorted into the buckets in batches.
+
+    __slots__ = ('buckets', 'counts', 'total', 'count', '_pending', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= FOLD_AT:
+            self._fold()
+
+    def snapshot(self):
+        with self._lock:
+            self._fold_locked()
+            return list(self.counts), self.total, self.count
+
+    def _fold(self):
+        with self._lock:
+            self._fold_locked()
+
+    def _fold_locked(self):
+        popleft = self._pending.popleft
+        values = sorted([popleft() for _ in range(len(self._pending))])
+        if not values:
+            return
+        counts = self.counts
+        previous = 0
+        for index, bound in enumerate(self.buckets):
+            below = bisect_right(values, bound)
+            counts[index] += below - previous
+            previous = below
+        counts[-1] += len(values) - previous
+        self.total += sum(values)
+        self.count += len(values)
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(key, _escape(value))
+                               for key, value in labels) + '}'
+    return '{} {}'.format(name, _format_value(value))
+
+
+def _escape(value):
+    return (value.replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+#######################################
+# the standard metrics
+
+def pool_seconds(registry, op):
+    """Return the latency histogram for the pool operation (see POOL_SECONDS).
+    """
+    return registry.histogram('lxd_pool_{}_seconds'.format(op),
+                              POOL_SECONDS[op], ('pool',))
+
+
+def pool_counter(registry, name):
+    """Return the (per-pool) counter (TIMEOUTS, RESET_FAILURES or
+    QUARANTINED).
+    """
+    help = {
+            TIMEOUTS: 'Calls to acquire() that timed out.',
+            RESET_FAILURES: 'Containers destroyed since they failed to reset.',
+            QUARANTINED: 'Containers that failed a health check.',
+            }[name]
+    return registry.counter(name, help, ('pool',))
+
+
+def affinity_counter(registry):
+    """Return the counter of acquires with a cache key (by pool and
+    whether a warm container was found, "hit" or "miss").
+    """
+    return registry.counter(AFFINITY,
+                            'Acquires with a cache key, by result.',
+                            ('pool', 'result'))
+
+
+def wait_seconds(registry):
+    """Return the histogram of how long acquires waited (by pool and
+    tenant)."""
+    return registry.histogram(WAIT_SECONDS,
+                              'Time spent waiting in line in acquire().',
+                              ('pool', 'tenant'))
+
+
+def exec_seconds(registry):
+    """Return the latency histogram for commands run in containers."""
+    return registry.histogram(EXEC_SECONDS,
+                              'Time taken to run a command in a container.')
+
+
+def lxc_failures(registry):
+    """Return the counter of failed lxc commands (by operation)."""
+    return registry.counter(LXC_FAILURES, 'lxc commands that failed.',
+                            ('op',))
+
+
+#######################################
+# gauges from the pool state
+
+def collect(registry, *, pools=(), store=None):
+    """Set the gauges for the pools.
+
+    The members (by state) of each live pool (a pool.Pool) come from
+    the pool itself, along with the number of callers waiting and the
+    target.  The members of any other pool in the store (a
+    state.Store) come from there.
+    """
+    members = registry.gauge(MEMBERS, 'Pool members, by state.',
+                             ('pool', 'state'))
+    waiting = registry.gauge(WAITING, 'Callers waiting in acquire().',
+                             ('pool',))
+    target = registry.gauge(TARGET, 'Members the pool is keeping.',
+                            ('pool',))
+    counts = store.counts() if store is not None else {}
+    targets = {}
+    for pool in pools:
+        counts[pool.name] = pool.counts()
+        targets[pool.name] = (pool.waiting, pool.target)
+    for gauge in (members, waiting, target):
+        gauge.clear()
+    for name, states in counts.items():
+        for state, count in states.items():
+            members.set(count, pool=name, state=state)
+    for name, (numwaiting, numtarget) in targets.items():
+        waiting.set(numwaiting, pool=name)
+        target.set(numtarget, pool=name)
+
+
+#######################################
+# over HTTP
+
+def serve(registry=REGISTRY, address=('127.0.0.1', 9100)):
+    """Serve the metrics over HTTP (at /metrics), in the background.
+
+    The (already running) http.server is returned.  Call its shutdown()
+    to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            _logger.debug('metrics: ' + fmt, *args)
+
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics-http', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,1870 @@
+"""The pool engine: a set of pre-launched containers ready to hand out."""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import heapq
+from itertools import chain, islice
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+
+from . import health as _health
+from . import metrics as _metrics
+from . import remotes as _remotes
+from . import resources as _resources
+from . import tenants as _tenants
+from ._util.logging import log_span, span
+from .lxd import LXC
+
+
+DEFAULT_IMAGE = 'ubuntu:'
+CONFIG_KEY = 'user.lxd-pool.pool'
+SOURCE_KEY = 'user.lxd-pool.image'
+GOLDEN_SUFFIX = '-golden'
+BASELINE = 'lxd-pool-baseline'
+MAX_RESETTERS = 4
+MAX_PARALLEL = 10  # the default for concurrent launches
+LAUNCHTIME_WEIGHT = 0.2  # for the moving average of launch times
+MAX_KEYS = 8  # cache keys each container is remembered as warm for
+LINGER = 60.0  # seconds a surplus member may stay idle (see Pool)
+
+# member states
+IDLE = 'idle'
+BUSY = 'busy'
+RESETTING = 'resetting'
+BROKEN = 'broken'
+DELETING = 'deleting'  # on a remote that was out of reach
+
+
+_logger = logging.getLogger(__name__)
+
+
+class PoolError(Exception):
+    """The base class for pool-related errors."""
+
+
+class UnknownContainerError(PoolError, KeyError):
+    """The container is not a member of the pool."""
+
+
+class UnknownPoolError(PoolError, LookupError):
+    """The pool does not exist."""
+
+
+class PoolTimeoutError(PoolError, TimeoutError):
+    """No container became available in time."""
+
+
+def default_lease():
+    """Return the lease holder to use by default (this process)."""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def lease_alive(lease):
+    """Return False if the lease holder is known to be gone.
+
+    That is only known for a lease held by a process on this host (see
+    default_lease()) that isn't running any more.
+    """
+    host, sep, pid = (lease or '').rpartition(':')
+    if not sep or host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Pool:
+    """A "warm" pool of LXD containers.
+
+    The pool keeps 'size' containers launched (and started) ahead of
+    time, so handing one out is a matter of popping it off the idle
+    queue.  Under demand it grows, up to 'maxsize', by launching more
+    containers.  Once demand drops, the surplus containers go away,
+    shrinking the pool back down to 'size': each one is destroyed once
+    it has been idle for 'linger' seconds (as noticed whenever a
+    container is released), so the pool doesn't pay for new launches
+    while it is kept busy.
+
+    Members are named "<pool>-<N>" and are tagged with the pool name
+    and the image they came from in their config (see CONFIG_KEY and
+    SOURCE_KEY).  By default they aren't launched
+    from the image directly.  Instead a (stopped) "golden" container,
+    "<pool>-golden", is launched from the image once and each member
+    is a copy of it, which is copy-on-write (and thus fast) on storage
+    backends like zfs or btrfs.  If 'clone' is False then every member
+    is launched from the image.  Right after it is created each member
+    gets a baseline snapshot (see BASELINE), which is what it is
+    restored to when reset.  A container released with reset=True is
+    restored in the background while the other (already clean) idle
+    containers keep being handed out.
+
+    The number of members the pool holds on to (its "target") is
+    'size' unless raised with set_target() (e.g. by a Replenisher, see
+    the replenish module) to get ahead of demand.
+
+    Once the pool is exhausted, callers of acquire() wait in line and
+    each released container goes straight to one of them.  Each caller
+    may give a tenant and a priority.  The waiters are served by
+    weighted fair queuing between the tenants, by priority (which goes
+    up the longer they wait, per 'aging') and otherwise first come,
+    first served.  Each of the 'tenants' may have a weight (its share
+    of the containers) and a cap (the most it may hold at once).  See
+    the tenants module.
+
+    If a state.Store is provided then the pool and each change to its
+    members is recorded there.  If an images.ImageCache is provided
+    then containers are launched from the cached copy of the image,
+    when there is one.
+
+    A pool may span several LXD hosts, given as 'remotes' (see the
+    remotes module), each with an optional capacity.  Each new member is
+    placed on the remote with the most room left, and acquire() hands
+    out a container from the least busy remote.  A remote that is
+    drained (see drain() and check_remotes()) gets no new members, and
+    its members are destroyed (once released) and replaced elsewhere.
+
+    A container released with a cache key (see release()) isn't reset
+    but is kept "warm" for the key: acquire() with the same key prefers
+    it, so a job can pick up the checkout, caches, etc. left by the
+    last one with that key.  Each container remembers its 'maxkeys'
+    most recent keys.  A warm container is never handed out for some
+    other key (or none) without being reset first, and clean containers
+    are handed out ahead of warm ones.
+
+    Each member gets the pool's resource 'limits' (see the resources
+    module) as its "limits.cpu" and "limits.memory" config.  If an
+    'admission' (a resources.Admission) is provided then containers are
+    only handed out or launched while the host has the memory (and
+    CPU) for them.  Otherwise acquire() waits, as though the pool were
+    exhausted.
+
+    Idle members that fail a health check (see check_health() and the
+    health module) are quarantined: they are marked broken and replaced.
+    The last 'quarantine' of them are kept around (but never handed
+    out) so someone can look at what went wrong.
+
+    How long acquire(), release(), resets and launches take is recorded
+    in 'metrics' (a metrics.Registry), which defaults to that of the
+    LXC.
+    """
+
+    def __init__(self, name, size, *, maxsize=None, image=None, lxc=None,
+                 store=None, images=None, clone=True, parallel=MAX_PARALLEL,
+                 remotes=None, limits=None, admission=None, tenants=None,
+                 aging=_tenants.AGING, quarantine=_health.QUARANTINE,
+                 maxkeys=MAX_KEYS, linger=LINGER,
+                 metrics=None, logger=_logger):
+        size, maxsize = _check_sizes(size, maxsize)
+        if lxc is None:
+            lxc = LXC()
+        if metrics is None:
+            metrics = getattr(lxc, 'metrics', None) or _metrics.REGISTRY
+
+        self.name = name
+        self.size = size
+        self.maxsize = maxsize
+        self.image = image or DEFAULT_IMAGE
+        self.lxc = lxc
+        self.store = store
+        self.images = images
+        self.clone = clone
+        self.parallel = parallel
+        self.remotes = _remotes.normalize(remotes)
+        self.limits = _resources.normalize(limits)
+        self.admission = admission
+        self.quarantine = quarantine
+        self.maxkeys = maxkeys
+        self.linger = linger
+        self.metrics = metrics
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._waiters = _tenants.FairQueue(
+                tenants, aging=aging,
+                admit=self._admits if admission is not None else None)
+        self._starved = None  # why the admission last turned us down
+        self._holders = {}
+        self._affinity = {}
+        self._idle = _Idle(self._affinity)
+        self._busy = _Busy()
+        self._resetting = set()
+        self._returning = set()  # released, on their way back to idle
+        self._launching = 0
+        self._resetter = None
+        self._nextindex = 1
+        self._target = size
+        self._acquired = 0
+        self._launchtime = None
+        self._stale = set()
+        self._leased = {}
+        self._golden = {}
+        self._goldenlock = threading.Lock()
+        self._placed = {}
+        self._drained = {}
+        self._healthy = {}
+        self._broken = {}
+        self._elsewhere = {}  # held by someone else: {container: state}
+        self._deleting = set()  # left on a drained remote (see _purge())
+        self._checked = {}
+        self._bykey = {}
+        self._hits = 0
+        self._misses = 0
+        self._timings = {
+                op: _metrics.pool_seconds(metrics, op).labels(pool=name)
+                for op in _metrics.POOL_SECONDS}
+        self._timeouts = _metrics.pool_counter(
+                metrics, _metrics.TIMEOUTS).labels(pool=name)
+        self._resetfailures = _metrics.pool_counter(
+                metrics, _metrics.RESET_FAILURES).labels(pool=name)
+        self._quarantined = _metrics.pool_counter(
+                metrics, _metrics.QUARANTINED).labels(pool=name)
+        self._waits = {}
+        self._waithistogram = _metrics.wait_seconds(metrics)
+        affinity = _metrics.affinity_counter(metrics)
+        self._affinityhits = affinity.labels(pool=name, result='hit')
+        self._affinitymisses = affinity.labels(pool=name, result='miss')
+
+    def __repr__(self):
+        return '{}({!r}, {!r}, maxsize={!r}, image={!r})'.format(
+                type(self).__name__, self.name, self.size, self.maxsize,
+                self.image)
+
+    def __len__(self):
+        with self._lock:
+            return (len(self._idle) + len(self._busy) + len(self._resetting)
+                    + len(self._returning) + len(self._elsewhere))
+
+    def __contains__(self, container):
+        with self._lock:
+            return (container in self._busy
+                    or container in self._resetting
+                    or container in self._idle
+                    or container in self._returning
+                    or container in self._broken
+                    or container in self._elsewhere)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def load(cls, name, *, lxc=None, store=None, reconcile=False, **kwargs):
+        """Return the existing pool.
+
+        If the store knows about the pool then its members are taken
+        from there, without asking LXD (unless 'reconcile' is True).
+        Otherwise the pool is found in LXD (and recorded in the store).
+        Unless provided, 'size' is the number of members found.
+
+        Only the members stored as idle are handed out.  Those stored
+        as busy or resetting are left to whoever holds them (e.g.
+        another process), unless the holder is gone (see lease_alive()),
+        in which case they are reset and then handed out.  Other
+        processes may have the pool loaded too: each idle member is
+        claimed in the store before it is handed out (see
+        state.Store.claim_member()), so only one of them gets it.
+        """
+        if lxc is None:
+            lxc = LXC()
+        record = store.get_pool(name) if store is not None else None
+        if record is None:
+            remotes = _remotes.normalize(kwargs.get('remotes'))
+            rows, reached = _list_members(lxc, name, remotes,
+                                          kwargs.get('logger', _logger))
+            if not rows:
+                raise UnknownPoolError(name)
+            kwargs.setdefault('size', len(rows))
+        else:
+            members = store.members(name)
+            kwargs.setdefault('size', record.size)
+            kwargs.setdefault('maxsize', record.maxsize)
+            kwargs.setdefault('image', record.image)
+            kwargs.setdefault('remotes', record.remotes)
+            kwargs.setdefault('limits', record.limits)
+            kwargs.setdefault('tenants', record.tenants)
+        if kwargs.get('maxsize') is not None:
+            kwargs['maxsize'] = max(kwargs['maxsize'], kwargs['size'])
+        self = cls(name, lxc=lxc, store=store, **kwargs)
+
+        if record is None:
+            self._register()
+            self._sync(rows, reached)
+        else:
+            abandoned = []
+            for member in members:
+                if member.state == IDLE:
+                    self._add(member.name, member.affinity)
+                    continue
+                self._index(member.name)
+                if member.state == DELETING:
+                    self._deleting.add(member.name)
+                elif member.state == BROKEN:
+                    self._broken[member.name] = member.note
+                elif lease_alive(member.lease):
+                    self._elsewhere[member.name] = member.state
+                else:
+                    abandoned.append(member.name)
+            for container in abandoned:
+                self.logger.warning('{} was left by a process that is gone, '
+                                    'resetting it'.format(container))
+                self._resetting.add(container)
+                self._record(container, RESETTING, lease=default_lease())
+                self._get_resetter().submit(self._reset, container)
+            if reconcile:
+                self.reconcile()
+        return self
+
+    @property
+    def idle(self):
+        """The number of containers ready to be handed out."""
+        return len(self._idle)
+
+    @property
+    def busy(self):
+        """The number of containers currently handed out."""
+        return len(self._busy)
+
+    @property
+    def resetting(self):
+        """The number of containers currently being reset."""
+        return len(self._resetting)
+
+    @property
+    def waiting(self):
+        """The number of callers blocked in acquire()."""
+        return len(self._waiters)
+
+    @property
+    def tenants(self):
+        """The {tenant: {'weight': WEIGHT, 'cap': CAP}} (or None)."""
+        return self._waiters.tenants
+
+    def queue(self):
+        """Return {tenant: {...}} describing how each tenant is faring.
+
+        Each has its weight and cap, the number of its callers waiting
+        and of the containers it holds, and the 50th, 90th and 99th
+        percentiles of its recent waits (as "p50", etc., in seconds).
+        """
+        with self._lock:
+            return self._waiters.stats()
+
+    def counts(self):
+        """Return {state: count} for the pool's members."""
+        with self._lock:
+            counts = {
+                    IDLE: len(self._idle) + len(self._returning),
+                    BUSY: len(self._busy),
+                    RESETTING: len(self._resetting),
+                    BROKEN: len(self._broken),
+                    }
+            for state in self._elsewhere.values():
+                counts[state] = counts.get(state, 0) + 1
+            if self._deleting:
+                counts[DELETING] = len(self._deleting)
+            return counts
+
+    @property
+    def broken(self):
+        """The quarantined members, as {container: what went wrong}."""
+        with self._lock:
+            return dict(self._broken)
+
+    @property
+    def golden(self):
+        """The name of the container that members are copied from.
+
+        Each remote has its own, by that name.
+        """
+        return self.name + GOLDEN_SUFFIX
+
+    @property
+    def drained(self):
+        """The remotes that currently get no new members."""
+        return sorted(self._drained)
+
+    @property
+    def target(self):
+        """The number of members to keep (between size and maxsize)."""
+        return self._target
+
+    @property
+    def acquired(self):
+        """The number of times acquire() has handed out a container."""
+        return self._acquired
+
+    @property
+    def hits(self):
+        """The number of acquires with a cache key that got a container
+        warm for it.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of acquires with a cache key that didn't."""
+        return self._misses
+
+    def warm(self):
+        """Return {container: [cache key, ...]} for the warm members."""
+        with self._lock:
+            return {container: list(keys)
+                    for container, keys in self._affinity.items()}
+
+    @property
+    def launchtime(self):
+        """The (moving) average time it takes to add a member, if known."""
+        return self._launchtime
+
+    def create(self):
+        """Launch containers until the pool has 'size' members.
+
+        Up to 'parallel' containers are launched at once.  Each one
+        may be handed out as soon as it is ready.
+        """
+        self._register()
+        room = self._admission_room()
+        with self._lock:
+            needed = min(self.size - self._total(), self._room(), room)
+            if needed <= 0:
+                return
+            self._launching += needed
+        self._reserve(needed)
+        self.logger.info('launching {} containers for pool {!r}'
+                         .format(needed, self.name))
+        asyncio.run(self._acreate(needed))
+
+    def acquire(self, *, timeout=None, block=True, lease=None, key=None,
+                priority=_tenants.PRIORITY, tenant=None):
+        """Return the name of an idle container, marking it busy.
+
+        Handing out an idle container is O(1).  If none is idle and the
+        pool is below 'maxsize' then a new one is launched.  Otherwise
+        this waits (in line) until a container is released.  If that
+        takes longer than 'timeout' seconds then PoolTimeoutError is
+        raised.  If 'block' is False then None is returned instead of
+        waiting.
+
+        Who is served first while waiting depends on the 'tenant' (which
+        defaults to tenants.DEFAULT) and the 'priority' (higher first).
+        A tenant at its cap waits even if there are idle containers.
+
+        'lease' identifies the holder of the container (in the store).
+        It defaults to this process.
+
+        If the pool has an admission (see above) then this first waits
+        (up to 'timeout') for the host to have room for another busy
+        container.  If 'block' is False then None is returned right
+        away instead.
+
+        If a cache 'key' is provided then an idle container that is warm
+        for it (see release()) is handed out, if there is one.  That
+        counts as a hit (see 'hits').
+        """
+        if lease is None:
+            lease = default_lease()
+        if tenant is None:
+            tenant = _tenants.DEFAULT
+        start = time.perf_counter()
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            # the fast path
+            container = self._acquire(timeout, block, lease, key, priority,
+                                      tenant)
+        else:
+            with span(self.logger, 'acquire', pool=self.name,
+                      lease=lease, tenant=tenant) as fields:
+                container = self._acquire(timeout, block, lease, key,
+                                          priority, tenant)
+                fields['container'] = container
+            if container is not None:
+                self._leased[container] = time.monotonic()
+        self._timings['acquire'].observe(time.perf_counter() - start)
+        return container
+
+    def _acquire(self, timeout, block, lease, key, priority, tenant):
+        while True:
+            if not self._idle and self._elsewhere:
+                self._reclaim()
+            container = None
+            fresh = claim = False
+            hit = dirty = False
+            waited = 0.0
+            with self._lock:
+                self._acquired += 1
+                # With an admission, everyone goes through the queue,
+                # which asks the admission (see _admits()), so that those
+                # held off for lack of resources are still served in
+                # order.
+                allowed = (self.admission is None
+                           and self._waiters.allowed(tenant))
+                if self._idle and allowed:
+                    container = self._pop_idle(key)
+                    claim = True
+                    self._busy.add(container)
+                    self._hold(container, tenant)
+                elif (allowed and self._total() < self.maxsize
+                        and self._room()):
+                    self._launching += 1
+                    self._waiters.take(tenant)
+                elif not block and self.admission is None:
+                    self._acquired -= 1
+                    return None
+                else:
+                    waiter = self._wait(timeout, block, priority, tenant)
+                    if waiter is None:
+                        self._acquired -= 1
+                        return None
+                    container, fresh = waiter.container, waiter.fresh
+                    claim = waiter.claim
+                    waited = time.monotonic() - waiter.since
+                self._waiters.record(tenant, waited)
+                if container is not None and self._affinity:
+                    hit, dirty = self._claim(container, key)
+            self._observe_wait(tenant, waited)
+            if container is None:
+                break
+            if claim and not self._claim_stored(container, BUSY, lease=lease,
+                                                reset=fresh or dirty):
+                # Another process got it first, so we try again.  (The
+                # timeout starts over, but that is rare.)
+                with self._lock:
+                    self._acquired -= 1
+                continue
+            if key is not None:
+                self._count_affinity(hit)
+            if dirty:
+                self._reset_now(container)
+                fresh = True
+            if not claim:
+                self._record(container, BUSY, lease=lease, reset=fresh)
+            return container
+
+        # We have to grow the pool.
+        if key is not None:
+            self._count_affinity(False)
+        try:
+            container = self._launch()
+        except BaseException:
+            with self._lock:
+                self._launching -= 1
+                self._waiters.give(tenant)
+                self._wake_grower()
+            raise
+        with self._lock:
+            self._launching -= 1
+            self._busy.add(container)
+            self._holders[container] = tenant
+        self._record(container, BUSY, lease=lease, reset=True)
+        return container
+
+    def release(self, container, *, reset=False, key=None):
+        """Put the container back in the pool.
+
+        If 'reset' is True then the container is restored to its
+        baseline snapshot in the background before it is handed out
+        again.  If the pool has grown past its target then any idle
+        members that have been idle for 'linger' seconds are destroyed.
+
+        If a cache 'key' is provided then the container is not reset
+        (whatever 'reset' says).  Instead it is kept warm for the key
+        (see acquire()).
+        """
+        if key is not None:
+            reset = False
+        start = time.perf_counter()
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            # the fast path
+            self._leased.pop(container, None)
+            self._release(container, reset, key)
+        else:
+            with span(self.logger, 'release', pool=self.name,
+                      container=container, reset=reset, key=key):
+                self._release(container, reset, key)
+            leased = self._leased.pop(container, None)
+            if leased is not None:
+                log_span(self.logger, 'lease', time.monotonic() - leased,
+                         pool=self.name, container=container)
+        self._timings['release'].observe(time.perf_counter() - start)
+
+    def _release(self, container, reset, key):
+        keys = None
+        with self._lock:
+            try:
+                self._busy.remove(container)
+            except KeyError:
+                raise UnknownContainerError(container)
+            self._unhold(container)
+            stale = container in self._stale
+            if stale:
+                # It is from an old image (see update()).
+                self._stale.discard(container)
+                self._wake_grower()
+            handed = False
+            if reset and not stale:
+                self._resetting.add(container)
+            elif not stale:
+                if key is not None:
+                    keys = self._remember(container, key)
+                # Unless it goes straight to someone waiting, it is
+                # recorded as idle (see below) before it is handed out
+                # again.  Once it is, another process may claim it.
+                handed = self._hand_off(container)
+                if not handed and self.store is not None:
+                    self._returning.add(container)
+                elif not handed:
+                    self._idle.append(container)
+            if self._idle and self._waiters:
+                # The tenant's cap may have been holding someone back.
+                self._dispatch()
+            expired = self._expired()
+        for other in expired:
+            self._shrink(other)
+        if stale:
+            self.logger.debug('removing %s (stale)', container)
+            self._record(container, None)
+            self._destroy(container)
+            self._refill()
+        elif reset:
+            self._record(container, RESETTING, lease=default_lease())
+            self._get_resetter().submit(self._reset, container)
+        elif not handed and self.store is not None:
+            self._record(container, IDLE, affinity=keys)
+            self._put_back(container)
+
+    @contextmanager
+    def checkout(self, *, timeout=None, reset=True, lease=None, key=None,
+                 priority=_tenants.PRIORITY, tenant=None):
+        """Return a context manager that holds a container from the pool.
+
+        The name of the container is the target of the with statement.
+        When the with statement exits, the container is released.  By
+        default it is also reset (in the background), unless a cache
+        'key' is provided (see release()).
+        """
+        container = self.acquire(timeout=timeout, lease=lease, key=key,
+                                 priority=priority, tenant=tenant)
+        try:
+            yield container
+        finally:
+            self.release(container, reset=reset, key=key)
+
+    def reset(self):
+        """Restore every idle container to its baseline snapshot.
+
+        The containers are reset in parallel and this blocks until all
+        are done.  Busy containers are left alone.
+        """
+        with self._lock:
+            containers = list(self._idle)
+            self._idle.clear()
+            self._resetting.update(containers)
+        containers = [c for c in containers
+                      if self._claim_stored(c, RESETTING,
+                                            lease=default_lease())]
+        resetter = self._get_resetter()
+        wait([resetter.submit(self._reset, container)
+              for container in containers])
+
+    def set_target(self, target):
+        """Change how many members the pool keeps (see replenish()).
+
+        The target is kept between 'size' and 'maxsize'.  The actual
+        target is returned.
+        """
+        target = max(self.size, min(self.maxsize, target))
+        with self._lock:
+            self._target = target
+        return target
+
+    def update(self, *, size=None, maxsize=None, image=None, remotes=None,
+               limits=None, tenants=None):
+        """Change the size, maxsize, image, remotes, limits and/or
+        tenants of the pool.
+
+        The pool is then resized to fit (see replenish()).  If the
+        image changed then the idle members are replaced right away,
+        with copies of a new golden container.  Any other members are
+        destroyed once they are released.  Likewise, any remote that
+        was dropped is drained (see drain()).  New limits are applied
+        to the current members right away (LXD applies them live).  To
+        drop all the limits, pass {}.  Likewise for the tenants (which
+        take effect for the next container handed out).
+        """
+        if size is None:
+            size = self.size
+        if maxsize is None:
+            maxsize = max(self.maxsize, size)
+        size, maxsize = _check_sizes(size, maxsize)
+        with self._lock:
+            if size != self.size:
+                # A Replenisher will raise it again if need be.
+                self._target = size
+            else:
+                self._target = min(maxsize, self._target)
+            self.size = size
+            self.maxsize = maxsize
+            stale = []
+            if image and image != self.image:
+                self.image = image
+                stale = list(self._idle)
+                self._idle.clear()
+                self._stale.update(self._busy, self._resetting,
+                                   self._returning)
+        if remotes is not None:
+            remotes = _remotes.normalize(remotes)
+            for remote in set(self.remotes) - set(remotes):
+                self.drain(remote)
+            for remote in set(remotes) - set(self.remotes):
+                if remote in self._drained:
+                    self.undrain(remote)
+            with self._lock:
+                self.remotes = remotes
+        if limits is not None:
+            self._apply_limits(_resources.normalize(limits))
+        if tenants is not None:
+            with self._lock:
+                self._waiters.tenants = _tenants.normalize(tenants)
+                if self._idle and self._waiters:
+                    self._dispatch()
+        if self.store is not None:
+            self.store.update_pool(self.name, size=size, maxsize=maxsize,
+                                   image=self.image,
+                                   remotes=self._stored_remotes(),
+                                   limits=self.limits, tenants=self.tenants)
+        for container in stale:
+            if not self._claim_stored(container, DELETING):
+                continue
+            self.logger.debug('removing %s (old image)', container)
+            self._record(container, None)
+            self._destroy(container)
+        self.replenish()
+
+    def replenish(self):
+        """Launch or destroy containers until the pool is at its target.
+
+        Any new containers are launched in parallel (like create()) and
+        this blocks until they are ready.  Only idle containers are
+        destroyed (right away); any other surplus goes away once it has
+        been released and left idle (see 'linger').  The change in the
+        number of members is returned.
+        """
+        room = self._admission_room()
+        with self._lock:
+            needed = self._target - self._total()
+            if needed > 0:
+                needed = min(needed, self._room(), room)
+                self._launching += needed
+            surplus = []
+            while needed < -len(surplus) and self._idle:
+                surplus.append(self._idle.pop())
+        if needed > 0:
+            self._reserve(needed)
+            self.logger.info('launching {} containers for pool {!r}'
+                             .format(needed, self.name))
+            asyncio.run(self._acreate(needed))
+            return needed
+        return -sum(1 for container in surplus if self._shrink(container))
+
+    def reconcile(self):
+        """Bring the pool (and the store) in line with LXD.
+
+        Members that LXD doesn't know about are dropped, unknown
+        containers tagged for the pool are added, and any that aren't
+        running get started.  Remotes that can't be reached are left
+        alone.
+        """
+        rows, reached = _list_members(self.lxc, self.name, self.remotes,
+                                      self.logger)
+        self._sync(rows, reached)
+
+    def drain(self, remote):
+        """Stop using the remote.
+
+        It gets no new members.  Its idle members are destroyed right
+        away and any others once they are released.  Each is replaced
+        on another remote (if there is room).  See undrain().
+        """
+        self._drain(remote, auto=False)
+
+    def undrain(self, remote):
+        """Start using the (drained) remote again."""
+        with self._lock:
+            self._drained.pop(remote, None)
+            self._healthy.pop(remote, None)
+        self._refill()
+
+    def check_remotes(self, *, maxlatency=_remotes.MAXLATENCY,
+                      recover=_remotes.RECOVER):
+        """Drain the remotes that are unreachable or overloaded.
+
+        A remote counts as overloaded if listing the pool's containers
+        there takes longer than 'maxlatency' seconds.  Once a remote
+        that was drained this way is healthy for 'recover' checks in a
+        row, it is used again.  (Remotes drained with drain() stay that
+        way.)  The drained remotes are returned.
+        """
+        if len(self.remotes) < 2:
+            # There's nowhere else to go.
+            return self.drained
+        for remote in list(self.remotes):
+            problem = self._probe(remote, maxlatency)
+            with self._lock:
+                drained = remote in self._drained
+                auto = self._drained.get(remote)
+            if problem is not None:
+                if not drained:
+                    self.logger.warning('draining remote {!r} of pool {!r} '
+                                        '({})'.format(remote, self.name,
+                                                      problem))
+                with self._lock:
+                    self._healthy[remote] = 0
+                # This also picks up any stragglers (e.g. launched
+                # while the remote was being drained).
+                self._drain(remote, auto=True)
+            elif drained and auto:
+                with self._lock:
+                    healthy = self._healthy.get(remote, 0) + 1
+                    self._healthy[remote] = healthy
+                if healthy >= recover:
+                    self.logger.info('remote {!r} of pool {!r} recovered'
+                                     .format(remote, self.name))
+                    self.undrain(remote)
+            if problem is None:
+                self._purge(remote)
+        return self.drained
+
+    def check_health(self, probes=None, *, batch=_health.BATCH,
+                     rate=_health.RATE):
+        """Probe idle members and quarantine the ones that fail.
+
+        Up to 'batch' idle members (or all of them, if None) are probed,
+        the ones checked longest ago first.  Each gets every probe (see
+        the health module), stopping at the first failure.  No more
+        than 'rate' probes are run per second.  Members handed out in
+        the meantime are left alone.  The quarantined members are
+        returned.
+        """
+        probes = _health.resolve(probes)
+        with self._lock:
+            members = set(chain(self._idle, self._busy, self._resetting))
+            checked = self._checked = {c: t for c, t in self._checked.items()
+                                       if c in members}
+            if batch is None:
+                batch = len(self._idle)
+            containers = heapq.nsmallest(
+                    batch, self._idle, key=lambda c: checked.get(c, 0.0))
+        spacing = 1.0 / rate if rate else 0.0
+        nextprobe = time.monotonic()
+        broken = []
+        for container in containers:
+            problem = None
+            for probe in probes:
+                delay = nextprobe - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                nextprobe = max(nextprobe, time.monotonic()) + spacing
+                problem = _health.run(probe, self.lxc, container)
+                if problem is not None:
+                    break
+            with self._lock:
+                checked[container] = time.monotonic()
+            if problem is not None and self._quarantine(container, problem):
+                broken.append(container)
+        return broken
+
+    def close(self):
+        """Wait for any pending background resets to finish."""
+        with self._lock:
+            resetter, self._resetter = self._resetter, None
+        if resetter is not None:
+            resetter.shutdown(wait=True)
+
+    # internal methods
+
+    def _total(self):
+        # The caller must hold the lock.
+        return (len(self._idle) + len(self._busy) + len(self._resetting)
+                + len(self._returning) + len(self._elsewhere)
+                + self._launching)
+
+    def _wait(self, timeout, block, priority, tenant):
+        # The caller must hold the lock.  If the returned waiter has no
+        # container then the caller must launch a new one (_launching
+        # was already incremented for it).  None is returned if we
+        # weren't served straight away and 'block' is False.
+        waiter = _Waiter(self._lock, priority, tenant)
+        self._waiters.push(waiter)
+        admission = self.admission is not None
+        if admission:
+            self._serve()
+        endtime = None if timeout is None else time.monotonic() + timeout
+        while waiter.container is None and not waiter.grow:
+            if not block:
+                self._waiters.remove(waiter)
+                return None
+            delay = None
+            if endtime is not None:
+                delay = endtime - time.monotonic()
+                if delay <= 0:
+                    self._waiters.remove(waiter)
+                    self._timeouts.inc()
+                    if admission and self._starved is not None:
+                        raise PoolTimeoutError(
+                                'not enough resources for pool {!r} after '
+                                '{}s ({})'.format(self.name, timeout,
+                                                  self._starved))
+                    raise PoolTimeoutError(
+                            'no container available in pool {!r} after {}s'
+                            .format(self.name, timeout))
+            if admission:
+                # Nothing tells us when the host frees up, so we look
+                # again every so often.
+                delay = _resources.POLL if delay is None else min(
+                        delay, _resources.POLL)
+            waiter.ready.wait(delay)
+            if admission and waiter.container is None and not waiter.grow:
+                self._serve()
+        return waiter
+
+    def _expired(self):
+        # The caller must hold the lock.  Take the surplus members that
+        # have been idle for 'linger' seconds out of the idle queue (the
+        # longest idle first) and return them.  See _shrink().
+        expired = []
+        if self._total() <= self._target:
+            return expired
+        deadline = time.monotonic() - self.linger
+        while (self._idle and self._total() > self._target
+               and self._idle.since() <= deadline):
+            expired.append(self._idle.popleft())
+        return expired
+
+    def _shrink(self, container):
+        # Destroy the (formerly idle) surplus member.  Return True if
+        # it was ours to destroy.
+        if not self._claim_stored(container, DELETING):
+            return False
+        self.logger.debug('shrinking pool %r (removing %s)',
+                          self.name, container)
+        self._record(container, None)
+        self._destroy(container)
+        return True
+
+    def _put_idle(self, container, *, fresh=False):
+        # The caller must hold the lock, and the container must already
+        # be recorded as idle.  If someone is waiting then the container
+        # goes straight to them (and False is returned).  In that case
+        # they take care of updating the store.  'fresh' indicates the
+        # container was just reset (or launched).
+        if self._waiters:
+            waiter = self._waiters.pop()
+            if waiter is not None:
+                self._hand(waiter, container, fresh, claim=True)
+                return False
+        self._idle.append(container)
+        return True
+
+    def _hand_off(self, container):
+        # The caller must hold the lock.  Hand the (just released)
+        # container to someone waiting, if there is anyone.  Since it
+        # was never recorded as idle, nobody else can have it.
+        if self._waiters:
+            waiter = self._waiters.pop()
+            if waiter is not None:
+                self._hand(waiter, container)
+                return True
+        return False
+
+    def _hand(self, waiter, container, fresh=False, *, claim=False):
+        # The caller must hold the lock.  If 'claim' is True then the
+        # container is recorded as idle, so the waiter has to claim it
+        # (see _claim_stored()).
+        waiter.container = container
+        waiter.fresh = fresh
+        waiter.claim = claim
+        self._busy.add(container)
+        self._hold(container, waiter.tenant)
+        waiter.ready.notify()
+
+    def _hold(self, container, tenant):
+        # The caller must hold the lock.
+        self._holders[container] = tenant
+        self._waiters.take(tenant)
+
+    def _unhold(self, container):
+        # The caller must hold the lock.  This must be done wherever a
+        # busy container is taken back (or goes away), so its tenant's
+        # cap isn't left used up.
+        tenant = self._holders.pop(container, None)
+        if tenant is not None:
+            self._waiters.give(tenant)
+
+    def _dispatch(self):
+        # The caller must hold the lock.  Hand idle containers to any
+        # waiters that may now have them (e.g. their tenant was at its
+        # cap until now).  Whoever gets one updates the store.
+        while self._idle and self._waiters:
+            waiter = self._waiters.pop()
+            if waiter is None:
+                break
+            self._hand(waiter, self._pop_idle(), claim=True)
+
+    def _serve(self):
+        # The caller must hold the lock.  Hand out whatever the waiters
+        # may now have (for an admission, which may have let up).
+        self._dispatch()
+        self._wake_grower()
+
+    def _wake_grower(self):
+        # The caller must hold the lock.  This is for when the pool
+        # shrinks unexpectedly, leaving room for someone to grow it.
+        if (self._waiters and self._total() < self.maxsize
+                and self._room()):
+            waiter = self._waiters.pop()
+            if waiter is None:
+                return
+            waiter.grow = True
+            self._launching += 1
+            self._waiters.take(waiter.tenant)
+            waiter.ready.notify()
+
+    def _observe_wait(self, tenant, waited):
+        histogram = self._waits.get(tenant)
+        if histogram is None:
+            histogram = self._waits[tenant] = self._waithistogram.labels(
+                    pool=self.name, tenant=tenant)
+        histogram.observe(waited)
+
+    def _admits(self):
+        # The caller must hold the lock.  This is the waiters' 'admit'
+        # (see tenants.FairQueue): whether the admission lets in the
+        # next container.
+        problem = self.admission.admit(self.limits, self._sample())
+        if problem is not None and self._starved is None:
+            self.logger.info('pool {!r} waiting for resources ({})'
+                             .format(self.name, problem))
+        self._starved = problem
+        return problem is None
+
+    def _admission_room(self):
+        # Return how many containers the admission would let in.
+        if self.admission is None:
+            return float('inf')
+        with self._lock:
+            sample = self._sample()
+        return self.admission.room(self.limits, sample)
+
+    def _reserve(self, count):
+        # Claim the resources for 'count' new members (which fit, per
+        # _admission_room()).
+        if self.admission is not None:
+            with self._lock:
+                sample = self._sample()
+            self.admission.admit(self.limits, sample, count=count)
+
+    def _sample(self):
+        # The caller must hold the lock.  Return some busy members, for
+        # measuring their memory usage (if the pool has no memory
+        # limit).
+        if self.limits and self.limits.get('memory'):
+            return ()
+        return list(islice(self._busy, _resources.SAMPLE))
+
+    def _pop_idle(self, key=None):
+        # The caller must hold the lock (and there must be an idle
+        # container).  We take from the least busy remote, relative to
+        # its capacity (or its number of members).  If there are warm
+        # containers then see _pop_warm() first.
+        if self._affinity:
+            container = self._pop_warm(key)
+            if container is not None:
+                return container
+        if len(self.remotes) < 2:
+            return self._idle.popleft()
+        # Only the remotes with idle containers are looked at, using
+        # the per-remote counts (so this doesn't grow with the pool).
+        # A remote without a capacity is as big as its members in use.
+        loads = {}
+        for remote in self._idle.remotes():
+            busy = self._busy.count(remote)
+            size = (self.remotes.get(remote)
+                    or busy + self._idle.count(remote))
+            loads[remote] = busy / size
+        return self._idle.popleft(min(loads, key=loads.get))
+
+    def _pop_warm(self, key):
+        # The caller must hold the lock.  Return an idle container that
+        # is warm for the key, or else a clean one (regardless of its
+        # remote), or else None.
+        for container in self._bykey.get(key, ()):
+            try:
+                self._idle.remove(container)
+            except ValueError:
+                # It isn't idle.
+                continue
+            return container
+        return self._idle.popclean()
+
+    def _claim(self, container, key):
+        # The caller must hold the lock.  Return (hit, dirty) for the
+        # (newly busy) container.  It is dirty if it is warm for some
+        # other key, in which case it has to be reset (see
+        # _reset_now()).
+        keys = self._affinity.get(container)
+        if keys is None:
+            return False, False
+        if key is not None and key in keys:
+            keys.move_to_end(key)
+            return True, False
+        self._forget(container)
+        return False, True
+
+    def _remember(self, container, key):
+        # The caller must hold the lock.  Return the container's keys.
+        keys = self._affinity.get(container)
+        if keys is None:
+            keys = self._affinity[container] = OrderedDict()
+        keys[key] = None
+        keys.move_to_end(key)
+        self._bykey.setdefault(key, {})[container] = None
+        while len(keys) > self.maxkeys:
+            oldest, _ = keys.popitem(last=False)
+            self._unkey(container, oldest)
+        return list(keys)
+
+    def _forget(self, container):
+        # The caller must hold the lock.
+        for key in self._affinity.pop(container, None) or ():
+            self._unkey(container, key)
+
+    def _unkey(self, container, key):
+        # The caller must hold the lock.
+        containers = self._bykey.get(key)
+        if containers is not None:
+            containers.pop(container, None)
+            if not containers:
+                del self._bykey[key]
+
+    def _count_affinity(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        (self._affinityhits if hit else self._affinitymisses).inc()
+        if self.store is not None:
+            self.store.count_affinity(self.name, hits=int(hit),
+                                      misses=int(not hit))
+
+    def _remote_counts(self):
+        # The caller must hold the lock.  Members being launched count,
+        # as do broken ones (which still take up room).
+        counts = dict(self._placed)
+        for container in chain(self._idle, self._busy, self._resetting,
+                               self._returning, self._broken,
+                               self._elsewhere):
+            remote, _ = _remotes.split(container)
+            counts[remote] = counts.get(remote, 0) + 1
+        return counts
+
+    def _free(self):
+        # The caller must hold the lock.  Return {remote: free slots}
+        # for each remote that may get new members.
+        free = {remote: capacity for remote, capacity in self.remotes.items()
+                if remote not in self._drained}
+        if any(capacity is not None for capacity in free.values()):
+            counts = self._remote_counts()
+            for remote, capacity in free.items():
+                if capacity is not None:
+                    free[remote] = max(0, capacity - counts.get(remote, 0))
+        return free
+
+    def _room(self):
+        # The caller must hold the lock.  Return how many more members
+        # the remotes have room for (which may be infinite).
+        free = self._free().values()
+        if None in free:
+            return float('inf')
+        return sum(free)
+
+    def _place(self):
+        # The caller must hold the lock.  Return the remote with the
+        # most room left (or None if they are all full or drained).
+        # Remotes without a capacity are always roomiest, with ties
+        # going to the one with the fewest members.
+        free = self._free()
+        if len(free) < 2:
+            for remote, slots in free.items():
+                return remote if slots != 0 else None
+            return None
+        counts = self._remote_counts()
+        best = None
+        for remote, slots in free.items():
+            if slots == 0:
+                continue
+            key = (float('inf') if slots is None else slots,
+                   -counts.get(remote, 0))
+            if best is None or key > best[0]:
+                best = (key, remote)
+        return best[1] if best is not None else None
+
+    def _drain(self, remote, *, auto):
+        with self._lock:
+            if not auto or remote not in self._drained:
+                self._drained[remote] = auto
+            idle = list(self._idle.on(remote))
+            for container in idle:
+                self._idle.remove(container)
+            self._stale.update(c for c in chain(self._busy, self._resetting,
+                                                self._returning)
+                               if _remotes.split(c)[0] == remote)
+        for container in idle:
+            if not self._claim_stored(container, DELETING):
+                continue
+            self.logger.debug('removing %s (drained)', container)
+            self._record(container, None)
+            self._destroy(container)
+        self._refill()
+
+    def _probe(self, remote, maxlatency):
+        # Return what is wrong with the remote (or None).
+        start = time.monotonic()
+        try:
+            self.lxc.list('{}={}'.format(CONFIG_KEY, self.name),
+                          remote=remote or None)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            return 'unreachable: {}'.format(exc)
+        elapsed = time.monotonic() - start
+        if elapsed > maxlatency:
+            return 'overloaded: took {:.1f}s to answer'.format(elapsed)
+        return None
+
+    def _apply_limits(self, limits):
+        old = self.limits or {}
+        self.limits = limits
+        new = _resources.config(limits)
+        dropped = set(_resources.config(old)) - set(new)
+        with self._lock:
+            containers = list(chain(self._idle, self._busy, self._resetting))
+        for container in containers:
+            try:
+                for key, value in sorted(new.items()):
+                    self.lxc.config_set(container, key, value)
+                for key in sorted(dropped):
+                    self.lxc.config_unset(container, key)
+            except (subprocess.CalledProcessError, OSError) as exc:
+                self.logger.warning('could not apply the limits to {} ({})'
+                                    .format(container, exc))
+
+    def _quarantine(self, container, problem):
+        # Return True if the container was quarantined (i.e. it was
+        # still idle).
+        with self._lock:
+            try:
+                self._idle.remove(container)
+            except ValueError:
+                return False
+            self._broken[container] = problem
+            self._checked.pop(container, None)
+            self._forget(container)
+        if not self._claim_stored(container, BROKEN, note=problem):
+            return False
+        with self._lock:
+            excess = []
+            while len(self._broken) > self.quarantine:
+                oldest = next(iter(self._broken))
+                del self._broken[oldest]
+                excess.append(oldest)
+        self.logger.warning('quarantining {} in pool {!r} ({})'
+                            .format(container, self.name, problem))
+        self._quarantined.inc()
+        for container in excess:
+            self.logger.debug('removing %s (quarantined too long)',
+                              container)
+            self._record(container, None)
+            self._destroy(container)
+        self._refill()
+        return True
+
+    def _destroy(self, container):
+        # A container on a drained remote might be out of reach, in
+        # which case it is kept as a pending delete until the remote
+        # can be reached again (see _purge()).
+        try:
+            self.lxc.delete(container)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            if _remotes.split(container)[0] not in self._drained:
+                raise
+            self.logger.warning('could not destroy {} ({}), will retry'
+                                .format(container, exc))
+            with self._lock:
+                self._deleting.add(container)
+            self._record(container, DELETING)
+
+    def _purge(self, remote, found=None):
+        # Delete the pending deletes on the (reachable) remote.  'found'
+        # is the pool's containers there, if already listed.
+        with self._lock:
+            pending = [c for c in self._deleting
+                       if _remotes.split(c)[0] == remote]
+        if not pending:
+            return
+        if found is None:
+            try:
+                rows, _ = _list_members(self.lxc, self.name, [remote],
+                                        self.logger)
+            except (subprocess.CalledProcessError, OSError):
+                return
+            found = {container for container, _ in rows}
+        for container in pending:
+            if container in found:
+                self.logger.info('removing {} (left behind)'
+                                 .format(container))
+                try:
+                    self.lxc.delete(container)
+                except (subprocess.CalledProcessError, OSError) as exc:
+                    self.logger.warning('could not destroy {} ({})'
+                                        .format(container, exc))
+                    continue
+            with self._lock:
+                self._deleting.discard(container)
+            self._record(container, None)
+
+    def _reset_now(self, container):
+        # Reset the (busy) container before it is handed out.
+        start = time.perf_counter()
+        try:
+            self.lxc.restore(container, BASELINE)
+        except Exception as exc:
+            self.logger.error('could not reset {} ({}), destroying it'
+                              .format(container, exc))
+            self._resetfailures.inc()
+            with self._lock:
+                self._busy.discard(container)
+                self._unhold(container)
+                self._wake_grower()
+                if self._idle and self._waiters:
+                    self._dispatch()
+            self._record(container, None)
+            self._destroy(container)
+            self._refill()
+            raise
+        self._timings['reset'].observe(time.perf_counter() - start)
+
+    def _get_resetter(self):
+        with self._lock:
+            if self._resetter is None:
+                self._resetter = ThreadPoolExecutor(
+                        max_workers=MAX_RESETTERS)
+            return self._resetter
+
+    def _reset(self, container):
+        start = time.perf_counter()
+        with span(self.logger, 'reset', pool=self.name, container=container):
+            self._restore(container)
+        self._timings['reset'].observe(time.perf_counter() - start)
+
+    def _restore(self, container):
+        self.logger.debug('resetting %s', container)
+        try:
+            self.lxc.restore(container, BASELINE)
+        except Exception as exc:
+            # We don't hand out a container in an unknown state.
+            self.logger.error('could not reset {} ({}), destroying it'
+                              .format(container, exc))
+            self._resetfailures.inc()
+            with self._lock:
+                self._resetting.discard(container)
+                self._wake_grower()
+            self._record(container, None)
+            self._destroy(container)
+            return
+        with self._lock:
+            self._forget(container)
+            stale = container in self._stale
+            if stale:
+                self._resetting.discard(container)
+                self._stale.discard(container)
+                self._wake_grower()
+        if stale:
+            self._record(container, None)
+            self._destroy(container)
+            self._refill()
+            return
+        # It is only put back once it is recorded as idle (see
+        # _release()).
+        self._record(container, IDLE, reset=True)
+        self._put_back(container, fresh=True)
+
+    def _put_back(self, container, *, fresh=False):
+        # Put the released (or reset) container back in the pool, now
+        # that it is recorded as idle, unless it went stale meanwhile.
+        with self._lock:
+            self._returning.discard(container)
+            self._resetting.discard(container)
+            stale = container in self._stale
+            if stale:
+                self._stale.discard(container)
+                self._wake_grower()
+            else:
+                self._put_idle(container, fresh=fresh)
+        if stale and self._claim_stored(container, DELETING):
+            self._record(container, None)
+            self._destroy(container)
+            self._refill()
+
+    def _refill(self):
+        # Replace a container that went away, in the background.
+        with self._lock:
+            if self._total() >= self._target:
+                return
+        self._get_resetter().submit(self.replenish)
+
+    def _register(self):
+        if self.store is None:
+            return
+        if self.store.get_pool(self.name) is None:
+            self.store.add_pool(self.name, self.size, self.maxsize,
+                                self.image, remotes=self._stored_remotes(),
+                                limits=self.limits, tenants=self.tenants)
+
+    def _stored_remotes(self):
+        if self.remotes == _remotes.DEFAULT:
+            return None
+        return self.remotes
+
+    def _claim_stored(self, container, state, **kwargs):
+        # Record the (formerly idle) container's new state, unless some
+        # other process claimed it first.  In that case it is left to
+        # them (see _lost()) and False is returned.
+        if self.store is None:
+            return True
+        if self.store.claim_member(container, state, **kwargs):
+            return True
+        self._lost(container)
+        return False
+
+    def _lost(self, container):
+        # Another process holds the container now (or it is gone).
+        member = self.store.get_member(container)
+        with self._lock:
+            self._busy.discard(container)
+            self._resetting.discard(container)
+            self._broken.pop(container, None)
+            self._unhold(container)
+            self._forget(container)
+            if member is not None and member.pool == self.name:
+                self._elsewhere[container] = member.state
+        self.logger.info('{} was taken by another process'
+                         .format(container))
+
+    def _reclaim(self):
+        # Take back the members held elsewhere (see load() and _lost())
+        # that have since been put back by their holders.
+        if self.store is None:
+            return
+        idle = self.store.members(self.name, IDLE)
+        with self._lock:
+            for member in idle:
+                if self._elsewhere.pop(member.name, None) is not None:
+                    self._put_idle(member.name)
+
+    def _record(self, container, state, **kwargs):
+        # A state of None means the container is gone.
+        if state is None and (container in self._affinity
+                              or container in self._holders):
+            with self._lock:
+                self._forget(container)
+                self._unhold(container)
+        if self.store is None:
+            return
+        if state is None:
+            self.store.remove_member(container)
+        else:
+            self.store.set_member(self.name, container, state, **kwargs)
+
+    def _sync(self, rows, reached):
+        # 'reached' is the remotes that the rows cover.
+        found = {container for container, _ in rows}
+        for remote in reached:
+            self._purge(remote, found)
+        for container, status in rows:
+            if container in self._deleting:
+                # _purge() couldn't delete it.
+                continue
+            if status.upper() != 'RUNNING':
+                self.lxc.start(container)
+            if container not in self:
+                self._record(container, IDLE)
+                with self._lock:
+                    self._index(container)
+                    self._put_idle(container)
+        with self._lock:
+            gone = [c for c in chain(self._idle, self._broken)
+                    if c not in found and _remotes.split(c)[0] in reached]
+            for container in gone:
+                if container in self._broken:
+                    del self._broken[container]
+                else:
+                    self._idle.remove(container)
+        for container in gone:
+            self.logger.warning('{} is gone, dropping it'.format(container))
+            self._record(container, None)
+
+    def _add(self, container, affinity=None):
+        # The caller is responsible for starting the container.  This is
+        # only for use while loading the pool.
+        self._index(container)
+        for key in affinity or ():
+            self._remember(container, key)
+        self._idle.append(container)
+
+    def _index(self, container):
+        # The caller must hold the lock, if necessary.
+        try:
+            _, _, index = container.rpartition('-')
+            index = int(index)
+        except ValueError:
+            pass
+        else:
+            self._nextindex = max(self._nextindex, index + 1)
+
+    def _newname(self):
+        # The new container is placed on a remote (see _place()), so
+        # the caller must call _unplace() once it is launched (or not).
+        with self._lock:
+            remote = self._place()
+            if remote is None:
+                raise PoolError('no room left for pool {!r} on any remote'
+                                .format(self.name))
+            self._placed[remote] = self._placed.get(remote, 0) + 1
+            index = self._nextindex
+            self._nextindex += 1
+        return _remotes.qualify(remote, '{}-{}'.format(self.name, index))
+
+    def _unplace(self, container):
+        # The caller must hold the lock.
+        remote, _ = _remotes.split(container)
+        self._placed[remote] -= 1
+        if not self._placed[remote]:
+            del self._placed[remote]
+
+    async def _acreate(self, count):
+        # The caller is responsible for adding 'count' to _launching.
+        lxc = self.lxc.aio(limit=asyncio.Semaphore(self.parallel))
+        image = self._resolve_image()
+        results = await asyncio.gather(
+                *(self._alaunch(lxc, image) for _ in range(count)),
+                return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _alaunch(self, lxc, image):
+        container = None
+        try:
+            container = self._newname()
+            remote, _ = _remotes.split(container)
+            config = self._config()
+            if self.clone:
+                # Everyone on the remote has to wait for the golden
+                # container anyway.
+                loop = asyncio.get_event_loop()
+                golden = await loop.run_in_executor(
+                        None, self._ensure_golden, image, remote)
+                start = time.monotonic()
+                self.logger.debug('copying %s from %s', container, golden)
+                await lxc.copy(golden, container, config=config)
+                await lxc.start(container)
+            else:
+                # (A copy gets it from the golden container.)
+                config[SOURCE_KEY] = image
+                start = time.monotonic()
+                self.logger.debug('launching %s from %s', container, image)
+                await lxc.launch(image, container, config=config)
+            await lxc.snapshot(container, BASELINE)
+        except BaseException:
+            with self._lock:
+                self._launching -= 1
+                if container is not None:
+                    self._unplace(container)
+                self._wake_grower()
+            raise
+        elapsed = time.monotonic() - start
+        log_span(self.logger, 'launch', elapsed, pool=self.name,
+                 container=container, clone=self.clone)
+        self._timings['launch'].observe(elapsed)
+        self._record(container, IDLE, reset=True)
+        with self._lock:
+            self._launching -= 1
+            self._unplace(container)
+            self._note_launch(elapsed)
+            self._put_idle(container, fresh=True)
+        return container
+
+    def _config(self):
+        config = _resources.config(self.limits)
+        config[CONFIG_KEY] = self.name
+        return config
+
+    def _resolve_image(self):
+        if self.images is None:
+            return self.image
+        return self.images.resolve(self.image)
+
+    def _launch(self):
+        # The caller is responsible for adding the container to the
+        # pool (and for _launching).
+        container = self._newname()
+        try:
+            remote, _ = _remotes.split(container)
+            image = self._resolve_image()
+            config = self._config()
+            if self.clone:
+                golden = self._ensure_golden(image, remote)
+                start = time.monotonic()
+                self.logger.debug('copying %s from %s', container, golden)
+                self.lxc.copy(golden, container, config=config)
+                self.lxc.start(container)
+            else:
+                # (A copy gets it from the golden container.)
+                config[SOURCE_KEY] = image
+                start = time.monotonic()
+                self.logger.debug('launching %s from %s', container, image)
+                self.lxc.launch(image, container, config=config)
+            self.lxc.snapshot(container, BASELINE)
+        finally:
+            with self._lock:
+                self._unplace(container)
+        elapsed = time.monotonic() - start
+        log_span(self.logger, 'launch', elapsed, pool=self.name,
+                 container=container, clone=self.clone)
+        self._timings['launch'].observe(elapsed)
+        with self._lock:
+            self._note_launch(elapsed)
+        return container
+
+    def _ensure_golden(self, image, remote=_remotes.LOCAL):
+        # Make sure the remote's golden container exists and is up to
+        # date with the image (which may be a fingerprint, see
+        # _resolve_image()).  Its (qualified) name is returned.
+        name = self.golden
+        golden = _remotes.qualify(remote, name)
+        with self._goldenlock:
+            if self._golden.get(remote) == image:
+                return golden
+            rows = self.lxc.list(name, remote=remote or None)
+            if any(row[0] == name for row in rows):
+                if self.lxc.config_get(golden, SOURCE_KEY) == image:
+                    self._golden[remote] = image
+                    return golden
+                self.logger.info('rebuilding {} (image changed)'
+                                 .format(golden))
+                self.lxc.delete(golden)
+            self.logger.info('launching {} from {}'.format(golden, image))
+            self.lxc.launch(image, golden, config={SOURCE_KEY: image})
+            self.lxc.stop(golden)
+            self._golden[remote] = image
+            return golden
+
+    def _note_launch(self, elapsed):
+        # The caller must hold the lock.
+        if self._launchtime is None:
+            self._launchtime = elapsed
+        else:
+            self._launchtime += LAUNCHTIME_WEIGHT * (elapsed
+                                                     - self._launchtime)
+
+
+def _list_members(lxc, name, remotes, logger):
+    # Return the (qualified) rows for the pool's members on each of its
+    # remotes, along with the remotes that could be reached.
+    rows = []
+    reached = []
+    for remote in remotes:
+        try:
+            found = lxc.list('{}={}'.format(CONFIG_KEY, name),
+                             remote=remote or None)
+        except subprocess.CalledProcessError as exc:
+            if len(remotes) < 2:
+                raise
+            logger.warning('could not list the containers on remote {!r} '
+                           '({})'.format(remote, exc))
+            continue
+        reached.append(remote)
+        rows.extend((_remotes.qualify(remote, container), status)
+                    for container, status in found)
+    return rows, reached
+
+
+def _check_sizes(size, maxsize):
+    if size < 0:
+        raise ValueError('size must be non-negative, got {}'.format(size))
+    if maxsize is None:
+        maxsize = size
+    elif maxsize < size:
+        raise ValueError('maxsize ({}) must not be less than size ({})'
+                         .format(maxsize, size))
+    return size, maxsize
+
+
+class _Idle:
+    """The idle members, in the order they became idle.
+
+    They are also kept by remote, so taking the next one from a given
+    remote doesn't mean looking through them all.  Likewise, those that
+    aren't warm (i.e. not in 'warm', the pool's affinity) when they
+    become idle are kept apart.  Otherwise it is used like a deque.
+    """
+
+    __slots__ = ('_all', '_byremote', '_clean', '_warm')
+
+    def __init__(self, warm):
+        self._all = OrderedDict()  # container -> when it became idle
+        self._byremote = {}  # remote -> OrderedDict of its containers
+        self._clean = OrderedDict()  # the ones that aren't warm
+        self._warm = warm
+
+    def __len__(self):
+        return len(self._all)
+
+    def __iter__(self):
+        return iter(self._all)
+
+    def __contains__(self, container):
+        return container in self._all
+
+    def append(self, container):
+        self._all[container] = time.monotonic()
+        remote, _ = _remotes.split(container)
+        containers = self._byremote.get(remote)
+        if containers is None:
+            containers = self._byremote[remote] = OrderedDict()
+        containers[container] = None
+        if container not in self._warm:
+            self._clean[container] = None
+
+    def remove(self, container):
+        try:
+            del self._all[container]
+        except KeyError:
+            raise ValueError(container)
+        self._unremote(container)
+
+    def popleft(self, remote=None):
+        """Remove and return the oldest (on the remote, if given)."""
+        containers = self._all if remote is None else self._byremote[remote]
+        container = next(iter(containers))
+        self.remove(container)
+        return container
+
+    def popclean(self):
+        """Remove and return the oldest that isn't warm (or None)."""
+        if not self._clean:
+            return None
+        container = next(iter(self._clean))
+        self.remove(container)
+        return container
+
+    def pop(self):
+        """Remove and return the newest."""
+        container, _ = self._all.popitem()
+        self._unremote(container)
+        return container
+
+    def clear(self):
+        self._all.clear()
+        self._byremote.clear()
+        self._clean.clear()
+
+    def since(self):
+        """Return when the oldest became idle."""
+        return next(iter(self._all.values()))
+
+    def remotes(self):
+        """Return the remotes with idle containers."""
+        return self._byremote.keys()
+
+    def on(self, remote):
+        """Return the idle containers on the remote."""
+        return iter(self._byremote.get(remote, ()))
+
+    def count(self, remote):
+        """Return how many idle containers the remote has."""
+        return len(self._byremote.get(remote, ()))
+
+    def _unremote(self, container):
+        self._clean.pop(container, None)
+        remote, _ = _remotes.split(container)
+        containers = self._byremote[remote]
+        del containers[container]
+        if not containers:
+            del self._byremote[remote]
+
+
+class _Busy(set):
+    """The busy members, with a count for each remote."""
+
+    __slots__ = ('_counts',)
+
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+
+    def add(self, container):
+        if container not in self:
+            super().add(container)
+            remote, _ = _remotes.split(container)
+            self._counts[remote] = self._counts.get(remote, 0) + 1
+
+    def remove(self, container):
+        super().remove(container)
+        self._uncount(container)
+
+    def discard(self, container):
+        if container in self:
+            self.remove(container)
+
+    def count(self, remote):
+        """Return how many busy containers the remote has."""
+        return self._counts.get(remote, 0)
+
+    def _uncount(self, container):
+        remote, _ = _remotes.split(container)
+        count = self._counts[remote] - 1
+        if count:
+            self._counts[remote] = count
+        else:
+            del self._counts[remote]
+
+
+class _Waiter:
+    """A caller blocked in Pool.acquire()."""
+
+    __slots__ = ('ready', 'container', 'fresh', 'claim', 'grow', 'priority',
+                 'tenant', 'since', 'finish')
+
+    def __init__(self, lock, priority=_tenants.PRIORITY,
+                 tenant=_tenants.DEFAULT):
+        self.ready = threading.Condition(lock)
+        self.container = None
+        self.fresh = False
+        self.claim = False  # (see Pool._hand())
+        self.grow = False
+        self.priority = priority
+        self.tenant = tenant
+        self.since = None
+        self.finish = None
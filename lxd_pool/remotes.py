@@ -0,0 +1,99 @@
+"""Pools that span several LXD hosts ("remotes", as in "lxc remote").
+
+A pool's members may live on any of its remotes.  A member on a remote
+other than the default one is named "<remote>:<name>", just like lxc
+expects, so it can be passed to any lxc command as-is.  The default
+remote (whatever lxc uses when none is given) is LOCAL.
+
+Each remote may have a capacity (the most members it will hold).  See
+Pool for how members are placed and how remotes get drained.
+"""
+import logging
+
+from ._util.threads import PeriodicWorker
+
+
+LOCAL = ''  # the default remote
+DEFAULT = {LOCAL: None}  # {remote: capacity}
+
+INTERVAL = 10.0  # seconds
+MAXLATENCY = 5.0  # seconds (before a remote counts as overloaded)
+RECOVER = 3  # healthy checks in a row before a drained remote is used again
+
+
+_logger = logging.getLogger(__name__)
+
+
+def split(container):
+    """Return (remote, name) for the container."""
+    remote, sep, name = container.partition(':')
+    if not sep:
+        return LOCAL, container
+    return remote, name
+
+
+def qualify(remote, name):
+    """Return the name that lxc knows the container on the remote by."""
+    if remote == LOCAL:
+        return name
+    return '{}:{}'.format(remote, name)
+
+
+def parse(spec):
+    """Return (remote, capacity) for "REMOTE[=CAPACITY]"."""
+    remote, sep, capacity = spec.partition('=')
+    remote = remote.rstrip(':')
+    if not sep:
+        return remote, None
+    capacity = int(capacity)
+    if capacity < 0:
+        raise ValueError('capacity must be non-negative, got {}'
+                         .format(capacity))
+    return remote, capacity
+
+
+def normalize(remotes):
+    """Return the {remote: capacity} for the given remotes.
+
+    'remotes' may be None (just the default remote), a mapping of
+    remote name to capacity (or None), or a sequence of remote names
+    (each optionally with "=CAPACITY").
+    """
+    if not remotes:
+        return dict(DEFAULT)
+    if hasattr(remotes, 'items'):
+        return {remote: capacity for remote, capacity in remotes.items()}
+    return dict(parse(spec) if isinstance(spec, str) else tuple(spec)
+                for spec in remotes)
+
+
+class Monitor(PeriodicWorker):
+    """A background thread that keeps an eye on a pool's remotes.
+
+    Every 'interval' seconds the pool is asked to check its remotes
+    (see Pool.check_remotes()), which drains any that are unreachable
+    or overloaded and brings back those that recovered.
+    """
+
+    def __init__(self, pool, *, interval=INTERVAL, maxlatency=MAXLATENCY,
+                 recover=RECOVER, logger=_logger):
+        super().__init__(interval, name='remotes-{}'.format(pool.name),
+                         logger=logger)
+        self.pool = pool
+        self.maxlatency = maxlatency
+        self.recover = recover
+
+    def __repr__(self):
+        return '{}({!r}, interval={!r})'.format(
+                type(self).__name__, self.pool, self.interval)
+
+    def tick(self):
+        """Check the remotes now.  The drained remotes are returned."""
+        return self.pool.check_remotes(maxlatency=self.maxlatency,
+                                       recover=self.recover)
+
+    # internal methods
+
+    def _failed(self, exc):
+        self.logger.error('could not check the remotes of pool {!r} ({})'
+                          .format(self.pool.name, exc))
@@ -0,0 +1,93 @@
+"""Keeping a pool ahead of demand, in the background."""
+from collections import deque
+import logging
+import math
+import time
+
+from ._util.threads import PeriodicWorker
+
+
+INTERVAL = 2.0  # seconds
+WEIGHT = 0.3  # for the moving average of the acquire rate
+HOLD = 300.0  # seconds
+LEADTIME = 10.0  # seconds (until the pool knows how long a launch takes)
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Replenisher(PeriodicWorker):
+    """A background thread that resizes a pool to fit the demand on it.
+
+    Every 'interval' seconds the demand is estimated as the containers
+    in use (busy or waited on) plus those expected to be asked for
+    while a new one is launched.  The latter comes from an
+    exponentially weighted moving average of the acquire rate (see
+    'weight'), multiplied by how long a launch takes (the pool's
+    launchtime, or 'leadtime' until that is known).
+
+    The pool's target is raised right away to meet the demand, and new
+    containers are launched for it, up to the pool's maxsize.  Since
+    load is bursty, the target only comes back down once the demand has
+    stayed lower for 'hold' seconds.  Then the surplus idle containers
+    are destroyed, down to the pool's size at the least.
+    """
+
+    def __init__(self, pool, *, interval=INTERVAL, weight=WEIGHT, hold=HOLD,
+                 leadtime=LEADTIME, logger=_logger):
+        if not 0 < weight <= 1:
+            raise ValueError('weight must be in (0, 1], got {}'.format(weight))
+        super().__init__(interval, name='replenish-{}'.format(pool.name),
+                         logger=logger)
+        self.pool = pool
+        self.weight = weight
+        self.hold = hold
+        self.leadtime = leadtime
+
+        self.rate = 0.0
+        self._history = deque()
+        self._last = None
+
+    def __repr__(self):
+        return '{}({!r}, interval={!r})'.format(
+                type(self).__name__, self.pool, self.interval)
+
+    def tick(self, now=None):
+        """Resize the pool for the current demand.
+
+        The new target is returned.
+        """
+        if now is None:
+            now = time.monotonic()
+        pool = self.pool
+        acquired = pool.acquired
+        if self._last is not None:
+            lastnow, lastacquired = self._last
+            if now > lastnow:
+                sample = (acquired - lastacquired) / (now - lastnow)
+                self.rate += self.weight * (sample - self.rate)
+        self._last = (now, acquired)
+
+        leadtime = pool.launchtime or self.leadtime
+        demand = (pool.busy + pool.waiting
+                  + int(math.ceil(self.rate * leadtime)))
+
+        # Hold on to the recent peak.
+        self._history.append((now, demand))
+        while self._history and self._history[0][0] < now - self.hold:
+            self._history.popleft()
+        demand = max(d for _, d in self._history)
+
+        oldtarget = pool.target
+        target = pool.set_target(demand)
+        if target != oldtarget:
+            self.logger.info('pool {!r} target {} -> {} (rate {:.2f}/s)'
+                             .format(pool.name, oldtarget, target, self.rate))
+        pool.replenish()
+        return target
+
+    # internal methods
+
+    def _failed(self, exc):
+        self.logger.error('could not replenish pool {!r} ({})'
+                          .format(self.pool.name, exc))
@@ -0,0 +1,229 @@
+"""Keeping pools within what the host's memory and CPU can take.
+
+A pool's maxsize is just a count of containers, while what actually
+runs out is the host's RAM (and CPU).  So each pool may have resource
+limits (see LIMITS), which are applied to its members as LXD's
+"limits.cpu" and "limits.memory", and a pool may be given an
+Admission, which holds off acquires and launches while the host is
+short on memory or overloaded.
+
+The host is read from /proc (meminfo and loadavg) and each container
+from its cgroup, so this only knows about the local host.
+"""
+import logging
+import os
+import os.path
+import threading
+import time
+
+from ._util.collections import as_namespace
+
+
+MEMINFO = '/proc/meminfo'
+LOADAVG = '/proc/loadavg'
+CGROUP = '/sys/fs/cgroup'
+
+LIMITS = ('cpu', 'memory')  # the per-pool limits (see config())
+RESERVE = 0.1  # the fraction of the host's memory kept free
+MAXLOAD = 1.0  # the most load (1-minute average) per CPU
+TTL = 1.0  # seconds a reading of the host is reused
+POLL = 1.0  # seconds between checks while waiting for resources
+SAMPLE = 5  # containers whose cgroups are read to estimate usage
+
+
+_logger = logging.getLogger(__name__)
+
+
+@as_namespace('total available load cpus')
+class HostUsage:
+    """The host's memory (in bytes) and its 1-minute load average."""
+
+    @property
+    def loadpercpu(self):
+        return self.load / self.cpus
+
+
+def read_host(*, meminfo=MEMINFO, loadavg=LOADAVG):
+    """Return the current HostUsage (read from /proc)."""
+    fields = {}
+    with open(meminfo) as infile:
+        for line in infile:
+            key, _, value = line.partition(':')
+            fields[key] = int(value.split()[0]) * 1024
+    total = fields['MemTotal']
+    # MemAvailable is missing on old kernels.
+    available = fields.get('MemAvailable')
+    if available is None:
+        available = (fields.get('MemFree', 0) + fields.get('Buffers', 0)
+                     + fields.get('Cached', 0))
+    with open(loadavg) as infile:
+        load = float(infile.read().split()[0])
+    return HostUsage(total, available, load, os.cpu_count() or 1)
+
+
+def read_memory(container, *, root=CGROUP):
+    """Return the memory the (local) container is using, in bytes.
+
+    None is returned if its cgroup can't be found (e.g. the container
+    is on another remote).
+    """
+    if ':' in container:
+        return None
+    candidates = [
+            # cgroup v2
+            os.path.join(root, 'lxc.payload.' + container, 'memory.current'),
+            os.path.join(root, 'lxc.payload', container, 'memory.current'),
+            # cgroup v1
+            os.path.join(root, 'memory', 'lxc.payload.' + container,
+                         'memory.usage_in_bytes'),
+            os.path.join(root, 'memory', 'lxc', container,
+                         'memory.usage_in_bytes'),
+            ]
+    for filename in candidates:
+        try:
+            with open(filename) as infile:
+                return int(infile.read().strip())
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def normalize(limits):
+    """Return the {limit: value} for the given limits (see LIMITS).
+
+    The memory limit may be given as a size (e.g. "2G"), which is
+    turned into bytes.  Unset limits are dropped.  None is returned if
+    there are none.
+    """
+    if not limits:
+        return None
+    unknown = set(limits) - set(LIMITS)
+    if unknown:
+        raise ValueError('unsupported limits {}'.format(sorted(unknown)))
+    normalized = {}
+    if limits.get('cpu') is not None:
+        cpu = int(limits['cpu'])
+        if cpu <= 0:
+            raise ValueError('cpu limit must be positive, got {}'.format(cpu))
+        normalized['cpu'] = cpu
+    if limits.get('memory') is not None:
+        from .images import parse_size
+        normalized['memory'] = parse_size(limits['memory'])
+    return normalized or None
+
+
+def config(limits):
+    """Return the LXD container config for the limits."""
+    cfg = {}
+    for key, value in sorted((limits or {}).items()):
+        if key == 'memory':
+            value = '{}B'.format(value)
+        cfg['limits.' + key] = str(value)
+    return cfg
+
+
+class Admission:
+    """Decides whether the host can take on another container.
+
+    A container may be handed out (or launched) only if the host's
+    load per CPU stays below 'maxload' and the memory the container
+    might use still leaves 'reserve' (a fraction) of the host's memory
+    free.  A container might use up to its pool's memory limit or, if
+    the pool has none, what its busy members use on average (read from
+    their cgroups).
+
+    Readings of the host are reused for 'ttl' seconds.  The memory of
+    each container let in since the last reading is counted against
+    it, so a burst of acquires can't all get in on one reading.
+    """
+
+    def __init__(self, *, reserve=RESERVE, maxload=MAXLOAD, ttl=TTL,
+                 read=read_host, logger=_logger):
+        if not 0 <= reserve < 1:
+            raise ValueError('reserve must be in [0, 1), got {}'
+                             .format(reserve))
+        self.reserve = reserve
+        self.maxload = maxload
+        self.ttl = ttl
+        self.read = read
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._reading = None
+        self._readat = None
+        self._claimed = 0
+
+    def __repr__(self):
+        return '{}(reserve={!r}, maxload={!r})'.format(
+                type(self).__name__, self.reserve, self.maxload)
+
+    def host(self):
+        """Return the (recent) HostUsage."""
+        with self._lock:
+            return self._host()
+
+    def footprint(self, limits=None, containers=()):
+        """Return the memory one more container might take, in bytes."""
+        if limits and limits.get('memory'):
+            return limits['memory']
+        usage = [read_memory(container) for container in containers]
+        usage = [used for used in usage if used is not None]
+        if not usage:
+            return 0
+        return sum(usage) // len(usage)
+
+    def admit(self, limits=None, containers=(), count=1):
+        """Let in 'count' more containers, if the host can take them.
+
+        If it can't then the reason is returned (otherwise None).
+        'limits' are the pool's and 'containers' are (some of) its busy
+        ones, for estimating how much memory each takes (see
+        footprint()).
+        """
+        footprint = self.footprint(limits, containers)
+        with self._lock:
+            host = self._host()
+            if host.loadpercpu >= self.maxload:
+                return 'load {:.2f} per CPU (max {})'.format(
+                        host.loadpercpu, self.maxload)
+            if self._free(host) < footprint * count:
+                available = max(0, host.available - self._claimed)
+                return 'only {} MiB of memory available'.format(
+                        int(available) // 1024 ** 2)
+            self._claimed += footprint * count
+        return None
+
+    def room(self, limits=None, containers=()):
+        """Return how many more containers the host can take."""
+        footprint = self.footprint(limits, containers)
+        with self._lock:
+            host = self._host()
+            if host.loadpercpu >= self.maxload:
+                return 0
+            free = self._free(host)
+        if free <= 0:
+            return 0
+        if not footprint:
+            return float('inf')
+        return int(free // footprint)
+
+    def forget(self):
+        """Make the next check read the host again."""
+        with self._lock:
+            self._readat = None
+
+    # internal methods
+
+    def _host(self):
+        # The caller must hold the lock.
+        now = time.monotonic()
+        if self._readat is None or now - self._readat >= self.ttl:
+            self._reading = self.read()
+            self._readat = now
+            self._claimed = 0
+        return self._reading
+
+    def _free(self, host):
+        # The caller must hold the lock.  Return the memory that may
+        # still be handed out.
+        return host.available - self._claimed - self.reserve * host.total
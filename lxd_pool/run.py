@@ -0,0 +1,160 @@
+"""Fanning a command out across the containers of a pool."""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import queue
+import subprocess
+
+from ._util import os as _os
+from ._util.collections import as_namespace
+
+
+INDEX_ENV = 'LXD_POOL_INDEX'
+NUM_ENV = 'LXD_POOL_NUM'
+
+
+@as_namespace('index container returncode output')
+class Result:
+    """The outcome of one invocation of a command in a pool container."""
+
+    @property
+    def failed(self):
+        return self.returncode != 0
+
+
+def run(pool, command, num, *, reset=False, maxworkers=None, online=None,
+        batch=None, key=None, priority=0, tenant=None):
+    """Run the command 'num' times across the pool, in parallel.
+
+    The number of concurrent invocations is capped by the pool's
+    maxsize (and optionally by 'maxworkers').  Each invocation gets its
+    own container for its duration, along with its index and the total
+    number of invocations in the environment (see INDEX_ENV and
+    NUM_ENV).  If 'reset' is True then each container is restored to
+    its baseline snapshot (in the background) once the invocation
+    finishes.
+
+    A Result is yielded for each invocation as soon as it finishes,
+    so the order is not necessarily that of the indices.
+
+    If 'online' is provided then the output is streamed rather than
+    buffered: online(index, container, line) is called (from a worker
+    thread) for each line of output as it arrives, and the output of
+    each Result is None.
+
+    If 'batch' is provided then each container is used for up to that
+    many invocations (with consecutive indices), run one after another
+    in a single session (see session.Session), before it is released.
+    That saves setting up an "lxc exec" for every invocation.  The
+    invocations in a batch share the container's state, since it is
+    only reset after the batch.
+
+    If a cache 'key' is provided (e.g. the repository being built) then
+    containers that last ran something with the same key are used when
+    possible, and they are kept warm for the key rather than reset (see
+    Pool.acquire() and Pool.release()).
+
+    Each container is acquired with the given 'priority' and 'tenant'
+    (see the tenants module), which decide who gets containers first
+    while the pool is exhausted.
+    """
+    if num <= 0:
+        return
+    if batch is not None:
+        yield from _run_batched(pool, command, num, batch, reset=reset,
+                                maxworkers=maxworkers, online=online,
+                                key=key, priority=priority, tenant=tenant)
+        return
+    workers = min(num, pool.maxsize)
+    if maxworkers is not None:
+        workers = min(workers, maxworkers)
+    if workers <= 0:
+        raise ValueError('pool {!r} has no capacity'.format(pool.name))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_one, pool, command, index, num,
+                                   reset, online, key, priority, tenant)
+                   for index in range(num)]
+        try:
+            for fut in as_completed(futures):
+                yield fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
+def _run_batched(pool, command, num, batch, *, reset, maxworkers, online,
+                 key, priority, tenant):
+    if batch <= 0:
+        raise ValueError('batch must be positive, got {}'.format(batch))
+    batches = [range(start, min(start + batch, num))
+               for start in range(0, num, batch)]
+    workers = min(len(batches), pool.maxsize)
+    if maxworkers is not None:
+        workers = min(workers, maxworkers)
+    if workers <= 0:
+        raise ValueError('pool {!r} has no capacity'.format(pool.name))
+
+    # Results are yielded as each invocation finishes, not each batch.
+    results = queue.Queue()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_batch, pool, command, indices, num,
+                                   reset, online, key, priority, tenant,
+                                   results.put)
+                   for indices in batches]
+        try:
+            for _ in range(num):
+                result = results.get()
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
+def _run_batch(pool, command, indices, num, reset, online, key, priority,
+               tenant, report):
+    try:
+        container = pool.acquire(key=key, priority=priority, tenant=tenant)
+    except BaseException as exc:
+        report(exc)
+        raise
+    try:
+        with pool.lxc.session(container) as session:
+            for index in indices:
+                report(_invoke(session.exec, session.exec_stream, container,
+                               command, index, num, online))
+    except BaseException as exc:
+        report(exc)
+        raise
+    finally:
+        pool.release(container, reset=reset, key=key)
+
+
+def _run_one(pool, command, index, num, reset, online, key, priority,
+             tenant):
+    container = pool.acquire(key=key, priority=priority, tenant=tenant)
+    try:
+        lxc = pool.lxc
+        return _invoke(partial(lxc.exec, container),
+                       partial(lxc.exec_stream, container),
+                       container, command, index, num, online)
+    finally:
+        pool.release(container, reset=reset, key=key)
+
+
+def _invoke(exec, exec_stream, container, command, index, num, online):
+    env = {INDEX_ENV: index, NUM_ENV: num}
+    try:
+        if online is None:
+            output = exec(command, env=env)
+        else:
+            output = None
+            lines = exec_stream(command, env=env, errors='replace')
+            for line in lines:
+                online(index, container, line)
+    except subprocess.CalledProcessError as exc:
+        if exc.output is not None:
+            output = exc.output.decode(_os.ENCODING).strip()
+        return Result(index, container, exc.returncode, output)
+    return Result(index, container, 0, output)
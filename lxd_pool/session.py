@@ -0,0 +1,185 @@
+"""Running many commands in a container through one "lxc exec"."""
+import codecs
+import shlex
+import subprocess
+import time
+import uuid
+
+from . import metrics as _metrics
+from ._util import os as _os
+from .lxd import _exec_args
+
+
+SHELL = 'sh'
+CLOSE_TIMEOUT = 5  # seconds
+DEAD = 255  # the returncode when the session dies mid-command
+
+
+class Session:
+    """A long-lived shell in a container, fed one command at a time.
+
+    Setting up an "lxc exec" costs far more than running a short
+    command, so a session starts a single shell (through "lxc exec")
+    and runs each command in it.  Each command still gets its own
+    output and exit code: after it finishes the shell writes a marker
+    line (unique to the session) with the exit code.
+
+    exec() and exec_stream() work like those of LXC, minus the
+    container name.  Each command runs in its own "sh -c" (with stdin
+    closed and stderr going to stdout), so a command can't break the
+    session (e.g. with "exit").  If the session dies anyway then the
+    command fails with returncode DEAD and the next one gets a new
+    session.
+
+    If the LXC doesn't run the lxc CLI (e.g. it has a custom runner)
+    then each command falls back to its own LXC.exec().
+
+    A session must not be used by more than one thread at a time.
+    """
+
+    def __init__(self, lxc, name, *, env=None, logger=None):
+        self.lxc = lxc
+        self.name = name
+        self.env = env
+        self.logger = logger or lxc.logger
+        self._marker = '__lxd_pool_{}__'.format(uuid.uuid4().hex).encode()
+        self._proc = None
+        self._exectime = _metrics.exec_seconds(lxc.metrics).labels()
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.lxc,
+                                       self.name)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def persistent(self):
+        """Whether commands share one "lxc exec" (see above)."""
+        return self.lxc.runner in (None, subprocess.Popen)
+
+    def open(self):
+        """Start the shell (if not already running)."""
+        if self._proc is not None or not self.persistent:
+            return
+        args = [self.lxc.executable] + _exec_args(self.name, [SHELL],
+                                                  self.env)
+        self.logger.debug('...starting session %r', args)
+        self._proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT)
+
+    def close(self):
+        """Stop the shell."""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            proc.wait(timeout=CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+    def exec(self, command, *, env=None):
+        """Run the command and return its output.
+
+        As with LXC.exec(), CalledProcessError is raised if the command
+        fails.
+        """
+        if not self.persistent:
+            return self.lxc.exec(self.name, command, env=self._env(env))
+        lines = []
+        try:
+            for line in self.exec_stream(command, env=env):
+                lines.append(line)
+        except subprocess.CalledProcessError as exc:
+            exc.output = ''.join(lines).encode(_os.ENCODING)
+            raise
+        return ''.join(lines).strip()
+
+    def exec_stream(self, command, *, env=None, errors='strict'):
+        """Run the command, yielding its output a line at a time.
+
+        As with LXC.exec_stream(), CalledProcessError is raised at the
+        end if the command fails.
+        """
+        if not self.persistent:
+            yield from self.lxc.exec_stream(self.name, command,
+                                            env=self._env(env),
+                                            errors=errors)
+            return
+        start = time.perf_counter()
+        try:
+            yield from self._exec_stream(command, env, errors)
+        finally:
+            self._exectime.observe(time.perf_counter() - start)
+
+    # internal methods
+
+    def _exec_stream(self, command, env, errors):
+        self.open()
+        proc = self._proc
+        script = _script(command, env, self._marker.decode())
+        self.logger.debug('...running %r in session', script)
+        try:
+            proc.stdin.write(script.encode(_os.ENCODING))
+            proc.stdin.flush()
+        except BrokenPipeError:
+            self.close()
+            raise subprocess.CalledProcessError(DEAD, command)
+
+        decoder = codecs.getincrementaldecoder(_os.ENCODING)(errors)
+        prefix = self._marker + b' '
+        returncode = DEAD
+        # We hold back one line, since the marker is preceded by an
+        # extra line ending.
+        pending = None
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                if line.startswith(prefix):
+                    returncode = int(line[len(prefix):])
+                    break
+                if pending is not None:
+                    yield decoder.decode(pending)
+                pending = line
+            else:
+                # The session died.
+                self.close()
+        except BaseException:
+            # The caller stopped early, so the rest of the command's
+            # output would confuse the next one.
+            proc.kill()
+            self.close()
+            raise
+        if pending is not None and returncode != DEAD:
+            pending = pending[:-1]
+        if pending:
+            text = decoder.decode(pending, final=True)
+            if text:
+                yield text
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def _env(self, env):
+        if not self.env:
+            return env
+        return dict(self.env, **(env or {}))
+
+
+def _script(command, env, marker):
+    if isinstance(command, str):
+        command = [SHELL, '-c', command]
+    if env:
+        command = ['env'] + ['{}={}'.format(key, value)
+                             for key, value in sorted(env.items())] + command
+    return "{} </dev/null 2>&1; printf '\\n{} %d\\n' $?\n".format(
+            ' '.join(shlex.quote(str(arg)) for arg in command), marker)
@@ -0,0 +1,388 @@
+"""A local store of pool state, so we don't have to ask LXD every time."""
+import json
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+from ._util.collections import as_namespace
+
+
+ENV = 'LXD_POOL_STATE'
+FILENAME = 'state.db'
+MEMORY = ':memory:'
+TIMEOUT = 30  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    maxsize INTEGER NOT NULL,
+    image TEXT NOT NULL,
+    created REAL NOT NULL,
+    remotes TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    limits TEXT,
+    tenants TEXT
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    name TEXT PRIMARY KEY,
+    pool TEXT NOT NULL REFERENCES pools (name) ON DELETE CASCADE,
+    state TEXT NOT NULL,
+    lease TEXT,
+    lastreset REAL,
+    updated REAL NOT NULL,
+    note TEXT,
+    affinity TEXT
+);
+
+CREATE INDEX IF NOT EXISTS members_by_pool_state ON members (pool, state);
+
+CREATE TABLE IF NOT EXISTS images (
+    alias TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    added REAL NOT NULL,
+    lastused REAL
+);
+
+CREATE TABLE IF NOT EXISTS retired_images (
+    fingerprint TEXT PRIMARY KEY,
+    alias TEXT NOT NULL,
+    retired REAL NOT NULL
+);
+"""
+
+# Columns added since the tables were first created.
+MIGRATIONS = [
+        ('pools', 'remotes', 'TEXT'),
+        ('members', 'note', 'TEXT'),
+        ('pools', 'hits', 'INTEGER NOT NULL DEFAULT 0'),
+        ('pools', 'misses', 'INTEGER NOT NULL DEFAULT 0'),
+        ('members', 'affinity', 'TEXT'),
+        ('pools', 'limits', 'TEXT'),
+        ('pools', 'tenants', 'TEXT'),
+        ]
+
+
+def default_path():
+    """Return the path to the state file.
+
+    $LXD_POOL_STATE takes precedence, followed by $XDG_DATA_HOME.
+    """
+    path = os.environ.get(ENV)
+    if path:
+        return path
+    datadir = (os.environ.get('XDG_DATA_HOME')
+               or os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(datadir, 'lxd-pool', FILENAME)
+
+
+@as_namespace('name size maxsize image created remotes hits misses limits '
+              'tenants')
+class PoolRecord:
+    """The stored info for a pool.
+
+    'remotes' is a {remote: capacity} dict, or None for a pool that
+    lives on the default remote only (see the remotes module).  'hits'
+    and 'misses' count the acquires with a cache key that did (or did
+    not) get a container warm for it.  'limits' is the {limit: value}
+    applied to each member, if any (see the resources module).
+    'tenants' is the {tenant: {'weight': WEIGHT, 'cap': CAP}} sharing
+    the pool, if any (see the tenants module).
+    """
+
+    @classmethod
+    def from_row(cls, row):
+        (name, size, maxsize, image, created, remotes, hits, misses,
+         limits, tenants) = row
+        if remotes is not None:
+            remotes = json.loads(remotes)
+        if limits is not None:
+            limits = json.loads(limits)
+        if tenants is not None:
+            tenants = json.loads(tenants)
+        return cls(name, size, maxsize, image, created, remotes, hits,
+                   misses, limits, tenants)
+
+
+@as_namespace('name pool state lease lastreset updated note affinity')
+class MemberRecord:
+    """The stored info for one container in a pool.
+
+    'note' says what is wrong with a broken (quarantined) member.
+    'affinity' is the cache keys it is warm for (least recent first),
+    since it was last reset.
+    """
+
+    @classmethod
+    def from_row(cls, row):
+        *row, affinity = row
+        if affinity is not None:
+            affinity = json.loads(affinity)
+        return cls(*row, affinity)
+
+
+@as_namespace('alias source fingerprint size added lastused')
+class ImageRecord:
+    """The stored info for an image in the local cache."""
+
+
+class Store:
+    """The persistent state of all pools, backed by SQLite.
+
+    Members are indexed by pool and state, so the per-pool summaries
+    (e.g. for "lxd-pool status") don't depend on the number of
+    containers known to LXD.  The store may be shared between threads
+    and (thanks to SQLite's WAL mode) between processes.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = default_path()
+        if path != MEMORY:
+            dirname = os.path.dirname(os.path.abspath(path))
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=TIMEOUT,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        with self._lock:
+            if path != MEMORY:
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA foreign_keys=ON')
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _migrate(self):
+        # The caller must hold the lock.
+        for table, column, coltype in MIGRATIONS:
+            rows = self._conn.execute('PRAGMA table_info({})'.format(table))
+            if column not in (row[1] for row in rows):
+                self._conn.execute('ALTER TABLE {} ADD COLUMN {} {}'
+                                   .format(table, column, coltype))
+
+    # pools
+
+    def add_pool(self, name, size, maxsize, image, *, remotes=None,
+                 limits=None, tenants=None):
+        """Record a new pool.  KeyError is raised if it already exists."""
+        try:
+            self._execute('INSERT INTO pools '
+                          '(name, size, maxsize, image, created, remotes, '
+                          'limits, tenants) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (name, size, maxsize, image, time.time(),
+                           _encode(remotes), _encode(limits),
+                           _encode(tenants)))
+        except sqlite3.IntegrityError:
+            raise KeyError(name)
+
+    def update_pool(self, name, **changes):
+        """Update the given fields of the pool's record."""
+        if not changes:
+            return
+        fields = set(changes) - {'size', 'maxsize', 'image', 'remotes',
+                                 'limits', 'tenants'}
+        if fields:
+            raise ValueError('unsupported fields {}'.format(sorted(fields)))
+        for field in ('remotes', 'limits', 'tenants'):
+            if field in changes:
+                changes = dict(changes,
+                               **{field: _encode(changes[field])})
+        names = sorted(changes)
+        sql = 'UPDATE pools SET {} WHERE name = ?'.format(
+                ', '.join('{} = ?'.format(field) for field in names))
+        self._execute(sql, [changes[field] for field in names] + [name])
+
+    def count_affinity(self, name, *, hits=0, misses=0):
+        """Add to the pool's cache-key hits and misses."""
+        self._execute('UPDATE pools SET hits = hits + ?, misses = misses + ? '
+                      'WHERE name = ?', (hits, misses, name))
+
+    def remove_pool(self, name):
+        """Forget the pool and its members."""
+        self._execute('DELETE FROM pools WHERE name = ?', (name,))
+
+    def get_pool(self, name):
+        """Return the PoolRecord for the pool (or None)."""
+        rows = self._execute('SELECT * FROM pools WHERE name = ?', (name,))
+        return PoolRecord.from_row(rows[0]) if rows else None
+
+    def pools(self):
+        """Return the PoolRecord for every known pool."""
+        rows = self._execute('SELECT * FROM pools ORDER BY name')
+        return [PoolRecord.from_row(row) for row in rows]
+
+    # members
+
+    def set_member(self, pool, name, state, *, lease=None, reset=False,
+                   note=None, affinity=None):
+        """Record the current state of the pool member.
+
+        If 'reset' is True then its last-reset time is updated too, and
+        its affinity (cache keys) is cleared unless given.  Otherwise
+        the affinity is only changed if given.
+        """
+        now = time.time()
+        if affinity is not None:
+            affinity = json.dumps(list(affinity))
+        self._execute("""
+                INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    pool = excluded.pool,
+                    state = excluded.state,
+                    lease = excluded.lease,
+                    lastreset = COALESCE(excluded.lastreset, lastreset),
+                    updated = excluded.updated,
+                    note = excluded.note,
+                    affinity = CASE WHEN excluded.lastreset IS NOT NULL
+                                    THEN excluded.affinity
+                                    ELSE COALESCE(excluded.affinity, affinity)
+                                    END
+                """, (name, pool, state, lease, now if reset else None, now,
+                      note, affinity))
+
+    def claim_member(self, name, state, *, lease=None, reset=False,
+                     note=None):
+        """Move the member from idle to 'state', if it is still idle.
+
+        This is atomic, so when several processes (each with the pool
+        loaded) go for the same idle member only one of them gets it.
+        Return True if we did (and False if it wasn't idle, e.g. someone
+        else got to it first).  'reset' is as for set_member().
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._conn.execute("""
+                        UPDATE members SET
+                            state = ?,
+                            lease = ?,
+                            lastreset = COALESCE(?, lastreset),
+                            updated = ?,
+                            note = ?,
+                            affinity = CASE WHEN ? THEN NULL ELSE affinity
+                                            END
+                        WHERE name = ? AND state = 'idle'
+                        """, (state, lease, now if reset else None, now,
+                              note, reset, name))
+                claimed = cursor.rowcount == 1
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+        return claimed
+
+    def get_member(self, name):
+        """Return the MemberRecord for the container (or None)."""
+        rows = self._execute('SELECT * FROM members WHERE name = ?', (name,))
+        return MemberRecord.from_row(rows[0]) if rows else None
+
+    def remove_member(self, name):
+        self._execute('DELETE FROM members WHERE name = ?', (name,))
+
+    def members(self, pool, state=None):
+        """Return the MemberRecord for each member of the pool."""
+        if state is None:
+            rows = self._execute(
+                    'SELECT * FROM members WHERE pool = ? ORDER BY name',
+                    (pool,))
+        else:
+            rows = self._execute(
+                    'SELECT * FROM members WHERE pool = ? AND state = ? '
+                    'ORDER BY name', (pool, state))
+        return [MemberRecord.from_row(row) for row in rows]
+
+    def counts(self, pool=None):
+        """Return {state: count} for the pool's members.
+
+        If no pool is given then a mapping of pool name to counts is
+        returned, covering every pool.
+        """
+        if pool is not None:
+            rows = self._execute(
+                    'SELECT state, COUNT(*) FROM members WHERE pool = ? '
+                    'GROUP BY state', (pool,))
+            return dict(rows)
+        counts = {}
+        rows = self._execute(
+                'SELECT pool, state, COUNT(*) FROM members '
+                'GROUP BY pool, state')
+        for pool, state, count in rows:
+            counts.setdefault(pool, {})[state] = count
+        return counts
+
+    # images
+
+    def set_image(self, alias, source, fingerprint, size):
+        """Record the image that the alias (now) refers to."""
+        self._execute("""
+                INSERT INTO images VALUES (?, ?, ?, ?, ?, NULL)
+                ON CONFLICT (alias) DO UPDATE SET
+                    source = excluded.source,
+                    fingerprint = excluded.fingerprint,
+                    size = excluded.size
+                """, (alias, source, fingerprint, size, time.time()))
+
+    def touch_image(self, alias):
+        """Mark the image as just used."""
+        self._execute('UPDATE images SET lastused = ? WHERE alias = ?',
+                      (time.time(), alias))
+
+    def remove_image(self, alias):
+        self._execute('DELETE FROM images WHERE alias = ?', (alias,))
+
+    def get_image(self, alias):
+        """Return the ImageRecord for the alias (or None)."""
+        rows = self._execute('SELECT * FROM images WHERE alias = ?', (alias,))
+        return ImageRecord(*rows[0]) if rows else None
+
+    def images(self):
+        """Return the ImageRecord for each cached image, least recent first.
+
+        Images that were never used sort by when they were added.
+        """
+        rows = self._execute(
+                'SELECT * FROM images ORDER BY COALESCE(lastused, added)')
+        return [ImageRecord(*row) for row in rows]
+
+    def retire_image(self, alias, fingerprint):
+        """Record that the alias no longer refers to the image (which is
+        yet to be deleted)."""
+        self._execute("""
+                INSERT OR REPLACE INTO retired_images VALUES (?, ?, ?)
+                """, (fingerprint, alias, time.time()))
+
+    def unretire_image(self, fingerprint):
+        self._execute('DELETE FROM retired_images WHERE fingerprint = ?',
+                      (fingerprint,))
+
+    def retired_images(self):
+        """Return the fingerprints of the retired images, oldest first."""
+        rows = self._execute(
+                'SELECT fingerprint FROM retired_images ORDER BY retired')
+        return [fingerprint for fingerprint, in rows]
+
+
+def _encode(mapping):
+    if mapping is None:
+        return None
+    return json.dumps(mapping, sort_keys=True)
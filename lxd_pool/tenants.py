@@ -0,0 +1,275 @@
+"""Sharing a pool fairly between tenants.
+
+Each acquire may say who it is for (its "tenant", e.g. a team or a
+kind of job) and how urgent it is (its priority, higher first).  Once
+a pool is exhausted its waiters are served by weighted fair queuing:
+each tenant gets containers in proportion to its weight, however many
+requests it has queued, so a nightly run that queues hundreds of them
+doesn't hold up an interactive job that queues one.  Among the
+waiters, a higher priority goes first, but a waiter's priority goes
+up by one for every 'aging' seconds it has waited, so nobody waits
+forever.
+
+A tenant may also have a cap, the most containers it may hold at
+once.  Its waiters past the cap are passed over (even if there are
+idle containers) until it releases one.
+
+Tenants are given as {tenant: {'weight': WEIGHT, 'cap': CAP}} or as
+specs like "nightly=1:20" (see parse()).  Tenants that aren't given
+have a weight of 1 and no cap.
+"""
+from collections import deque
+import time
+
+
+DEFAULT = 'default'  # the tenant of acquires that don't give one
+PRIORITY = 0
+WEIGHT = 1.0
+AGING = 60.0  # seconds waited per priority level gained
+WINDOW = 1000  # waits kept per tenant (for the percentiles)
+PERCENTILES = (50, 90, 99)
+
+
+def parse(spec):
+    """Return (tenant, {'weight': WEIGHT, 'cap': CAP}) for
+    "TENANT[=WEIGHT][:CAP]"."""
+    spec, _, cap = spec.partition(':')
+    tenant, _, weight = spec.partition('=')
+    if not tenant:
+        raise ValueError('missing tenant in {!r}'.format(spec))
+    return tenant, _check(float(weight) if weight else WEIGHT,
+                          int(cap) if cap else None)
+
+
+def normalize(tenants):
+    """Return the {tenant: {'weight': WEIGHT, 'cap': CAP}} for the given
+    tenants.
+
+    'tenants' may be None (no tenants configured), a mapping of tenant
+    to a dict (as above) or to a weight, or a sequence of specs (see
+    parse()) or of (tenant, share) pairs.  None is returned if there
+    are none.
+    """
+    if not tenants:
+        return None
+    if not hasattr(tenants, 'items'):
+        tenants = dict(parse(spec) if isinstance(spec, str) else tuple(spec)
+                       for spec in tenants)
+    normalized = {}
+    for tenant, share in tenants.items():
+        if not hasattr(share, 'get'):
+            share = {'weight': share}
+        weight = share.get('weight')
+        normalized[tenant] = _check(WEIGHT if weight is None else weight,
+                                    share.get('cap'))
+    return normalized
+
+
+def _check(weight, cap):
+    if weight <= 0:
+        raise ValueError('weight must be positive, got {}'.format(weight))
+    if cap is not None and cap < 0:
+        raise ValueError('cap must be non-negative, got {}'.format(cap))
+    return {'weight': weight, 'cap': cap}
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile (nearest rank) of the sorted values."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+class FairQueue:
+    """The callers waiting for a pool's containers (see the module doc).
+
+    A waiter is any object with 'tenant' and 'priority' attributes,
+    which gets 'since' and 'finish' (its virtual finish time) set when
+    it is pushed.  Waiters are kept in FIFO buckets by tenant and
+    priority, so picking the next one only looks at the head of each
+    bucket.
+
+    The queue also counts the containers each tenant holds (see take()
+    and give()), for the caps, and its recent waits (see record()).  It
+    isn't thread-safe; the pool only uses it under its lock.
+
+    If 'admit' is provided then pop() calls it once it has picked a
+    waiter, and only serves the waiter if it returns True.  That is
+    for an admission (see the resources module), so that waiters held
+    off for lack of resources are still served in order.
+    """
+
+    def __init__(self, tenants=None, *, aging=AGING, window=WINDOW,
+                 clock=time.monotonic, admit=None):
+        self.tenants = normalize(tenants)
+        self.aging = aging
+        self.window = window
+        self.clock = clock
+        self.admit = admit
+
+        self._buckets = {}  # (tenant, priority) -> deque of waiters
+        self._count = 0
+        self._vtime = 0.0
+        self._finish = {}  # tenant -> its last waiter's finish time
+        self._held = {}
+        self._waits = {}
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.tenants)
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __iter__(self):
+        for bucket in list(self._buckets.values()):
+            yield from bucket
+
+    def weight(self, tenant):
+        """Return the tenant's weight."""
+        share = self.tenants and self.tenants.get(tenant)
+        return share['weight'] if share else WEIGHT
+
+    def cap(self, tenant):
+        """Return the most containers the tenant may hold (or None)."""
+        share = self.tenants and self.tenants.get(tenant)
+        return share['cap'] if share else None
+
+    def allowed(self, tenant):
+        """Return True if the tenant may take another container."""
+        if not self.tenants:
+            return True
+        cap = self.cap(tenant)
+        return cap is None or self._held.get(tenant, 0) < cap
+
+    def push(self, waiter):
+        """Add the waiter to the queue."""
+        tenant = waiter.tenant
+        start = max(self._vtime, self._finish.get(tenant, 0.0))
+        waiter.finish = self._finish[tenant] = start + 1 / self.weight(tenant)
+        waiter.since = self.clock()
+        key = (tenant, waiter.priority)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = deque()
+        bucket.append(waiter)
+        self._count += 1
+
+    def pop(self):
+        """Remove and return the waiter to serve next.
+
+        None is returned if every waiter's tenant is at its cap (or
+        there are none), or if 'admit' turns down the next one.
+        """
+        if self._count == 1 or len(self._buckets) == 1:
+            # the fast path (only one candidate)
+            for key, bucket in self._buckets.items():
+                if not self.allowed(key[0]) or not self._admitted():
+                    return None
+                return self._take(key, bucket)
+            return None
+        now = self.clock()
+        best = bestrank = None
+        for key, bucket in self._buckets.items():
+            waiter = bucket[0]
+            if not self.allowed(waiter.tenant):
+                continue
+            rank = (-self._priority(waiter, now), waiter.finish)
+            if bestrank is None or rank < bestrank:
+                best, bestrank = key, rank
+        if best is None or not self._admitted():
+            return None
+        return self._take(best, self._buckets[best])
+
+    def remove(self, waiter):
+        """Take the waiter out of the queue (e.g. it timed out)."""
+        tenant = waiter.tenant
+        key = (tenant, waiter.priority)
+        bucket = self._buckets[key]
+        bucket.remove(waiter)
+        if not bucket:
+            del self._buckets[key]
+        self._count -= 1
+        if waiter.finish >= self._finish.get(tenant, 0.0):
+            # It was the tenant's last, so the tenant's next waiter
+            # shouldn't be pushed back on its account.  (Within a
+            # bucket the finish times only go up.)
+            finishes = [bucket[-1].finish
+                        for (other, _), bucket in self._buckets.items()
+                        if other == tenant]
+            if finishes:
+                self._finish[tenant] = max(finishes)
+            else:
+                # It starts over from the virtual time (see push()).
+                self._finish.pop(tenant, None)
+
+    def take(self, tenant):
+        """Count a container as held by the tenant."""
+        self._held[tenant] = self._held.get(tenant, 0) + 1
+
+    def give(self, tenant):
+        """Count a container as no longer held by the tenant."""
+        held = self._held.get(tenant, 0) - 1
+        if held > 0:
+            self._held[tenant] = held
+        else:
+            self._held.pop(tenant, None)
+
+    def record(self, tenant, seconds):
+        """Note that someone of the tenant waited 'seconds' to acquire."""
+        waits = self._waits.get(tenant)
+        if waits is None:
+            waits = self._waits[tenant] = deque(maxlen=self.window)
+        waits.append(seconds)
+
+    def depth(self):
+        """Return {tenant: number waiting}."""
+        depth = {}
+        for (tenant, _), bucket in self._buckets.items():
+            depth[tenant] = depth.get(tenant, 0) + len(bucket)
+        return depth
+
+    def stats(self):
+        """Return {tenant: {...}} with each tenant's share, the number
+        waiting and holding containers, and the percentiles of its
+        recent waits (in seconds, as "p50", etc.)."""
+        depth = self.depth()
+        tenants = set(depth) | set(self._held) | set(self._waits)
+        tenants.update(self.tenants or ())
+        stats = {}
+        for tenant in tenants:
+            waits = sorted(self._waits.get(tenant, ()))
+            stats[tenant] = {
+                    'weight': self.weight(tenant),
+                    'cap': self.cap(tenant),
+                    'waiting': depth.get(tenant, 0),
+                    'held': self._held.get(tenant, 0),
+                    'samples': len(waits),
+                    }
+            for pct in PERCENTILES:
+                stats[tenant]['p{}'.format(pct)] = percentile(waits, pct)
+        return stats
+
+    # internal methods
+
+    def _admitted(self):
+        return self.admit is None or self.admit()
+
+    def _priority(self, waiter, now):
+        # Whole levels only, so that among waiters of the same priority
+        # the finish times decide (rather than just who came first).
+        if not self.aging:
+            return waiter.priority
+        return waiter.priority + int((now - waiter.since) // self.aging)
+
+    def _take(self, key, bucket):
+        waiter = bucket.popleft()
+        if not bucket:
+            del self._buckets[key]
+        self._count -= 1
+        if waiter.finish > self._vtime:
+            self._vtime = waiter.finish
+        return waiter
@@ -0,0 +1,129 @@
+"""Micro-benchmarks for FixedNamespace (as_namespace), against the stdlib.
+
+Usage::
+
+  $ python -m tests.bench_namespace [--number 100000] [--json]
+
+The same 6-field record (the shape of the state records) is built as a
+FixedNamespace, a namedtuple and a plain class with __slots__.  Each
+operation is timed on each of them, in nanoseconds per call.
+"""
+import argparse
+from collections import namedtuple
+import json
+import sys
+import timeit
+
+from lxd_pool._util.collections import as_namespace
+
+
+NUMBER = 100000
+REPEAT = 5
+FIELDS = 'name pool state lease lastreset updated'
+VALUES = ('ci-1', 'ci', 'idle', None, 1.5, 2.5)
+
+
+@as_namespace(FIELDS)
+class Namespace:
+    """A FixedNamespace record."""
+
+
+Tuple = namedtuple('Tuple', FIELDS)
+
+
+class Slots:
+    """A plain class with __slots__ (the baseline)."""
+
+    __slots__ = tuple(FIELDS.split())
+
+    def __init__(self, name, pool, state, lease, lastreset, updated):
+        self.name = name
+        self.pool = pool
+        self.state = state
+        self.lease = lease
+        self.lastreset = lastreset
+        self.updated = updated
+
+    def __repr__(self):
+        return ('{}(name={!r}, pool={!r}, state={!r}, lease={!r}, '
+                'lastreset={!r}, updated={!r})'.format(
+                    type(self).__name__, self.name, self.pool, self.state,
+                    self.lease, self.lastreset, self.updated))
+
+
+CLASSES = [
+        ('namespace', Namespace),
+        ('namedtuple', Tuple),
+        ('slots', Slots),
+        ]
+
+# Each is a statement run with "cls" and "obj" (an instance) defined.
+OPERATIONS = [
+        ('new', 'cls(*values)'),
+        ('new (kwargs)', 'cls(**kwargs)'),
+        ('getattr', 'obj.state'),
+        ('repr', 'repr(obj)'),
+        ('dir', 'dir(obj)'),
+        ('_replace', 'obj._replace(state="busy")'),
+        ('_asdict', 'obj._asdict()'),
+        ]
+
+
+def bench(cls, stmt, number=NUMBER):
+    """Return the best time (in seconds) per run of the statement."""
+    obj = cls(*VALUES)
+    if stmt.startswith('obj._') and not hasattr(obj, stmt[4:].split('(')[0]):
+        return None
+    namespace = {
+            'cls': cls,
+            'obj': obj,
+            'values': VALUES,
+            'kwargs': dict(zip(FIELDS.split(), VALUES)),
+            }
+    timer = timeit.Timer(stmt, globals=namespace)
+    return min(timer.repeat(REPEAT, number)) / number
+
+
+def _format(name, results):
+    cells = []
+    for clsname, _ in CLASSES:
+        result = results.get(clsname)
+        cells.append('{:>10}'.format(
+                '-' if result is None else '{:.0f}ns'.format(result * 1e9)))
+    return '{:14}'.format(name) + ' '.join(cells)
+
+
+#######################################
+# the script
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_namespace')
+    parser.add_argument('--number', type=int, default=NUMBER)
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, _ in OPERATIONS])
+    parser.add_argument('--json', action='store_true', default=False)
+    return parser.parse_args(argv)
+
+
+def main(number=NUMBER, *, only=None, asjson=False):
+    results = {}
+    if not asjson:
+        print('{:14}'.format('') + ' '.join('{:>10}'.format(name)
+                                            for name, _ in CLASSES))
+    for name, stmt in OPERATIONS:
+        if only and name not in only:
+            continue
+        for clsname, cls in CLASSES:
+            results.setdefault(name, {})[clsname] = bench(cls, stmt, number)
+        if not asjson:
+            print(_format(name, results[name]))
+            sys.stdout.flush()
+    if asjson:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args.number, only=args.only, asjson=args.json)
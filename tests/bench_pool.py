@@ -0,0 +1,169 @@
+"""Benchmarks for pool operations, run against a simulated LXD.
+
+Usage::
+
+  $ python -m tests.bench_pool [--sizes 1,10,100,1000] [--scale 1.0]
+
+Each benchmark is run at each pool size.  The simulated LXD (see
+tests.fakelxd) takes a configurable amount of time per operation, so
+the numbers reflect the overhead of lxd-pool itself on top of a
+(roughly) realistic LXD.
+"""
+import argparse
+import json
+import os
+import os.path
+import statistics
+import sys
+import tempfile
+import time
+
+from lxd_pool.lxd import LXC
+from lxd_pool.pool import Pool
+from lxd_pool.run import run
+from lxd_pool.state import Store
+
+from .fakelxd import FakeLXD
+
+
+SIZES = (1, 10, 100, 1000)
+ITERATIONS = 200
+
+
+def new_pool(size, fake, store=None):
+    pool = Pool('bench', size, maxsize=size, image='bench-image',
+                lxc=LXC(runner=fake), store=store)
+    pool.create()
+    return pool
+
+
+def bench_acquire(size, fake):
+    """Return the latency of acquiring (and releasing) an idle container."""
+    pool = new_pool(size, fake)
+    times = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        container = pool.acquire()
+        times.append(time.perf_counter() - start)
+        pool.release(container)
+    return _summarize(times)
+
+
+def bench_reset(size, fake):
+    """Return the time until a released container is ready again."""
+    pool = new_pool(size, fake)
+    times = []
+    with pool:
+        # Each iteration resets the whole pool, so we do fewer of them
+        # for big pools.
+        for _ in range(min(ITERATIONS, max(10, 2000 // size))):
+            # Drain the pool so we have to wait on the reset.
+            held = [pool.acquire() for _ in range(size)]
+            start = time.perf_counter()
+            for container in held:
+                pool.release(container, reset=True)
+            container = pool.acquire()
+            times.append(time.perf_counter() - start)
+            pool.release(container)
+            while pool.resetting:
+                time.sleep(0.0005)
+    return _summarize(times)
+
+
+def bench_run(size, fake):
+    """Return the throughput (invocations/second) of run()."""
+    pool = new_pool(size, fake)
+    num = max(size * 4, 20)
+    with pool:
+        start = time.perf_counter()
+        for result in run(pool, 'true', num, reset=True):
+            assert not result.failed, result
+        elapsed = time.perf_counter() - start
+    return {'num': num, 'elapsed': elapsed, 'per_second': num / elapsed}
+
+
+def bench_status(size, fake):
+    """Return the latency of answering "lxd-pool status" from the store."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = Store(os.path.join(tmpdir, 'state.db'))
+        new_pool(size, fake, store=store)
+        # Add noise from another pool, so the index matters.
+        store.add_pool('other', size * 5, size * 5, 'bench-image')
+        for i in range(size * 5):
+            name = 'other-{}'.format(i)
+            store.set_member('other', name, 'idle')
+        times = []
+        for _ in range(ITERATIONS):
+            start = time.perf_counter()
+            store.get_pool('bench')
+            store.counts('bench')
+            store.members('bench')
+            times.append(time.perf_counter() - start)
+        store.close()
+    return _summarize(times)
+
+
+BENCHMARKS = [
+        ('acquire', bench_acquire),
+        ('reset', bench_reset),
+        ('run', bench_run),
+        ('status', bench_status),
+        ]
+
+
+def _summarize(times):
+    times = sorted(times)
+    return {
+            'n': len(times),
+            'mean': statistics.mean(times),
+            'p50': times[len(times) // 2],
+            'p99': times[min(len(times) - 1, int(len(times) * 0.99))],
+            }
+
+
+def _format(name, result):
+    if 'per_second' in result:
+        return '{:8} {:>10.1f}/s  ({} in {:.2f}s)'.format(
+                name, result['per_second'], result['num'], result['elapsed'])
+    return '{:8} mean {:>9.3f}ms  p50 {:>9.3f}ms  p99 {:>9.3f}ms'.format(
+            name, result['mean'] * 1000, result['p50'] * 1000,
+            result['p99'] * 1000)
+
+
+#######################################
+# the script
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_pool')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        type=lambda v: [int(s) for s in v.split(',')])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the simulated LXD delays')
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument('--json', action='store_true', default=False)
+    return parser.parse_args(argv)
+
+
+def main(sizes=SIZES, *, scale=1.0, only=None, asjson=False):
+    results = {}
+    for size in sizes:
+        if not asjson:
+            print('pool size {}:'.format(size))
+        for name, bench in BENCHMARKS:
+            if only and name not in only:
+                continue
+            result = bench(size, FakeLXD(scale=scale))
+            results.setdefault(size, {})[name] = result
+            if not asjson:
+                print('  ' + _format(name, result))
+                sys.stdout.flush()
+    if asjson:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args.sizes, scale=args.scale, only=args.only, asjson=args.json)
@@ -0,0 +1,211 @@
+"""A simulated LXD, for exercising pools without real containers."""
+import json
+import subprocess
+import threading
+
+from lxd_pool._util.os import dummy_runner
+
+
+# The (rough) default time, in seconds, each operation takes.
+DELAYS = {
+        'launch': 0.01,
+        'copy': 0.002,
+        'start': 0.002,
+        'stop': 0.002,
+        'delete': 0.002,
+        'snapshot': 0.001,
+        'restore': 0.002,
+        'exec': 0.001,
+        'config': 0.0005,
+        'list': 0.001,
+        'image': 0.001,
+        }
+
+
+class FakeLXD:
+    """A command runner (a la subprocess) that acts like the lxc CLI.
+
+    The containers (and their config and snapshots) are tracked in
+    memory.  Each operation takes the time given for it in 'delays'
+    (multiplied by 'scale'), so the latency of real LXD can be
+    approximated.  Every command is recorded in 'calls'.
+
+    Any number of remotes are simulated too: containers named
+    "<remote>:<name>" are on that remote.  Commands that touch a remote
+    in 'unreachable' fail, and those that touch a remote in 'slow' take
+    that many seconds longer.  Commands exec'ed in a container in
+    'broken' fail.
+    """
+
+    def __init__(self, delays=None, *, scale=1.0, output='ok'):
+        self.delays = dict(DELAYS, **(delays or {}))
+        self.scale = scale
+        self.output = output
+        self.containers = {}
+        self.images = {}
+        self.calls = []
+        self.unreachable = set()
+        self.slow = {}
+        self.broken = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, args, **kwargs):
+        args = list(args)
+        op = args[1]
+        remotes = {arg.partition(':')[0] for arg in args[2:]
+                   if ':' in arg and not arg.startswith('-')}
+        with self._lock:
+            self.calls.append(args)
+            down = remotes & self.unreachable
+            if down:
+                output = subprocess.CalledProcessError(
+                        1, ['lxc'], 'error: {} is unreachable'.format(
+                            sorted(down)[0]).encode())
+            else:
+                output = getattr(self, '_' + op)(args[2:])
+        delay = self.delays.get(op, 0) * self.scale
+        delay += max([self.slow.get(remote, 0) for remote in remotes] or [0])
+        runner = dummy_runner(output or '', delay=delay)
+        if isinstance(output, subprocess.CalledProcessError):
+            runner(args)
+            raise output
+        return runner(args, **kwargs)
+
+    def count(self, op):
+        """Return how many times the operation was run."""
+        return sum(1 for args in self.calls if args[1] == op)
+
+    def _check(self, name):
+        if name not in self.containers:
+            return subprocess.CalledProcessError(
+                    1, ['lxc'], 'error: not found: {}'.format(name).encode())
+
+    def _new(self, name, config):
+        self.containers[name] = {
+                'status': 'RUNNING',
+                'config': config,
+                'snapshots': [],
+                }
+
+    # the lxc commands
+
+    def _list(self, args):
+        filters = [arg for arg in args[4:] if not arg.endswith(':')]
+        remote = ''.join(arg for arg in args[4:] if arg.endswith(':'))
+        lines = []
+        for name, info in sorted(self.containers.items()):
+            if remote:
+                if not name.startswith(remote):
+                    continue
+                name = name[len(remote):]
+            elif ':' in name:
+                continue
+            for filter in filters:
+                key, sep, value = filter.partition('=')
+                if sep and info['config'].get(key) != value:
+                    break
+                if not sep and not name.startswith(filter):
+                    break
+            else:
+                lines.append('{},{}'.format(name, info['status']))
+        return '\n'.join(lines)
+
+    def _launch(self, args):
+        image, name = args[:2]
+        config = {}
+        for i, arg in enumerate(args):
+            if arg == '--config':
+                key, _, value = args[i+1].partition('=')
+                config[key] = value
+        self._new(name, config)
+
+    def _copy(self, args):
+        source, name = args[:2]
+        error = self._check(source)
+        if error:
+            return error
+        config = dict(self.containers[source]['config'])
+        for i, arg in enumerate(args):
+            if arg == '--config':
+                key, _, value = args[i+1].partition('=')
+                config[key] = value
+        self._new(name, config)
+        self.containers[name]['status'] = 'STOPPED'
+
+    def _start(self, args):
+        error = self._check(args[0])
+        if error:
+            return error
+        self.containers[args[0]]['status'] = 'RUNNING'
+
+    def _stop(self, args):
+        error = self._check(args[0])
+        if error:
+            return error
+        self.containers[args[0]]['status'] = 'STOPPED'
+
+    def _delete(self, args):
+        error = self._check(args[0])
+        if error:
+            return error
+        del self.containers[args[0]]
+
+    def _snapshot(self, args):
+        error = self._check(args[0])
+        if error:
+            return error
+        self.containers[args[0]]['snapshots'].append(args[1])
+
+    def _restore(self, args):
+        error = self._check(args[0])
+        if error:
+            return error
+        if args[1] not in self.containers[args[0]]['snapshots']:
+            return subprocess.CalledProcessError(
+                    1, ['lxc'], b'error: no such snapshot')
+
+    def _config(self, args):
+        if args[0] not in ('get', 'set', 'unset'):
+            return
+        error = self._check(args[1])
+        if error:
+            return error
+        config = self.containers[args[1]]['config']
+        if args[0] == 'set':
+            config[args[2]] = args[3]
+        elif args[0] == 'unset':
+            config.pop(args[2], None)
+        else:
+            return config.get(args[2], '')
+
+    def _exec(self, args):
+        if args[0] in self.broken:
+            return subprocess.CalledProcessError(
+                    1, ['lxc'], b'error: the container is broken')
+        return self._check(args[0]) or self.output
+
+    def _image(self, args):
+        op = args[0]
+        if op == 'copy':
+            fingerprint = '{:064x}'.format(len(self.images) + 1)
+            aliases = []
+            if '--alias' in args:
+                aliases.append(args[args.index('--alias') + 1])
+            self.images[fingerprint] = aliases
+        elif op == 'list':
+            return json.dumps([
+                    {'fingerprint': fingerprint,
+                     'size': 300 * 1024 ** 2,
+                     'aliases': [{'name': alias} for alias in aliases],
+                     }
+                    for fingerprint, aliases in self.images.items()
+                    if len(args) < 4 or args[3] in aliases])
+        elif op == 'delete':
+            self.images.pop(args[1], None)
+        elif op == 'alias':
+            if args[1] == 'create':
+                self.images[args[3]].append(args[2])
+            else:
+                for aliases in self.images.values():
+                    if args[2] in aliases:
+                        aliases.remove(args[2])
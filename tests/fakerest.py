@@ -0,0 +1,206 @@
+"""A simulated LXD REST API, served over a unix socket.
+
+Only what lxd_pool.rest uses is covered: listing, creating and
+deleting containers, their state, snapshots, exec (with recorded
+output) and waiting on operations.
+"""
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class FakeLXDServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """A fake LXD listening on the unix socket at 'path'.
+
+    Every request is recorded in 'requests', as (method, path).  Each
+    operation takes 'delay' seconds to finish.  An exec'ed command that
+    mentions "fail" exits with 3.  If 'drop' is positive then that many
+    of the next requests are read and then dropped (the connection is
+    closed without a response).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, *, delay=0.0):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        self.path = path
+        self.delay = delay
+        self.drop = 0
+        self.containers = {}
+        self.operations = {}
+        self.logs = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        os.unlink(self.path)
+
+    def new_operation(self, *, metadata=None, error=None):
+        with self.lock:
+            opid = str(len(self.operations) + 1)
+            self.operations[opid] = {
+                    'done': time.monotonic() + self.delay,
+                    'metadata': metadata,
+                    'err': error,
+                    }
+        return '/1.0/operations/' + opid
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server = self.server
+        with server.lock:
+            server.requests.append((method, self.path))
+            drop = server.drop > 0
+            if drop:
+                server.drop -= 1
+        if drop:
+            self.close_connection = True
+            return
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/')[2:]]
+        query = parse_qs(url.query)
+        if url.path in server.logs:
+            return self._logs(method, url.path)
+        handle = getattr(self, '_{}_{}'.format(method.lower(), parts[0]),
+                         None)
+        if handle is None:
+            return self._error(404, 'not found')
+        handle(parts[1:], query, body)
+
+    def _send(self, status, data):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sync(self, metadata=None):
+        self._send(200, {'type': 'sync', 'status_code': 200,
+                         'metadata': metadata})
+
+    def _async(self, **kwargs):
+        operation = self.server.new_operation(**kwargs)
+        self._send(202, {'type': 'async', 'status_code': 100,
+                         'operation': operation})
+
+    def _error(self, code, error):
+        self._send(code, {'type': 'error', 'error': error,
+                          'error_code': code})
+
+    def _logs(self, method, path):
+        if method == 'DELETE':
+            del self.server.logs[path]
+            return self._sync({})
+        self._send(200, self.server.logs[path])
+
+    # the endpoints
+
+    def _get_operations(self, parts, query, body):
+        op = self.server.operations.get(parts[0])
+        if op is None:
+            return self._error(404, 'not found')
+        timeout = float(query.get('timeout', ['-1'])[0])
+        remaining = op['done'] - time.monotonic()
+        if remaining > 0 and timeout != 0:
+            time.sleep(remaining if timeout < 0 else min(remaining, timeout))
+        if op['done'] > time.monotonic():
+            return self._sync({'status': 'Running', 'status_code': 103,
+                               'err': ''})
+        if op['err']:
+            return self._sync({'status': 'Failure', 'status_code': 400,
+                               'err': op['err']})
+        self._sync({'status': 'Success', 'status_code': 200, 'err': '',
+                    'metadata': op['metadata']})
+
+    def _get_containers(self, parts, query, body):
+        containers = self.server.containers
+        if not parts:
+            return self._sync([dict(info, name=name)
+                               for name, info in sorted(containers.items())])
+        info = containers.get(parts[0])
+        if info is None:
+            return self._error(404, 'not found')
+        if parts[1:] == ['state']:
+            return self._sync({'status': info['status']})
+        self._sync(dict(info, name=parts[0]))
+
+    def _post_containers(self, parts, query, body):
+        containers = self.server.containers
+        if not parts:
+            containers[body['name']] = {
+                    'status': 'Stopped',
+                    'config': body.get('config') or {},
+                    'source': body['source'],
+                    'snapshots': [],
+                    }
+            return self._async()
+        info = containers[parts[0]]
+        if parts[1] == 'snapshots':
+            info['snapshots'].append(body['name'])
+            return self._async()
+        if parts[1] == 'exec':
+            path = '/1.0/containers/{}/logs/exec_{}.stdout'.format(
+                    parts[0], len(self.server.operations) + 1)
+            self.server.logs[path] = ' '.join(body['command']).encode()
+            failed = 'fail' in ' '.join(body['command'])
+            return self._async(metadata={'return': 3 if failed else 0,
+                                         'output': {'1': path}})
+        self._error(404, 'not found')
+
+    def _put_containers(self, parts, query, body):
+        info = self.server.containers[parts[0]]
+        if parts[1:] == ['state']:
+            info['status'] = ('Running' if body['action'] == 'start'
+                              else 'Stopped')
+            return self._async()
+        if body['restore'] not in info['snapshots']:
+            return self._async(error='no such snapshot')
+        self._async()
+
+    def _delete_containers(self, parts, query, body):
+        self.server.containers.pop(parts[0])
+        self._async()
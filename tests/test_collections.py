@@ -0,0 +1,69 @@
+"""Tests for lxd_pool._util.collections."""
+import unittest
+
+from lxd_pool._util.collections import as_namespace
+
+
+@as_namespace('name size note')
+class Record:
+    """A FixedNamespace record."""
+
+
+class Scaled(Record):
+
+    def __init__(self, name, size, note=None):
+        super().__init__(name, size * 10, note)
+
+
+@as_namespace('')
+class Empty:
+    pass
+
+
+class FixedNamespaceTests(unittest.TestCase):
+
+    def test_make(self):
+        record = Record._make(['c1', 2, None])
+
+        self.assertEqual(record._values(), ('c1', 2, None))
+        self.assertIs(type(record), Record)
+        with self.assertRaises(ValueError):
+            Record._make(['c1', 2])
+
+    def test_make_calls_custom_init(self):
+        record = Scaled._make(['c1', 2, None])
+
+        self.assertEqual(record.size, 20)
+        self.assertIs(type(record), Scaled)
+
+    def test_make_empty(self):
+        self.assertIsInstance(Empty._make(()), Empty)
+
+    def test_asdict(self):
+        record = Record('c1', 2, 'x')
+
+        self.assertEqual(list(record._asdict().items()),
+                         [('name', 'c1'), ('size', 2), ('note', 'x')])
+
+    def test_replace(self):
+        record = Record('c1', 2, 'x')
+
+        changed = record._replace(size=3, note=None)
+
+        self.assertEqual(changed._values(), ('c1', 3, None))
+        self.assertEqual(record.size, 2)
+        with self.assertRaises(ValueError):
+            record._replace(bogus=1)
+
+    def test_read_only(self):
+        record = Record('c1', 2, None)
+
+        with self.assertRaises(AttributeError):
+            record.size = 3
+        with self.assertRaises(AttributeError):
+            del record.size
+        self.assertEqual(repr(record), "Record(name='c1', size=2, note=None)")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Tests for lxd_pool.daemon, against a simulated LXD (see tests.fakelxd)."""
+import os.path
+import tempfile
+import threading
+import time
+import unittest
+
+from lxd_pool.daemon import Client, RemotePool, Server
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+from lxd_pool.pool import BUSY, Pool
+from lxd_pool.state import Store
+
+from .fakelxd import FakeLXD
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        lxc = LXC(runner=self.fake, metrics=Registry())
+        Pool('ci', 2, image='img', lxc=lxc, store=self.store).create()
+        self.server = Server(os.path.join(tmpdir.name, 'lxd-pool.sock'),
+                             store=self.store, lxc=lxc, health=False)
+        self.server.bind()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.server.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def connect(self):
+        client = Client(self.server.address)
+        self.addCleanup(client.close)
+        return RemotePool('ci', client, lxc=self.server.lxc)
+
+    def states(self):
+        return {member.name: member.state
+                for member in self.store.members('ci')}
+
+    def wait_for(self, predicate, timeout=5):
+        endtime = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > endtime:
+                self.fail('timed out')
+            time.sleep(0.01)
+
+    def test_released_when_the_client_goes_away(self):
+        pool = self.connect()
+        container = pool.acquire()
+        restores = self.fake.count('restore')
+        pool.close()
+
+        self.wait_for(lambda: self.server.get_pool('ci').idle == 2)
+        self.assertEqual(self.fake.count('restore'), restores + 1)
+        self.assertNotIn(BUSY, self.states().values())
+        self.assertIn(container, self.server.get_pool('ci'))
+
+    def test_released_over_another_connection(self):
+        pool = self.connect()
+        container = pool.acquire()
+        # Each thread has its own connection.
+        thread = threading.Thread(target=pool.release, args=(container,))
+        thread.start()
+        thread.join()
+        other = self.connect()
+        self.assertIn(container, [other.acquire(), other.acquire()])
+        pool.close()
+        time.sleep(0.1)
+
+        self.assertEqual(self.states()[container], BUSY)
+
+    def test_other_pools_answer_while_loading(self):
+        Pool('slow', 1, image='img', lxc=self.server.lxc,
+             store=self.store).create()
+        pool = self.connect()
+        loading = threading.Event()
+        release = threading.Event()
+        load = Pool.load
+
+        def slow_load(name, **kwargs):
+            if name == 'slow':
+                loading.set()
+                release.wait()
+            return load(name, **kwargs)
+
+        Pool.load = slow_load
+        self.addCleanup(setattr, Pool, 'load', load)
+        thread = threading.Thread(target=self.server.get_pool,
+                                  args=('slow',))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        loading.wait()
+
+        self.assertEqual(pool.info()['idle'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Tests for lxd_pool.images, against a simulated LXD (see tests.fakelxd)."""
+import unittest
+
+from lxd_pool.images import ImageCache
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+from lxd_pool.pool import SOURCE_KEY
+from lxd_pool.state import Store
+
+from .fakelxd import FakeLXD
+from .test_pool import new_pool
+
+
+class UpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        lxc = LXC(runner=self.fake, metrics=Registry())
+        self.images = ImageCache(self.store, lxc=lxc)
+        self.old = self.images.add('images:alpine', 'img').fingerprint
+
+    def new_pool(self, **kwargs):
+        pool = new_pool(1, fake=self.fake, store=self.store,
+                        images=self.images, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_no_auto_update(self):
+        for args in self.fake.calls:
+            self.assertNotIn('--auto-update', args)
+
+    def test_old_image_kept_while_used(self):
+        pool = self.new_pool(clone=False)
+        member = pool.acquire()
+        self.assertEqual(
+                self.fake.containers[member]['config'][SOURCE_KEY],
+                self.old)
+
+        new = self.images.update('img').fingerprint
+
+        self.assertNotEqual(new, self.old)
+        self.assertIn(self.old, self.fake.images)
+        self.assertEqual(self.images.prune(), [])
+
+        pool.lxc.delete(member)
+        self.assertEqual(self.images.prune(), [self.old])
+        self.assertNotIn(self.old, self.fake.images)
+        self.assertEqual(self.images.prune(), [])
+
+    def test_old_image_kept_for_golden(self):
+        self.new_pool(clone=True)
+
+        self.images.update('img')
+
+        self.assertIn(self.old, self.fake.images)
+
+    def test_unused_old_image_deleted(self):
+        new = self.images.update('img').fingerprint
+
+        self.assertEqual(set(self.fake.images), {new})
+        self.assertEqual(self.images.resolve('img'), new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Tests for lxd_pool._util.logging."""
+import io
+import json
+import logging
+import unittest
+
+from lxd_pool._util.logging import flush, get_json_handler
+
+
+class FlushTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = get_json_handler(self.stream)
+        self.logger = logging.getLogger('{}.{}'.format(__name__, self.id()))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.handler.listener.stop)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def messages(self):
+        return [json.loads(line)['msg']
+                for line in self.stream.getvalue().splitlines()]
+
+    def test_flush(self):
+        self.logger.debug('...%s %s', 'GET', '/1.0')
+
+        flush(self.logger)
+
+        self.assertEqual(self.messages(), ['...GET /1.0'])
+
+    def test_logging_after_flush(self):
+        self.logger.info('first')
+        flush(self.logger)
+        self.logger.info('second')
+        flush(self.logger)
+
+        self.assertEqual(self.messages(), ['first', 'second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+"""Tests for lxd_pool.lxd."""
+import asyncio
+import subprocess
+import unittest
+
+from lxd_pool._util.os import acmd
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+
+from .test_os import Proc
+
+
+class Recorder:
+    """A runner (a la subprocess.check_output()) that records the calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, args, **kwargs):
+        self.calls.append((args, kwargs.get('cwd')))
+        return b''
+
+
+class FileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = Recorder()
+        self.lxc = LXC(runner=self.runner, metrics=Registry())
+
+    def test_push_relative_to_cwd(self):
+        self.lxc.push('c1', 'src', '/work', cwd='/home/me')
+
+        (tar, cwd), _ = self.runner.calls
+        self.assertEqual(tar[:3], ['tar', '-C', '/home/me/src'])
+        self.assertIsNone(cwd)
+
+    def test_push_absolute(self):
+        self.lxc.push('c1', '/src', '/work', cwd='/home/me')
+
+        (tar, _), _ = self.runner.calls
+        self.assertEqual(tar[:3], ['tar', '-C', '/src'])
+
+    def test_pull_relative_to_cwd(self):
+        self.lxc.pull('c1', '/work', 'out', cwd='/home/me')
+
+        _, (untar, cwd) = self.runner.calls
+        self.assertEqual(untar[-1], '/home/me/out')
+        self.assertIsNone(cwd)
+
+
+class StreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Registry()
+
+    def exec_stream(self, proc):
+        lxc = LXC(runner=lambda *a, **k: proc, metrics=self.metrics)
+        return lxc.exec_stream('c1', 'make')
+
+    def render(self, prefix):
+        return [line for line in self.metrics.render().splitlines()
+                if line.startswith(prefix)]
+
+    def test_stream(self):
+        lines = list(self.exec_stream(Proc([b'a\n', b'b\n'])))
+
+        self.assertEqual(lines, ['a\n', 'b\n'])
+        self.assertEqual(self.render('lxd_pool_exec_seconds_count'),
+                         ['lxd_pool_exec_seconds_count 1'])
+
+    def test_failure(self):
+        stream = self.exec_stream(Proc([b'a\n'], returncode=2))
+
+        self.assertEqual(next(stream), 'a\n')
+        with self.assertRaises(subprocess.CalledProcessError):
+            next(stream)
+        self.assertEqual(self.render('lxd_pool_lxc_failures_total{'),
+                         ['lxd_pool_lxc_failures_total{op="exec"} 1'])
+
+    def test_closed_early(self):
+        proc = Proc([b'a\n', b'b\n'])
+        stream = self.exec_stream(proc)
+
+        next(stream)
+        stream.close()
+
+        self.assertTrue(proc.killed)
+        self.assertEqual(self.render('lxd_pool_lxc_failures_total{'), [])
+
+
+class Concurrency:
+    """Its run() is an asyncio runner (a la
+    _util.os.check_output_async()) that tracks how many commands run at
+    once."""
+
+    def __init__(self, delay=0.01, output=b'ok', fail=False):
+        self.delay = delay
+        self.output = output
+        self.fail = fail
+        self.running = 0
+        self.most = 0
+
+    async def run(self, args, **kwargs):
+        self.running += 1
+        self.most = max(self.most, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        if self.fail:
+            raise subprocess.CalledProcessError(3, args, self.output)
+        return self.output
+
+
+class AcmdTests(unittest.TestCase):
+
+    def test_limit(self):
+        runner = Concurrency()
+
+        async def run():
+            limit = asyncio.Semaphore(2)
+            return await asyncio.gather(*[
+                    acmd(['true'], runner=runner.run, limit=limit)
+                    for _ in range(6)])
+
+        self.assertEqual(asyncio.run(run()), ['ok'] * 6)
+        self.assertEqual(runner.most, 2)
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            asyncio.run(acmd(['sh', '-c', 'echo oops; exit 3']))
+
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.output, b'oops\n')
+
+    def test_output(self):
+        output = asyncio.run(acmd(['echo', 'hello']))
+
+        self.assertEqual(output, 'hello')
+
+
+class AsyncLXCTests(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Registry()
+
+    def aio(self, runner, **kwargs):
+        lxc = LXC(runner=runner, metrics=self.metrics)
+        return lxc.aio(**kwargs)
+
+    def render(self, prefix):
+        return [line for line in self.metrics.render().splitlines()
+                if line.startswith(prefix)]
+
+    def test_exec_timed(self):
+        lxc = self.aio(Concurrency(delay=0.05).run)
+
+        output = asyncio.run(lxc.exec('c1', 'true'))
+
+        self.assertEqual(output, 'ok')
+        count, = self.render('lxd_pool_exec_seconds_count')
+        self.assertEqual(count, 'lxd_pool_exec_seconds_count 1')
+        total, = self.render('lxd_pool_exec_seconds_sum')
+        self.assertGreaterEqual(float(total.split()[1]), 0.05)
+
+    def test_exec_failure(self):
+        lxc = self.aio(Concurrency(fail=True).run)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            asyncio.run(lxc.exec('c1', 'false'))
+
+        self.assertEqual(self.render('lxd_pool_lxc_failures_total{'),
+                         ['lxd_pool_lxc_failures_total{op="exec"} 1'])
+
+    def test_limit(self):
+        runner = Concurrency()
+
+        async def run(lxc):
+            await asyncio.gather(*[lxc.exec('c{}'.format(i), 'true')
+                                   for i in range(5)])
+
+        asyncio.run(run(self.aio(runner.run, limit=asyncio.Semaphore(3))))
+
+        self.assertEqual(runner.most, 3)
+
+    def test_push_in_executor(self):
+        runner = Recorder()
+        lxc = self.aio(runner)
+
+        async def run():
+            push = lxc.push(['c1', 'c2'], '/src', '/work')
+            # Nothing has run until it is awaited.
+            self.assertEqual(runner.calls, [])
+            await push
+            await lxc.pull('c1', '/work', '/out')
+
+        asyncio.run(run())
+
+        self.assertEqual([args[0] for args, _ in runner.calls],
+                         ['tar', 'lxc', 'lxc', 'lxc', 'sh'])
+
+    def test_unsupported(self):
+        lxc = self.aio(Recorder())
+
+        with self.assertRaises(NotImplementedError):
+            lxc.exec_stream('c1', 'true')
+        with self.assertRaises(NotImplementedError):
+            lxc.session('c1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Tests for the lxd-pool command (lxd_pool.__main__)."""
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from lxd_pool import __main__ as cli
+from lxd_pool._util.cli import HandlerSpec
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+from lxd_pool.state import ENV
+
+from .fakelxd import FakeLXD
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs "lxd-pool ARGS..." and then prints which modules it imported.
+SCRIPT = """
+import json, runpy, sys
+sys.argv = ['lxd-pool'] + sys.argv[1:]
+try:
+    runpy.run_module('lxd_pool', run_name='__main__', alter_sys=True)
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+# what a quick command shouldn't need
+HEAVY = ['asyncio', 'lxd_pool.daemon', 'lxd_pool.lxd', 'lxd_pool.metrics',
+         'lxd_pool.pool', 'lxd_pool.rest']
+
+
+class MainTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        patcher = mock.patch.dict(os.environ, {
+                ENV: os.path.join(tmpdir, 'state.db')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = FakeLXD(scale=0)
+        lxc = LXC(runner=self.fake, metrics=Registry())
+        patcher = mock.patch.object(cli, '_get_lxc', lambda cliargs: lxc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def main(self, *argv):
+        handler, args, cliargs, showtb = cli.parse_args(
+                ['lxd-pool', '-qqq'] + list(argv))
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            status = cli.main(handler, args, cliargs, showtb=showtb)
+        return status, stdout.getvalue()
+
+    def test_image_add(self):
+        status, out = self.main('image-add', 'images:alpine', '--alias',
+                                'img')
+
+        self.assertFalse(status)
+        self.assertTrue(out.startswith('img '), out)
+
+    def test_image_update(self):
+        self.main('image-add', 'images:alpine', '--alias', 'img')
+
+        status, out = self.main('image-update', 'img')
+
+        self.assertFalse(status)
+        self.assertTrue(out.startswith('img '), out)
+
+    def test_failure(self):
+        self.main('image-add', 'images:alpine', '--alias', 'img')
+
+        status, _ = self.main('image-add', 'images:alpine', '--alias',
+                              'img')
+
+        self.assertEqual(status, 1)
+
+
+class StartupTests(unittest.TestCase):
+
+    def imported(self, *argv):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        env = dict(os.environ, PYTHONPATH=ROOT,
+                   **{ENV: os.path.join(tmpdir, 'state.db')})
+        output = subprocess.check_output(
+                [sys.executable, '-c', SCRIPT] + list(argv), env=env,
+                cwd=tmpdir, stderr=subprocess.DEVNULL)
+        return json.loads(output.splitlines()[-1])
+
+    def test_help(self):
+        imported = self.imported('-h')
+
+        self.assertEqual([name for name in HEAVY if name in imported], [])
+
+    def test_list(self):
+        imported = self.imported('-qqq', 'list')
+
+        self.assertIn('lxd_pool.state', imported)
+        self.assertEqual([name for name in HEAVY if name in imported], [])
+
+    def test_one_parser(self):
+        built = []
+        parser = HandlerSpec.parser
+
+        def record(spec, prog, **kwargs):
+            built.append(spec.name)
+            return parser(spec, prog, **kwargs)
+
+        with mock.patch.object(HandlerSpec, 'parser', record):
+            handler, _, _, _ = cli.parse_args(['lxd-pool', 'list'])
+
+        self.assertEqual(built, ['list'])
+        self.assertEqual(handler.name, 'list')
+
+
+if __name__ == '__main__':
+    unittest.main()
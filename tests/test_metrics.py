@@ -0,0 +1,95 @@
+"""Tests for lxd_pool.metrics."""
+import unittest
+
+from lxd_pool import metrics
+from lxd_pool.metrics import FOLD_AT, Registry
+from lxd_pool.pool import BUSY, IDLE
+
+from .test_pool import new_pool
+
+
+class RenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('t_seconds', 'Time taken.',
+                                            buckets=(1.0, 0.25))
+        for value in (0.125, 0.5, 0.5, 4.0):
+            histogram.observe(value)
+
+        self.assertEqual(self.registry.render(), '\n'.join([
+                '# HELP t_seconds Time taken.',
+                '# TYPE t_seconds histogram',
+                't_seconds_bucket{le="0.25"} 1',
+                't_seconds_bucket{le="1.0"} 3',
+                't_seconds_bucket{le="+Inf"} 4',
+                't_seconds_sum 5.125',
+                't_seconds_count 4',
+                ]) + '\n')
+
+    def test_histogram_labels(self):
+        histogram = self.registry.histogram('t_seconds', 'Time taken.',
+                                            ('pool',), buckets=(1.0,))
+        for _ in range(FOLD_AT + 1):
+            histogram.observe(2.0, pool='ci')
+
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+                't_seconds_bucket{pool="ci",le="1.0"} 0',
+                't_seconds_bucket{pool="ci",le="+Inf"} 1001',
+                't_seconds_sum{pool="ci"} 2002.0',
+                't_seconds_count{pool="ci"} 1001',
+                ])
+
+    def test_escaping(self):
+        counter = self.registry.counter('c_total', 'Things.', ('path',))
+
+        counter.inc(path='a\\b"c\nd')
+        counter.inc(2, path='e')
+
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+                r'c_total{path="a\\b\"c\nd"} 1',
+                'c_total{path="e"} 2',
+                ])
+
+    def test_type_clash(self):
+        self.registry.counter('x', 'X.')
+
+        with self.assertRaises(TypeError):
+            self.registry.gauge('x', 'X.')
+
+
+class CollectTests(unittest.TestCase):
+
+    def test_pool_gauges(self):
+        registry = Registry()
+        pool = new_pool(3)
+        self.addCleanup(pool.close)
+        pool.acquire()
+        registry.add_collector(lambda registry: metrics.collect(
+                registry, pools=[pool]))
+
+        lines = registry.render().splitlines()
+
+        for line in [
+                'lxd_pool_members{{pool="ci",state="{}"}} 2'.format(IDLE),
+                'lxd_pool_members{{pool="ci",state="{}"}} 1'.format(BUSY),
+                'lxd_pool_waiting{pool="ci"} 0',
+                'lxd_pool_target{pool="ci"} 3',
+                ]:
+            self.assertIn(line, lines)
+
+    def test_forgotten_pools(self):
+        registry = Registry()
+        pool = new_pool(1)
+        self.addCleanup(pool.close)
+        metrics.collect(registry, pools=[pool])
+
+        metrics.collect(registry)
+
+        self.assertNotIn('pool="ci"', registry.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
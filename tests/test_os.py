@@ -0,0 +1,186 @@
+"""Tests for lxd_pool._util.os."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from lxd_pool._util import os as _os
+
+
+# Writes a chunk and then waits for the sinks to have read it (so it
+# fails if the output is buffered), and then writes the rest.
+SOURCE = r"""
+import os, sys, time
+out = sys.stdout.buffer
+out.write(b'x' * 1000)
+out.flush()
+deadline = time.monotonic() + 10
+while not os.path.exists(sys.argv[1]):
+    if time.monotonic() > deadline:
+        sys.exit(2)
+    time.sleep(0.01)
+for _ in range(100):
+    out.write(b'y' * 10000)
+out.flush()
+"""
+
+SINK = r"""
+import sys
+data = sys.stdin.buffer.read(1000)
+open(sys.argv[1], 'w').close()
+data += sys.stdin.buffer.read()
+with open(sys.argv[2], 'w') as f:
+    f.write(str(len(data)))
+"""
+
+# Reads a bit and then fails.
+FAILING = r"""
+import sys
+sys.stdin.buffer.read(10)
+sys.exit(3)
+"""
+
+
+class Proc:
+    """A finished process (a la subprocess.Popen) whose output comes in
+    the given chunks."""
+
+    def __init__(self, chunks, returncode=0):
+        self.stdout = Output(chunks)
+        self.returncode = returncode
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+
+    def wait(self):
+        return self.returncode
+
+
+class Output:
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read1(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    read = read1
+
+    def close(self):
+        pass
+
+
+class Streamer:
+    """A runner that can't stream itself (a la rest.RESTRunner)."""
+
+    popen = subprocess.Popen
+
+    def __call__(self, args, **kwargs):
+        raise AssertionError('not streamed: {}'.format(args))
+
+
+class PipeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.marker = os.path.join(self.tmpdir, 'read')
+
+    def source(self):
+        return [sys.executable, '-c', SOURCE, self.marker]
+
+    def sink(self, name):
+        return [sys.executable, '-c', SINK, self.marker,
+                os.path.join(self.tmpdir, name)]
+
+    def received(self, name):
+        with open(os.path.join(self.tmpdir, name)) as f:
+            return int(f.read())
+
+    def test_stream(self):
+        _os.cmd_pipe(self.source(), [self.sink('a'), self.sink('b')])
+
+        self.assertEqual(self.received('a'), 1001000)
+        self.assertEqual(self.received('b'), 1001000)
+
+    def test_runner_with_popen(self):
+        _os.cmd_pipe(self.source(), [self.sink('a')], runner=Streamer())
+
+        self.assertEqual(self.received('a'), 1001000)
+
+    def test_sink_fails(self):
+        failing = [sys.executable, '-c', FAILING]
+
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            _os.cmd_pipe(self.source(), [failing, self.sink('a')])
+
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.cmd, failing)
+        # The other sink still got everything.
+        self.assertEqual(self.received('a'), 1001000)
+
+    def test_buffered(self):
+        calls = []
+
+        def runner(args, **kwargs):
+            calls.append((args, kwargs.get('input')))
+            return b'data'
+
+        _os.cmd_pipe(['tar', 'c'], [['tar', 'x']], runner=runner)
+
+        self.assertEqual(calls, [(['tar', 'c'], None),
+                                 (['tar', 'x'], b'data')])
+
+
+class StreamTests(unittest.TestCase):
+
+    def test_lines(self):
+        proc = Proc([b'a\nb', b'c\r', b'\nd'])
+
+        lines = list(_os.cmd_stream(['cmd'], runner=lambda *a, **k: proc))
+
+        self.assertEqual(lines, ['a\n', 'bc\r\n', 'd'])
+
+    def test_split_character(self):
+        data = 'caf\u00e9 \u2603\n'.encode('utf-8')
+        proc = Proc([data[:4], data[4:7], data[7:]])
+
+        chunks = list(_os.cmd_stream(['cmd'], runner=lambda *a, **k: proc,
+                                     chunksize=4))
+
+        self.assertEqual(''.join(chunks), 'caf\u00e9 \u2603\n')
+        self.assertEqual(chunks[0], 'caf')
+
+    def test_failure(self):
+        stream = _os.cmd_stream(['sh', '-c', 'echo a; exit 3'])
+
+        self.assertEqual(next(stream), 'a\n')
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            next(stream)
+        self.assertEqual(cm.exception.returncode, 3)
+
+    def test_closed_early(self):
+        procs = []
+
+        def runner(args, **kwargs):
+            procs.append(subprocess.Popen(args, **kwargs))
+            return procs[-1]
+
+        stream = _os.cmd_stream(['yes'], runner=runner)
+        self.assertEqual(next(stream), 'y\n')
+        stream.close()
+
+        proc, = procs
+        self.assertEqual(proc.returncode, -9)
+
+    def test_check_output_runner(self):
+        stream = _os.cmd_stream(['cmd'], runner=lambda *a, **k: b'a\nb\n')
+
+        self.assertEqual(list(stream), ['a\n', 'b\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
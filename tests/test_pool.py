@@ -0,0 +1,351 @@
+"""Tests for lxd_pool.pool, against a simulated LXD (see tests.fakelxd)."""
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+from lxd_pool.health import Checker
+from lxd_pool.pool import (BROKEN, BUSY, DELETING, IDLE, Pool,
+                           default_lease)
+from lxd_pool.remotes import split
+from lxd_pool.run import run
+from lxd_pool.state import Store
+
+from .fakelxd import FakeLXD
+
+
+def new_pool(size=2, *, fake=None, store=None, **kwargs):
+    if fake is None:
+        fake = FakeLXD(scale=0)
+    kwargs.setdefault('image', 'img')
+    lxc = LXC(runner=fake, metrics=Registry())
+    pool = Pool('ci', size, lxc=lxc, store=store, **kwargs)
+    pool.create()
+    return pool
+
+
+def dead_lease():
+    """Return a lease held by a process (on this host) that is gone."""
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return '{}:{}'.format(socket.gethostname(), proc.pid)
+
+
+class LoadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        self.first = new_pool(2, fake=self.fake, store=self.store)
+        self.addCleanup(self.first.close)
+
+    def load(self):
+        pool = Pool.load('ci', lxc=self.first.lxc, store=self.store)
+        self.addCleanup(pool.close)
+        return pool
+
+    def states(self):
+        return {member.name: (member.state, member.lease)
+                for member in self.store.members('ci')}
+
+    def test_busy_members_are_left_alone(self):
+        held = self.first.acquire()
+        second = self.load()
+
+        self.assertIn(held, second)
+        self.assertEqual(second.counts()[BUSY], 1)
+        other = second.acquire()
+        self.assertNotEqual(other, held)
+        self.assertIsNone(second.acquire(block=False))
+        self.assertEqual(self.states()[held], (BUSY, default_lease()))
+
+    def test_resetting_members_are_left_alone(self):
+        held = self.first.acquire()
+        self.first.release(held, reset=True)
+        self.first.close()
+        self.store.set_member('ci', held, 'resetting', lease='elsewhere:1')
+        second = self.load()
+
+        self.assertEqual(second.idle, 1)
+        self.assertNotEqual(second.acquire(), held)
+
+    def test_abandoned_members_are_reset(self):
+        held = self.first.acquire()
+        self.store.set_member('ci', held, BUSY, lease=dead_lease())
+        restores = self.fake.count('restore')
+        second = self.load()
+        second.close()  # Wait for the reset.
+
+        self.assertEqual(self.fake.count('restore'), restores + 1)
+        self.assertEqual(second.idle, 2)
+        self.assertEqual(self.states()[held], (IDLE, None))
+
+    def test_idle_members_claimed_once(self):
+        # Two processes with the pool loaded, going for the same idle
+        # members.
+        self.first.close()
+        a = self.load()
+        b = self.load()
+
+        first = a.acquire(lease='proc-a')
+        second = b.acquire(lease='proc-b')
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.states(), {first: (BUSY, 'proc-a'),
+                                         second: (BUSY, 'proc-b')})
+        # Each left the other's to them.
+        self.assertIsNone(a.acquire(lease='proc-a', block=False))
+        self.assertEqual(a.counts()[BUSY], 2)
+        self.assertEqual(b.counts()[BUSY], 2)
+        self.assertEqual(self.states()[second], (BUSY, 'proc-b'))
+
+        # ... until it is released.
+        b.release(second)
+        self.assertEqual(a.acquire(lease='proc-a', block=False), second)
+
+
+class ShrinkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0.1)
+
+    def new_pool(self, **kwargs):
+        pool = new_pool(2, fake=self.fake, maxsize=4, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_no_launches_under_sustained_load(self):
+        pool = self.new_pool()
+        # Warm up (to maxsize).
+        list(run(pool, 'true', 8))
+        copies = self.fake.count('copy')
+
+        results = list(run(pool, 'true', 40))
+
+        self.assertEqual(len(results), 40)
+        self.assertEqual(self.fake.count('copy'), copies)
+        self.assertEqual(self.fake.count('delete'), 0)
+        self.assertEqual(len(pool), 4)
+
+    def test_surplus_goes_once_idle(self):
+        pool = self.new_pool(linger=0.05)
+        held = [pool.acquire() for _ in range(4)]
+        for container in held:
+            pool.release(container)
+        self.assertEqual(len(pool), 4)
+
+        time.sleep(0.1)
+        pool.release(pool.acquire())
+
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(self.fake.count('delete'), 2)
+
+
+class RemoteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        self.pool = new_pool(4, fake=self.fake, store=self.store,
+                             remotes=['a=2', 'b=2', 'c=2'])
+        self.addCleanup(self.pool.close)
+
+    def on(self, remote):
+        return sorted(name for name in self.fake.containers
+                      if split(name)[0] == remote
+                      and not name.endswith('-golden'))
+
+    def members(self, remote):
+        return sorted(member.name for member in self.store.members('ci')
+                      if split(member.name)[0] == remote)
+
+    def test_acquire_spreads_over_remotes(self):
+        pool = new_pool(6, fake=self.fake, remotes=['a=2', 'b=2', 'c=2'])
+        self.addCleanup(pool.close)
+
+        held = [pool.acquire() for _ in range(3)]
+
+        self.assertEqual(sorted(split(c)[0] for c in held), ['a', 'b', 'c'])
+        pool.release(held[0])
+        self.assertEqual(split(pool.acquire())[0], split(held[0])[0])
+
+    def test_drain_and_recover_unreachable(self):
+        left = self.on('a')
+        self.assertTrue(left)
+        self.fake.unreachable.add('a')
+
+        self.assertEqual(self.pool.check_remotes(), ['a'])
+        self.pool.close()  # Wait for the replacements.
+
+        self.assertEqual(self.pool.counts()[DELETING], len(left))
+        self.assertEqual(self.members('a'), left)
+        self.assertEqual(len(self.pool), 4)
+        self.assertFalse(any(split(c)[0] == 'a' for c in self.pool.broken))
+        # Reconciling doesn't adopt them.
+        self.pool.reconcile()
+        self.assertEqual(self.pool.counts()[IDLE], 4)
+
+        self.fake.unreachable.clear()
+        self.pool.check_remotes(recover=2)
+
+        self.assertEqual(self.on('a'), [])
+        self.assertEqual(self.members('a'), [])
+        self.assertNotIn(DELETING, self.pool.counts())
+        self.assertEqual(self.pool.drained, ['a'])
+        self.pool.check_remotes(recover=2)
+        self.assertEqual(self.pool.drained, [])
+
+    def test_pending_deletes_are_loaded(self):
+        self.fake.unreachable.add('a')
+        self.pool.check_remotes()
+        self.pool.close()
+        loaded = Pool.load('ci', lxc=self.pool.lxc, store=self.store)
+        self.addCleanup(loaded.close)
+
+        self.assertEqual(loaded.counts().get(DELETING), 2)
+        self.fake.unreachable.clear()
+        loaded.reconcile()
+        self.assertEqual(self.on('a'), [])
+        self.assertNotIn(DELETING, loaded.counts())
+
+    def test_slow_remote_drained(self):
+        self.fake.slow['b'] = 0.2
+
+        self.assertEqual(self.pool.check_remotes(maxlatency=0.1), ['b'])
+        self.pool.close()
+
+        self.assertEqual(self.on('b'), [])
+        self.assertEqual(len(self.pool), 4)
+
+
+class HealthTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        self.pool = new_pool(3, fake=self.fake, store=self.store)
+        self.addCleanup(self.pool.close)
+
+    def test_quarantine(self):
+        container = self.pool.acquire()
+        self.pool.release(container)
+        self.fake.broken.add(container)
+
+        broken = self.pool.check_health(['exec'], batch=None, rate=None)
+        self.pool.close()  # Wait for the replacement.
+
+        self.assertEqual(broken, [container])
+        self.assertIn(container, self.pool.broken)
+        self.assertEqual(self.pool.idle, 3)
+        member, = self.store.members('ci', BROKEN)
+        self.assertEqual(member.name, container)
+        self.assertIn('broken', member.note)
+        # It is never handed out again.
+        held = [self.pool.acquire() for _ in range(3)]
+        self.assertNotIn(container, held)
+
+    def test_busy_members_are_not_probed(self):
+        container = self.pool.acquire()
+        self.fake.broken.add(container)
+
+        self.assertEqual(self.pool.check_health(['exec'], batch=None,
+                                                rate=None), [])
+        self.assertEqual(self.pool.broken, {})
+
+    def test_checker(self):
+        self.fake.broken.update(self.fake.containers)
+        checker = Checker(self.pool, probes=['exec'], interval=0.01,
+                          batch=1, rate=None)
+
+        with checker:
+            for _ in range(500):
+                if len(self.pool.broken) >= 2:
+                    break
+                checker._stop.wait(0.01)
+
+        self.assertGreaterEqual(len(self.pool.broken), 2)
+
+
+class AffinityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLXD(scale=0)
+        self.store = Store(':memory:')
+        self.pool = new_pool(3, fake=self.fake, store=self.store)
+        self.addCleanup(self.pool.close)
+
+    def warm(self, key):
+        container = self.pool.acquire(key=key)
+        self.pool.release(container, key=key)
+        return container
+
+    def test_warm_container_preferred(self):
+        warm = self.warm('A')
+        # Others were idle longer.
+        restores = self.fake.count('restore')
+
+        self.assertEqual(self.pool.acquire(key='A'), warm)
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 1))
+        self.assertEqual(self.fake.count('restore'), restores)
+
+    def test_clean_container_preferred_without_a_match(self):
+        warm = self.warm('A')
+
+        held = [self.pool.acquire(key='B'), self.pool.acquire()]
+
+        self.assertNotIn(warm, held)
+        self.assertEqual(self.pool.misses, 2)
+
+    def test_warm_container_reset_for_another_key(self):
+        warm = self.warm('A')
+        others = [self.pool.acquire() for _ in range(2)]
+        restores = self.fake.count('restore')
+
+        self.assertEqual(self.pool.acquire(key='B'), warm)
+        self.assertEqual(self.fake.count('restore'), restores + 1)
+        self.assertNotIn(warm, others)
+
+    def test_reset_container_is_clean(self):
+        warm = self.warm('A')
+        self.pool.release(self.pool.acquire(key='A'), reset=True)
+        restores = self.fake.count('restore')
+
+        held = [self.pool.acquire(key='B') for _ in range(3)]
+
+        self.assertIn(warm, held)
+        self.assertEqual(self.fake.count('restore'), restores)
+
+    def test_affinity_is_loaded(self):
+        warm = self.warm('A')
+        self.pool.close()
+        loaded = Pool.load('ci', lxc=self.pool.lxc, store=self.store)
+        self.addCleanup(loaded.close)
+
+        self.assertNotEqual(loaded.acquire(key='B'), warm)
+        self.assertEqual(loaded.acquire(key='A'), warm)
+
+
+class TenantTests(unittest.TestCase):
+
+    def test_failed_reset_releases_the_hold(self):
+        fake = FakeLXD(scale=0)
+        pool = new_pool(1, fake=fake, maxsize=2, tenants=['t:1'])
+        self.addCleanup(pool.close)
+        container = pool.acquire(tenant='t', key='A')
+        pool.release(container, key='A')
+        # The warm container has to be reset before it is handed out
+        # again, which fails.
+        fake.containers[container]['snapshots'].clear()
+        with self.assertRaises(subprocess.CalledProcessError):
+            pool.acquire(tenant='t')
+        pool.close()  # Wait for the replacement.
+
+        self.assertEqual(pool.queue()['t']['held'], 0)
+        self.assertIsNotNone(pool.acquire(tenant='t', block=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests for lxd_pool.replenish."""
+import unittest
+
+from lxd_pool.replenish import Replenisher
+
+from .test_pool import new_pool
+
+
+class TickTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = new_pool(2, maxsize=10)
+        self.addCleanup(self.pool.close)
+        # as if launches take 2 seconds
+        self.pool._launchtime = 2.0
+        self.replenisher = Replenisher(self.pool, weight=1.0, hold=30)
+
+    def burst(self, count):
+        for _ in range(count):
+            self.pool.release(self.pool.acquire())
+
+    def test_grow_ahead_of_a_burst(self):
+        self.assertEqual(self.replenisher.tick(now=0), 2)
+        self.burst(4)
+
+        # 4 acquires/s, over the 2 seconds a launch takes
+        self.assertEqual(self.replenisher.tick(now=1), 8)
+        self.assertEqual(len(self.pool), 8)
+        self.assertEqual(self.pool.busy, 0)
+
+    def test_maxsize(self):
+        self.replenisher.tick(now=0)
+        self.burst(20)
+
+        self.assertEqual(self.replenisher.tick(now=1), 10)
+        self.assertEqual(len(self.pool), 10)
+
+    def test_hold_then_shrink(self):
+        self.replenisher.tick(now=0)
+        self.burst(4)
+        self.replenisher.tick(now=1)
+
+        # The load dropped, but not for long enough.
+        self.assertEqual(self.replenisher.tick(now=2), 8)
+        self.assertEqual(self.replenisher.tick(now=30), 8)
+        self.assertEqual(len(self.pool), 8)
+
+        self.assertEqual(self.replenisher.tick(now=32), 2)
+        self.assertEqual(self.pool.target, 2)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_busy(self):
+        held = [self.pool.acquire() for _ in range(4)]
+
+        # There is no rate yet, so only what is in use counts.
+        self.assertEqual(self.replenisher.tick(now=0), 4)
+        for container in held:
+            self.pool.release(container)
+        self.assertEqual(len(self.pool), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
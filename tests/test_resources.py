@@ -0,0 +1,144 @@
+"""Tests for lxd_pool.resources (and pools with an admission)."""
+import threading
+import time
+import unittest
+
+from lxd_pool.pool import PoolTimeoutError
+from lxd_pool.resources import Admission, HostUsage
+
+from .fakelxd import FakeLXD
+from .test_pool import new_pool
+
+
+GiB = 1024 ** 3
+
+
+class Host:
+    """A host whose usage the tests set."""
+
+    def __init__(self, available=5 * GiB, load=0.5):
+        self.usage = HostUsage(10 * GiB, available, load, 4)
+
+    def __call__(self):
+        return self.usage
+
+    def set(self, available=None, load=None):
+        usage = self.usage
+        self.usage = HostUsage(
+                usage.total,
+                usage.available if available is None else available,
+                usage.load if load is None else load,
+                usage.cpus)
+
+
+class AdmissionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Host()
+        self.admission = Admission(reserve=0.1, maxload=1.0, ttl=60,
+                                   read=self.host)
+
+    def test_memory(self):
+        # 5G available, less 1G reserved, is room for 4.
+        self.assertEqual(self.admission.room({'memory': GiB}), 4)
+        self.assertIsNone(self.admission.admit({'memory': GiB}, count=4))
+
+        problem = self.admission.admit({'memory': GiB})
+
+        self.assertEqual(problem, 'only 1024 MiB of memory available')
+        self.assertEqual(self.admission.room({'memory': GiB}), 0)
+
+    def test_load(self):
+        self.host.set(load=4.0)
+
+        problem = self.admission.admit({'memory': GiB})
+
+        self.assertEqual(problem, 'load 1.00 per CPU (max 1.0)')
+        self.assertEqual(self.admission.room(), 0)
+
+    def test_reading_reused(self):
+        self.admission.admit({'memory': GiB})
+        self.host.set(available=GiB)
+
+        self.assertEqual(self.admission.room({'memory': GiB}), 3)
+        self.admission.forget()
+        self.assertEqual(self.admission.room({'memory': GiB}), 0)
+
+
+class PoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Host()
+        self.admission = Admission(reserve=0.1, ttl=0, read=self.host)
+        self.pool = new_pool(2, fake=FakeLXD(scale=0), maxsize=10,
+                             limits={'memory': '1G'},
+                             admission=self.admission)
+        self.addCleanup(self.pool.close)
+
+    def test_refused(self):
+        self.host.set(available=1.5 * GiB)
+
+        self.assertIsNone(self.pool.acquire(block=False))
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.acquire(timeout=0.1)
+        self.assertEqual(self.pool.busy, 0)
+
+    def test_overloaded(self):
+        self.host.set(load=8.0)
+
+        self.assertIsNone(self.pool.acquire(block=False))
+
+    def test_admitted_once_there_is_room(self):
+        self.host.set(available=1.5 * GiB)
+        timer = threading.Timer(0.2, self.host.set, (5 * GiB,))
+        timer.start()
+        self.addCleanup(timer.join)
+
+        start = time.monotonic()
+        container = self.pool.acquire(timeout=10)
+
+        self.assertIsNotNone(container)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_served_in_order(self):
+        self.admission.ttl = 60
+        self.host.set(available=1.5 * GiB)
+        self.admission.forget()
+        served = []
+
+        def acquire(priority):
+            self.pool.acquire(timeout=10, priority=priority)
+            served.append(priority)
+
+        threads = []
+        for priority in [0, 1]:
+            thread = threading.Thread(target=acquire, args=(priority,))
+            thread.start()
+            self.addCleanup(thread.join)
+            threads.append(thread)
+            deadline = time.monotonic() + 5
+            while self.pool.waiting <= priority:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        # Room for one.
+        self.host.set(available=2.5 * GiB)
+        self.admission.forget()
+        threads[1].join(5)
+
+        self.assertEqual(served, [1])
+        self.host.set(available=5 * GiB)
+        self.admission.forget()
+        threads[0].join(5)
+        self.assertEqual(served, [1, 0])
+
+    def test_growth_limited(self):
+        # Room for 2 more.
+        self.host.set(available=3.5 * GiB)
+
+        self.pool.update(size=6)
+
+        self.assertEqual(len(self.pool), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""Tests for lxd_pool.rest, against a simulated LXD (see tests.fakerest)."""
+import os.path
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+from lxd_pool.rest import Client, LXDError, RESTRunner
+
+from .fakerest import FakeLXDServer
+
+
+def _fallback(args, **kwargs):
+    raise AssertionError('fell back to the CLI for {}'.format(args))
+
+
+class RESTTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.server = FakeLXDServer(os.path.join(tmpdir.name, 'unix.socket'))
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.client = Client(self.server.path, timeout=2)
+        self.addCleanup(self.client.close)
+        self.runner = RESTRunner(self.client, fallback=_fallback)
+
+    def lxc(self, *args):
+        return self.runner(('lxc',) + args, stderr=subprocess.STDOUT)
+
+    def test_sync(self):
+        self.server.containers['c1'] = {'status': 'Running', 'config': {}}
+        self.server.containers['c2'] = {'status': 'Stopped', 'config': {}}
+
+        output = self.lxc('list', '--format', 'csv', '-c', 'ns')
+
+        self.assertEqual(output, b'c1,RUNNING\nc2,STOPPED\n')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_async(self):
+        self.lxc('launch', 'img', 'c1')
+
+        self.assertEqual(self.server.containers['c1']['status'], 'Running')
+        self.assertEqual(self.server.containers['c1']['source'],
+                         {'type': 'image', 'alias': 'img'})
+
+    def test_launch_fingerprint(self):
+        fingerprint = 'a0' * 32
+        self.lxc('launch', 'local:' + fingerprint, 'c1')
+
+        self.assertEqual(self.server.containers['c1']['source'],
+                         {'type': 'image', 'fingerprint': fingerprint})
+
+    def test_wait_longer_than_the_timeout(self):
+        self.lxc('launch', 'img', 'c1')
+        self.server.delay = 3  # longer than the client's timeout
+
+        start = time.monotonic()
+        output = self.lxc('exec', 'c1', '--', 'sleep', '3')
+
+        self.assertGreaterEqual(time.monotonic() - start, 3)
+        self.assertEqual(output, b'sleep 3')
+        polls = [path for method, path in self.server.requests
+                 if path.endswith('/wait?timeout=1')]
+        self.assertGreater(len(polls), 1)
+
+    def test_wait_timeout(self):
+        self.server.delay = 3
+        resp = self.client.request('POST', '/1.0/containers',
+                                   {'name': 'c1', 'source': {}})
+
+        with self.assertRaises(LXDError):
+            self.client.wait(resp['operation'], timeout=1)
+
+    def test_failing_exec(self):
+        self.lxc('launch', 'img', 'c1')
+
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            self.lxc('exec', 'c1', '--', 'fail')
+
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.output, b'fail')
+
+    def test_failing_operation(self):
+        self.lxc('launch', 'img', 'c1')
+
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            self.lxc('restore', 'c1', 'missing')
+
+        self.assertIn(b'no such snapshot', cm.exception.output)
+
+    def test_dropped_get_is_retried(self):
+        self.server.containers['c1'] = {'status': 'Running', 'config': {}}
+        self.server.drop = 1
+
+        output = self.lxc('config', 'get', 'c1', 'user.x')
+
+        self.assertEqual(output, b'')
+        self.assertEqual(self.server.requests,
+                         [('GET', '/1.0/containers/c1')] * 2)
+
+    def test_dropped_post_is_not_retried(self):
+        self.lxc('launch', 'img', 'c1')
+        self.server.drop = 1
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.lxc('exec', 'c1', '--', 'true')
+
+        execs = [path for method, path in self.server.requests
+                 if method == 'POST' and path.endswith('/exec')]
+        self.assertEqual(len(execs), 1)
+
+    def test_closed_keep_alive(self):
+        self.lxc('launch', 'img', 'c1')
+        # The server went away between requests (e.g. LXD restarted).
+        self.client._local.conn.sock.shutdown(socket.SHUT_WR)
+        self.lxc('exec', 'c1', '--', 'true')
+
+        execs = [path for method, path in self.server.requests
+                 if method == 'POST' and path.endswith('/exec')]
+        self.assertEqual(len(execs), 1)
+
+    def test_lost_lxd(self):
+        client = Client(self.server.path + '.gone', timeout=2)
+        runner = RESTRunner(client, fallback=_fallback)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            runner(['lxc', 'list', '--format', 'csv'],
+                   stderr=subprocess.STDOUT)
+
+    def test_streams_with_popen(self):
+        # e.g. the local tar and the lxc exec ends of "lxd-pool push"
+        self.assertIs(RESTRunner(self.client).popen, subprocess.Popen)
+        self.assertIsNone(self.runner.popen)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for lxd_pool.run, against a simulated LXD (see tests.fakelxd)."""
+import threading
+import time
+import unittest
+
+from lxd_pool.run import INDEX_ENV, run
+
+from .fakelxd import FakeLXD
+from .test_pool import new_pool
+
+
+class UnevenLXD(FakeLXD):
+    """A FakeLXD where each invocation's exec takes its own time.
+
+    The threads they ran in are recorded, along with the most that ran
+    at once.
+    """
+
+    def __init__(self, delays):
+        super().__init__(scale=0)
+        self.execdelays = delays
+        self.running = 0
+        self.most = 0
+        self.threads = set()
+        self._runlock = threading.Lock()
+
+    def __call__(self, args, **kwargs):
+        prefix = '{}='.format(INDEX_ENV)
+        index = [arg for arg in args if arg.startswith(prefix)]
+        if args[1] != 'exec' or not index:
+            return super().__call__(args, **kwargs)
+        with self._runlock:
+            self.running += 1
+            self.threads.add(threading.get_ident())
+            self.most = max(self.most, self.running)
+        try:
+            time.sleep(self.execdelays.get(int(index[0][len(prefix):]), 0))
+            return super().__call__(args, **kwargs)
+        finally:
+            with self._runlock:
+                self.running -= 1
+
+
+class RunTests(unittest.TestCase):
+
+    def pool(self, delays, size, **kwargs):
+        self.fake = UnevenLXD(delays)
+        pool = new_pool(size, fake=self.fake, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_workers_capped_by_pool_size(self):
+        pool = self.pool({index: 0.02 for index in range(12)}, 2, maxsize=3)
+
+        results = list(run(pool, 'true', 12))
+
+        self.assertEqual(sorted(result.index for result in results),
+                         list(range(12)))
+        self.assertEqual(len(self.fake.threads), 3)
+        self.assertEqual(self.fake.most, 3)
+        self.assertEqual(len(pool), 3)
+
+    def test_maxworkers(self):
+        pool = self.pool({index: 0.02 for index in range(6)}, 4)
+
+        list(run(pool, 'true', 6, maxworkers=2))
+
+        self.assertEqual(len(self.fake.threads), 2)
+        self.assertEqual(self.fake.most, 2)
+
+    def test_completion_order(self):
+        pool = self.pool({0: 0.3, 1: 0.0, 2: 0.1}, 3)
+
+        results = list(run(pool, 'true', 3))
+
+        self.assertEqual([result.index for result in results], [1, 2, 0])
+        self.assertFalse(any(result.failed for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Tests for lxd_pool.session, with a stand-in for the lxc CLI."""
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from lxd_pool.lxd import LXC
+from lxd_pool.metrics import Registry
+from lxd_pool.run import run
+from lxd_pool.session import DEAD
+
+from .test_pool import new_pool
+
+
+# Runs the command of "lxc exec NAME ... -- COMMAND" locally, and logs
+# each invocation.
+FAKE_LXC = """#!/bin/sh
+echo "$*" >> "$0.log"
+[ "$1" = exec ] || exit 1
+while [ $# -gt 0 ] && [ "$1" != -- ]; do shift; done
+shift
+exec "$@"
+"""
+
+
+class SessionTests(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.executable = os.path.join(tmpdir, 'lxc')
+        with open(self.executable, 'w') as f:
+            f.write(FAKE_LXC)
+        os.chmod(self.executable, stat.S_IRWXU)
+        self.lxc = LXC(executable=self.executable, metrics=Registry())
+
+    def session(self):
+        session = self.lxc.session('c1')
+        self.addCleanup(session.close)
+        return session
+
+    def invocations(self):
+        if not os.path.exists(self.executable + '.log'):
+            return []
+        with open(self.executable + '.log') as f:
+            return f.read().splitlines()
+
+    def test_exit_status(self):
+        session = self.session()
+
+        self.assertEqual(session.exec('echo hi'), 'hi')
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            session.exec('echo oops; exit 3')
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.output, b'oops\n')
+        self.assertEqual(session.exec('echo again'), 'again')
+        self.assertEqual(self.invocations(), ['exec c1 -- sh'])
+
+    def test_no_trailing_newline(self):
+        session = self.session()
+
+        lines = list(session.exec_stream('printf "a\\nb"'))
+
+        self.assertEqual(lines, ['a\n', 'b'])
+        self.assertEqual(list(session.exec_stream('printf ""')), [])
+
+    def test_env(self):
+        session = self.session()
+
+        output = session.exec('echo "$A $B"', env={'A': 1, 'B': 'x y'})
+
+        self.assertEqual(output, '1 x y')
+
+    def test_closed_early(self):
+        session = self.session()
+        stream = session.exec_stream('while :; do echo y; done')
+
+        self.assertEqual(next(stream), 'y\n')
+        proc = session._proc
+        stream.close()
+
+        self.assertIsNotNone(proc.poll())
+        self.assertIsNone(session._proc)
+        # The next command gets a new shell (without the leftovers).
+        self.assertEqual(session.exec('echo hi'), 'hi')
+        self.assertEqual(len(self.invocations()), 2)
+
+    def test_dead(self):
+        session = self.session()
+
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            session.exec('kill -9 $PPID')
+
+        self.assertEqual(cm.exception.returncode, DEAD)
+        self.assertIsNone(session._proc)
+        self.assertEqual(session.exec('echo hi'), 'hi')
+
+    def test_run_batch(self):
+        pool = new_pool(2)
+        self.addCleanup(pool.close)
+        # The commands go to the stand-in (but the pool's own operations
+        # went to the FakeLXD).
+        pool.lxc.runner = None
+        pool.lxc.executable = self.executable
+
+        results = list(run(pool, 'echo $LXD_POOL_INDEX', 6, batch=3))
+
+        self.assertEqual(sorted(int(result.output) for result in results),
+                         list(range(6)))
+        # one session per batch (i.e. per container)
+        invocations = self.invocations()
+        self.assertEqual(len(invocations), 2)
+        self.assertEqual({result.container for result in results},
+                         {invocation.split()[1]
+                          for invocation in invocations})
+
+
+if __name__ == '__main__':
+    unittest.main()
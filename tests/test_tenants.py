@@ -0,0 +1,145 @@
+"""Tests for lxd_pool.tenants."""
+import unittest
+
+from lxd_pool.tenants import FairQueue, normalize, parse
+
+
+class Waiter:
+
+    def __init__(self, tenant, priority=0):
+        self.tenant = tenant
+        self.priority = priority
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.tenant,
+                                       self.priority)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse('nightly=0.5:20'),
+                         ('nightly', {'weight': 0.5, 'cap': 20}))
+        self.assertEqual(parse('ci'), ('ci', {'weight': 1.0, 'cap': None}))
+        with self.assertRaises(ValueError):
+            parse('ci=0')
+
+    def test_normalize(self):
+        self.assertIsNone(normalize(None))
+        self.assertEqual(normalize({'a': 2, 'b': {'cap': 1}}),
+                         {'a': {'weight': 2, 'cap': None},
+                          'b': {'weight': 1.0, 'cap': 1}})
+
+
+class FairQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def queue(self, tenants=None, **kwargs):
+        return FairQueue(tenants, clock=self.clock, **kwargs)
+
+    def push(self, queue, tenant, count=1, priority=0):
+        waiters = [Waiter(tenant, priority) for _ in range(count)]
+        for waiter in waiters:
+            queue.push(waiter)
+        return waiters
+
+    def serve(self, queue, count):
+        served = []
+        for _ in range(count):
+            waiter = queue.pop()
+            if waiter is None:
+                break
+            served.append(waiter.tenant)
+        return served
+
+    def test_weighted_shares(self):
+        queue = self.queue({'a': 3, 'b': 1})
+        self.push(queue, 'a', 30)
+        self.push(queue, 'b', 30)
+
+        served = self.serve(queue, 20)
+
+        self.assertEqual(served.count('a'), 15)
+        self.assertEqual(served.count('b'), 5)
+
+    def test_shares_regardless_of_queued(self):
+        # A tenant with a flood of waiters doesn't crowd out the others.
+        queue = self.queue()
+        self.push(queue, 'nightly', 100)
+        self.push(queue, 'ci', 2)
+
+        served = self.serve(queue, 4)
+
+        self.assertEqual(served.count('ci'), 2)
+
+    def test_cap(self):
+        queue = self.queue({'a': {'cap': 2}})
+        self.push(queue, 'a', 5)
+        queue.take('a')
+        queue.take('a')
+
+        self.assertIsNone(queue.pop())
+        self.push(queue, 'b')
+        self.assertEqual(self.serve(queue, 5), ['b'])
+
+        queue.give('a')
+        waiter = queue.pop()
+        queue.take(waiter.tenant)
+        self.assertEqual(waiter.tenant, 'a')
+        self.assertIsNone(queue.pop())
+        self.assertEqual(queue.stats()['a']['held'], 2)
+        self.assertEqual(queue.depth(), {'a': 4})
+
+    def test_priority(self):
+        queue = self.queue(aging=None)
+        self.push(queue, 'a', 3)
+        self.push(queue, 'b', 1, priority=1)
+
+        self.assertEqual(self.serve(queue, 2), ['b', 'a'])
+
+    def test_aging(self):
+        queue = self.queue(aging=10)
+        self.push(queue, 'a')
+        self.clock.now = 25
+        self.push(queue, 'b', priority=2)
+
+        # "a" has gained 2 levels while waiting, and came first.
+        self.assertEqual(self.serve(queue, 2), ['a', 'b'])
+
+    def test_remove_rolls_back_the_finish(self):
+        queue = self.queue()
+        waiters = self.push(queue, 'a', 10)
+        self.push(queue, 'b')
+        # All of "a"'s waiters time out.
+        for waiter in waiters:
+            queue.remove(waiter)
+        late = self.push(queue, 'a')[0]
+
+        self.assertEqual(late.finish, 1.0)
+        self.push(queue, 'b')
+        # ... rather than after every waiter of "b"
+        self.assertEqual(self.serve(queue, 3), ['b', 'a', 'b'])
+
+    def test_remove_the_last_waiter(self):
+        queue = self.queue()
+        first, last = self.push(queue, 'a', 2)
+
+        queue.remove(last)
+
+        self.assertEqual(self.push(queue, 'a')[0].finish, 2.0)
+        self.assertEqual(len(queue), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for lxd_pool._util.threads."""
+import threading
+import unittest
+
+from lxd_pool._util.threads import PeriodicWorker
+
+
+class Counter(PeriodicWorker):
+
+    def __init__(self, *, fail=0):
+        super().__init__(0.001, name='counter')
+        self.ticks = 0
+        self.fail = fail
+        self.failures = []
+        self.done = threading.Event()
+
+    def tick(self):
+        self.ticks += 1
+        if self.ticks <= self.fail:
+            raise RuntimeError(self.ticks)
+        if self.ticks >= 3:
+            self.done.set()
+
+    def _failed(self, exc):
+        self.failures.append(exc.args[0])
+
+
+class PeriodicWorkerTests(unittest.TestCase):
+
+    def test_ticks_until_stopped(self):
+        with Counter() as worker:
+            self.assertTrue(worker.done.wait(5))
+            self.assertEqual(worker._thread.name, 'counter')
+        ticks = worker.ticks
+        worker.done.wait(0.01)
+
+        self.assertIsNone(worker._thread)
+        self.assertEqual(worker.ticks, ticks)
+
+    def test_failures_dont_stop_it(self):
+        with Counter(fail=2) as worker:
+            self.assertTrue(worker.done.wait(5))
+
+        self.assertEqual(worker.failures, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()